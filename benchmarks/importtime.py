@@ -0,0 +1,167 @@
+"""Import-time benchmark for the public curricula modules.
+
+Each module is imported in a fresh interpreter with `-X importtime` and
+the cumulative time of the module itself is recorded. The best of
+several runs is kept to smooth out noise. Results can be written as
+JSON for comparison between commits, and `--check` exits with a
+non-zero status if any module exceeds its budget or pulls in a module
+that should only be loaded on demand.
+
+    python benchmarks/importtime.py --check --output importtime.json
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+root = Path(__file__).absolute().parent.parent
+
+# Cumulative import budget in microseconds per module, loose enough to
+# absorb machine noise but tight enough to catch an eager heavy import
+BUDGETS = {
+    "curricula.log": 45_000,
+    "curricula.models": 65_000,
+    "curricula.gradebook": 65_000,
+    "curricula.structure": 35_000,
+    "curricula.packaging": 90_000,
+    "curricula.watch": 65_000,
+    "curricula.server": 120_000,
+    "curricula.shell": 60_000,
+    "curricula.shell.plugin": 60_000,
+    "curricula.library.buildcache": 100_000,
+    "curricula.library.callgrind": 95_000,
+    "curricula.library.compare": 65_000,
+    "curricula.library.configurable": 25_000,
+    "curricula.library.debug": 5_000,
+    "curricula.library.distributed": 115_000,
+    "curricula.library.files": 30_000,
+    "curricula.library.importance": 35_000,
+    "curricula.library.inject": 25_000,
+    "curricula.library.launcher": 50_000,
+    "curricula.library.metrics": 35_000,
+    "curricula.library.printer": 20_000,
+    "curricula.library.process": 85_000,
+    "curricula.library.affinity": 35_000,
+    "curricula.library.journal": 70_000,
+    "curricula.library.multiplex": 100_000,
+    "curricula.library.profile": 60_000,
+    "curricula.library.resultindex": 90_000,
+    "curricula.library.runcache": 55_000,
+    "curricula.library.schedule": 110_000,
+    "curricula.library.serialization": 45_000,
+    "curricula.library.singleton": 5_000,
+    "curricula.library.template": 55_000,
+    "curricula.library.tracing": 35_000,
+    "curricula.library.utility": 40_000,
+    "curricula.library.valgrind": 95_000,
+    "curricula.library.workspace": 75_000,
+}
+
+# Modules that must only be imported when their feature is used
+DEFERRED = (
+    "jinja2",
+    "xml.etree.ElementTree",
+    "distutils",
+    "tracemalloc",
+    "numpy",
+    "curricula_grade",
+    "curricula_compile",
+)
+
+
+def parse_importtime(output: str) -> Dict[str, Tuple[int, int]]:
+    """Map imported module names to their self and cumulative times."""
+
+    times = {}
+    for line in output.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:"):].split("|")
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue
+        times[fields[2].strip()] = (int(fields[0]), int(fields[1]))
+    return times
+
+
+def measure(module_name: str) -> Dict[str, Tuple[int, int]]:
+    """Import the module in a clean interpreter and collect timings."""
+
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, (str(root), env.get("PYTHONPATH"))))
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    process = subprocess.run(
+        (sys.executable, "-X", "importtime", "-c", f"import {module_name}"),
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        cwd=str(root),
+        env=env)
+    if process.returncode != 0:
+        raise RuntimeError(f"failed to import {module_name}:\n{process.stderr.decode()}")
+    return parse_importtime(process.stderr.decode())
+
+
+def benchmark(module_names: List[str], repeat: int) -> Dict[str, dict]:
+    """Record the best cumulative time over several runs."""
+
+    results = {}
+    for module_name in module_names:
+        best = None
+        imported = set()
+        for _ in range(repeat):
+            times = measure(module_name)
+            imported.update(times)
+            if best is None or times[module_name][1] < best[1]:
+                best = times[module_name]
+        results[module_name] = dict(
+            self_us=best[0],
+            cumulative_us=best[1],
+            budget_us=BUDGETS.get(module_name),
+            deferred=sorted(name for name in imported if name in DEFERRED))
+    return results
+
+
+def check(results: Dict[str, dict]) -> List[str]:
+    """List every budget violation."""
+
+    failures = []
+    for module_name, result in results.items():
+        if result["budget_us"] is not None and result["cumulative_us"] > result["budget_us"]:
+            failures.append(f"{module_name} took {result['cumulative_us']}us, budget is {result['budget_us']}us")
+        for name in result["deferred"]:
+            failures.append(f"{module_name} eagerly imports {name}")
+    return failures
+
+
+def main() -> int:
+    """Run the benchmark from the command line."""
+
+    parser = argparse.ArgumentParser(description="Measure import time of curricula modules")
+    parser.add_argument("modules", nargs="*", default=list(BUDGETS))
+    parser.add_argument("-r", "--repeat", type=int, default=5)
+    parser.add_argument("-o", "--output", default=None, help="write results as JSON")
+    parser.add_argument("--check", action="store_true", help="fail if a budget is exceeded")
+    args = parser.parse_args()
+
+    results = benchmark(args.modules, args.repeat)
+    for module_name, result in results.items():
+        budget = f"{result['budget_us']:>8}" if result["budget_us"] is not None else " " * 8
+        print(f"{result['self_us']:>8} {result['cumulative_us']:>8} {budget}  {module_name}")
+
+    if args.output is not None:
+        with open(args.output, "w") as file:
+            json.dump(dict(python=sys.version, results=results), file, indent=2)
+
+    if args.check:
+        failures = check(results)
+        for failure in failures:
+            print(f"FAIL: {failure}", file=sys.stderr)
+        return 1 if failures else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,380 @@
+"""Benchmark suite for the hot paths of the curricula library.
+
+Workloads are tiny local programs compiled from benchmarks/workloads
+with the system C compiler, falling back to equivalent shell scripts,
+so the suite runs offline. Each benchmark reports the best, median and
+mean time of several repeats. Results are written as JSON and can be
+compared against a previous run to spot regressions between commits.
+
+    python benchmarks/library.py -o after.json --compare before.json
+"""
+
+import argparse
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import timeit
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+root = Path(__file__).absolute().parent
+sys.path.insert(0, str(root.parent))
+
+from curricula.library import callgrind, launcher, process, serialization, valgrind  # noqa: E402
+from curricula.models import Assignment  # noqa: E402
+
+WORKLOADS = root.joinpath("workloads")
+DATA = root.joinpath("data")
+
+# Relative slowdown reported as a regression by --compare
+THRESHOLD = 0.10
+
+
+class Skip(Exception):
+    """Raised by a benchmark setup that cannot run here."""
+
+
+class Context:
+    """Shared state for the benchmarks, such as compiled workloads."""
+
+    directory: Path
+    executables: Dict[str, Path]
+    cleanups: List[Callable[[], Any]]
+
+    def __init__(self, directory: Path):
+        self.directory = directory
+        self.executables = {}
+        self.cleanups = []
+
+    def defer(self, cleanup: Callable[[], Any]):
+        """Release something once the current benchmark is done."""
+
+        self.cleanups.append(cleanup)
+
+    def clean(self):
+        """Run deferred cleanups, most recent first."""
+
+        while self.cleanups:
+            self.cleanups.pop()()
+
+    def executable(self, name: str) -> Path:
+        """Compile a workload on first use, or use its shell fallback."""
+
+        if name not in self.executables:
+            compiler = shutil.which("cc") or shutil.which("gcc") or shutil.which("clang")
+            path = self.directory.joinpath(name)
+            if compiler is not None and subprocess.run(
+                    (compiler, "-O2", "-o", str(path), str(WORKLOADS.joinpath(f"{name}.c"))),
+                    stdout=subprocess.DEVNULL,
+                    stderr=subprocess.DEVNULL).returncode == 0:
+                self.executables[name] = path
+            else:
+                self.executables[name] = WORKLOADS.joinpath(f"{name}.sh")
+        return self.executables[name]
+
+
+# Each benchmark prepares its workload and returns the callable to time
+BENCHMARKS: Dict[str, Callable[[Context], Callable[[], Any]]] = {}
+
+
+def benchmark(name: str, number: int = 1):
+    """Register a benchmark setup function."""
+
+    def decorator(setup: Callable[[Context], Callable[[], Any]]):
+        setup.number = number
+        BENCHMARKS[name] = setup
+        return setup
+
+    return decorator
+
+
+@benchmark("process.run.spawn", number=20)
+def bench_process_run_spawn(context: Context):
+    executable = str(context.executable("true"))
+    return lambda: process.run(executable, timeout=10)
+
+
+def bench_launcher_spawn(name: str):
+    """Measure spawn overhead of a launcher alone, without process.run."""
+
+    def setup(context: Context):
+        executable = str(context.executable("true"))
+        spawner = launcher.LAUNCHERS[name]()
+        context.defer(spawner.close)
+
+        def spawn():
+            spawner.spawn((executable,), stdin=False).communicate(timeout=10)
+
+        return spawn
+
+    return setup
+
+
+benchmark("launcher.spawn.subprocess", number=20)(bench_launcher_spawn("subprocess"))
+benchmark("launcher.spawn.posix_spawn", number=20)(bench_launcher_spawn("posix_spawn"))
+benchmark("launcher.spawn.fork_server", number=20)(bench_launcher_spawn("fork_server"))
+
+
+@benchmark("process.run.stdin", number=20)
+def bench_process_run_stdin(context: Context):
+    executable = str(context.executable("echo"))
+    stdin = b"hello\n" * 1000
+    return lambda: process.run(executable, stdin=stdin, timeout=10)
+
+
+def start_interactive(context: Context) -> process.Interactive:
+    """Start an echo workload with non-blocking output."""
+
+    interactive = process.Interactive((str(context.executable("echo")),))
+    os.set_blocking(interactive.stdout.file.fileno(), False)
+    os.set_blocking(interactive.stderr.file.fileno(), False)
+    return interactive
+
+
+@benchmark("interactive.round_trip", number=200)
+def bench_interactive_round_trip(context: Context):
+    interactive = start_interactive(context)
+    context.defer(lambda: interactive.close(timeout=5))
+
+    def round_trip():
+        interactive.stdin.write(b"ping")
+        interactive.stdout.read(condition=lambda buffer: buffer.endswith(b"\n"), timeout=5)
+
+    return round_trip
+
+
+@benchmark("interactive.throughput")
+def bench_interactive_throughput(context: Context):
+    line = b"x" * 1023
+    count = 1024
+
+    # Keep the data in flight below the pipe buffer size to avoid deadlock
+    window = 32
+
+    def throughput():
+        interactive = start_interactive(context)
+        for _ in range(count // window):
+            for _ in range(window):
+                interactive.stdin.write(line, flush=False)
+            interactive.stdin.file.flush()
+            expected = window * (len(line) + 1)
+            interactive.stdout.read(condition=lambda buffer: len(buffer) >= expected, timeout=5)
+        interactive.close(timeout=5)
+
+    return throughput
+
+
+@benchmark("readable.large_output")
+def bench_readable_large_output(context: Context):
+    executable = str(context.executable("spew"))
+    size = 8 * 1024 * 1024
+
+    def read():
+        child = subprocess.Popen((executable, str(size)), stdout=subprocess.PIPE)
+        os.set_blocking(child.stdout.fileno(), False)
+        readable = process.Readable(child.stdout)
+        readable.read(condition=lambda buffer: len(buffer) >= size, timeout=30)
+        child.wait()
+
+    return read
+
+
+@benchmark("valgrind.parse", number=5)
+def bench_valgrind_parse(context: Context):
+    text = DATA.joinpath("valgrind.xml").read_text()
+    head, _, tail = text.partition("<error>")
+    error, _, tail = tail.partition("</error>")
+    report = head + f"<error>{error}</error>" * 5000 + tail
+    return lambda: valgrind.parse_errors(io.StringIO(report))
+
+
+@benchmark("callgrind.parse", number=1000)
+def bench_callgrind_parse(context: Context):
+    path = context.directory.joinpath("callgrind.out")
+    shutil.copy(str(DATA.joinpath("callgrind.out")), str(path))
+    return lambda: callgrind.read_last_line(path)
+
+
+@benchmark("serialization.dump", number=5)
+def bench_serialization_dump(context: Context):
+    runtime = process.Runtime(
+        args=("./program", "--flag"),
+        cwd=Path("/tmp"),
+        elapsed=0.5,
+        code=0,
+        timeout=1.0,
+        stdin=b"input\n" * 1000,
+        stdout=b"output line\n" * 20000,
+        stderr=b"")
+    results = {f"test_{i}": dict(passing=True, runtime=runtime.dump()) for i in range(200)}
+    return lambda: serialization.dump(json.loads(json.dumps(results)), io.StringIO())
+
+
+def create_assignment_data(problem_count: int) -> dict:
+    """Synthesize a serialized assignment with many problems."""
+
+    def category(name: str) -> dict:
+        return dict(enabled=True, name=name, minutes=None, weight="1", points="10")
+
+    return dict(
+        short="hw1",
+        title="Homework 1",
+        authors=[dict(name="Author", email="author@example.com")],
+        problems=[dict(
+            short=f"problem{i}",
+            title=f"Problem {i}",
+            relative_path=f"problem{i}",
+            grading=dict(
+                enabled=True,
+                weight="1",
+                points="10",
+                automated=category("Automated tests"),
+                review=category("Code review"),
+                manual=None),
+            authors=[dict(name="Author", email="author@example.com")],
+            topics=["lists"],
+            notes=None,
+            difficulty="easy") for i in range(problem_count)],
+        grading=dict(points=100),
+        extra=None,
+        notes=None,
+        meta=dict(built="2020-01-01 00:00:00", curricula="2.0.1"))
+
+
+@benchmark("assignment.load", number=5)
+def bench_assignment_load(context: Context):
+    data = json.dumps(create_assignment_data(5000))
+    return lambda: Assignment.load(json.loads(data))
+
+
+@benchmark("assignment.dump", number=5)
+def bench_assignment_dump(context: Context):
+    assignment = Assignment.load(create_assignment_data(5000))
+    return lambda: assignment.dump()
+
+
+@benchmark("template.render", number=20)
+def bench_template_render(context: Context):
+    try:
+        import jinja2  # noqa: F401
+    except ImportError:
+        raise Skip("jinja2 is not installed")
+
+    from curricula.library.template import jinja2_create_environment
+
+    template_path = context.directory.joinpath("template")
+    template_path.mkdir(exist_ok=True)
+    template_path.joinpath("readme.md").write_text(
+        "# [[ assignment.title ]]\n"
+        "[% for problem in assignment.problems %]"
+        "## [[ problem.title ]] ([[ problem.grading.points | pretty ]] points)\n"
+        "[% endfor %]")
+    assignment = Assignment.load(create_assignment_data(500))
+
+    def render():
+        environment = jinja2_create_environment(default_template_path=template_path)
+        environment.get_template("template:readme.md").render(assignment=assignment)
+
+    return render
+
+
+def run(names: List[str], repeat: int, directory: Path) -> Dict[str, dict]:
+    """Run each benchmark and summarize timings per call in seconds."""
+
+    context = Context(directory)
+    results = {}
+    for name in names:
+        setup = BENCHMARKS[name]
+        try:
+            function = setup(context)
+        except Skip as skip:
+            results[name] = dict(skipped=str(skip))
+            print(f"{name:<28} skipped: {skip}")
+            continue
+
+        number = getattr(setup, "number", 1)
+        try:
+            function()
+            timings = [time / number for time in timeit.repeat(function, repeat=repeat, number=number)]
+        finally:
+            context.clean()
+        results[name] = dict(
+            number=number,
+            repeat=repeat,
+            best=min(timings),
+            median=statistics.median(timings),
+            mean=statistics.mean(timings))
+        print(f"{name:<28} {results[name]['best'] * 1e3:>12.4f} ms")
+    return results
+
+
+def compare(previous: Dict[str, dict], current: Dict[str, dict], threshold: float) -> List[str]:
+    """Print relative change per benchmark and list regressions."""
+
+    regressions = []
+    for name, result in current.items():
+        before = previous.get(name)
+        if before is None or "best" not in before or "best" not in result:
+            continue
+        ratio = result["best"] / before["best"]
+        print(f"{name:<28} {ratio:>8.3f}x")
+        if ratio > 1 + threshold:
+            regressions.append(f"{name} is {ratio:.2f}x slower")
+    return regressions
+
+
+def describe() -> dict:
+    """Record where the results came from."""
+
+    commit = None
+    try:
+        commit = subprocess.run(
+            ("git", "rev-parse", "HEAD"),
+            cwd=str(root),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL).stdout.decode().strip() or None
+    except OSError:
+        pass
+    return dict(python=sys.version, platform=platform.platform(), commit=commit)
+
+
+def main() -> int:
+    """Run the benchmark suite from the command line."""
+
+    parser = argparse.ArgumentParser(description="Benchmark curricula library hot paths")
+    parser.add_argument("benchmarks", nargs="*", default=list(BENCHMARKS), help="subset of benchmarks to run")
+    parser.add_argument("-r", "--repeat", type=int, default=5)
+    parser.add_argument("-o", "--output", default=None, help="write results as JSON")
+    parser.add_argument("-c", "--compare", default=None, help="previous JSON results to compare against")
+    parser.add_argument("-t", "--threshold", type=float, default=THRESHOLD)
+    args = parser.parse_args()
+
+    unknown = set(args.benchmarks) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(sorted(unknown))}")
+
+    with tempfile.TemporaryDirectory() as directory:
+        results = run(args.benchmarks, args.repeat, Path(directory))
+
+    if args.output is not None:
+        with open(args.output, "w") as file:
+            json.dump(dict(meta=describe(), results=results), file, indent=2)
+
+    if args.compare is not None:
+        with open(args.compare) as file:
+            previous = json.load(file)["results"]
+        regressions = compare(previous, results, args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
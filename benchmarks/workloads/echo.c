@@ -0,0 +1,11 @@
+/* Echo each line of stdin back to stdout, flushing after every line. */
+#include <stdio.h>
+
+int main(void) {
+    char line[4096];
+    while (fgets(line, sizeof(line), stdin) != NULL) {
+        fputs(line, stdout);
+        fflush(stdout);
+    }
+    return 0;
+}
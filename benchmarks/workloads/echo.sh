@@ -0,0 +1,5 @@
+#!/bin/sh
+# Fallback for echo.c when no C compiler is available.
+while IFS= read -r line; do
+    printf '%s\n' "$line"
+done
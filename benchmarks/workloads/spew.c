@@ -0,0 +1,19 @@
+/* Write the number of bytes given as the first argument to stdout. */
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+
+int main(int argc, char **argv) {
+    long remaining = argc > 1 ? atol(argv[1]) : 0;
+    char block[65536];
+    memset(block, 'x', sizeof(block));
+    for (size_t i = 79; i < sizeof(block); i += 80) {
+        block[i] = '\n';
+    }
+    while (remaining > 0) {
+        size_t size = remaining < (long) sizeof(block) ? (size_t) remaining : sizeof(block);
+        fwrite(block, 1, size, stdout);
+        remaining -= (long) size;
+    }
+    return 0;
+}
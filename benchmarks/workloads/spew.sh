@@ -0,0 +1,3 @@
+#!/bin/sh
+# Fallback for spew.c when no C compiler is available.
+head -c "$1" /dev/zero | tr '\0' 'x'
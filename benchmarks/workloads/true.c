@@ -0,0 +1,4 @@
+/* Exit immediately to measure bare spawn cost. */
+int main(void) {
+    return 0;
+}
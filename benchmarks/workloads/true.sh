@@ -0,0 +1,3 @@
+#!/bin/sh
+# Fallback for true.c when no C compiler is available.
+exit 0
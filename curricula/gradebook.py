@@ -0,0 +1,212 @@
+from decimal import Decimal, ROUND_HALF_UP
+from dataclasses import dataclass
+from typing import Dict, List, Mapping, Optional, Sequence, Tuple, Any
+
+from .models import Assignment, ProblemGrading
+
+__all__ = (
+    "CATEGORIES",
+    "Grade",
+    "Gradebook")
+
+CATEGORIES = ("automated", "review", "manual")
+
+# Scores are reported to the hundredth of a point
+PLACES = Decimal("0.01")
+
+# Floating point results this close to a rounding boundary are redone in Decimal
+TIE_TOLERANCE = 1e-6
+
+# Earned points for one student as problem short to category to points
+Earned = Mapping[str, Mapping[str, Any]]
+
+
+def quantize(value: Decimal) -> Decimal:
+    """Round the way reported scores always have been."""
+
+    return value.quantize(PLACES, rounding=ROUND_HALF_UP)
+
+
+def numpy() -> Optional[Any]:
+    """NumPy if it's installed, otherwise fall back to Decimal."""
+
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+@dataclass(eq=False)
+class Grade:
+    """Points earned by a student in each category and overall."""
+
+    automated: Decimal
+    review: Decimal
+    manual: Decimal
+    total: Decimal
+
+    def dump(self) -> dict:
+        """Use string format like the models."""
+
+        return dict(
+            automated=str(self.automated),
+            review=str(self.review),
+            manual=str(self.manual),
+            total=str(self.total))
+
+
+class Gradebook:
+    """Roster-wide scoring compiled from an assignment's grading tree.
+
+    Each enabled grading category of each problem becomes a column with
+    a coefficient: the assignment points awarded per point earned in it.
+    Scoring the roster is then one matrix product of earned points and
+    coefficients, done with NumPy when available. Results are rounded
+    exactly as Decimal arithmetic would, falling back to Decimal for any
+    student whose score lands within floating point error of a rounding
+    boundary. After weights change, call compile again; earned points
+    are kept so rescoring is just the product.
+    """
+
+    assignment: Assignment
+
+    columns: List[Tuple[str, str]]
+    coefficients: List[Decimal]
+
+    students: List[str]
+    _earned: List[List[Decimal]]
+    _matrix: Optional[Any]
+    _vector: Optional[Any]
+
+    def __init__(self, assignment: Assignment):
+        self.assignment = assignment
+        self.students = []
+        self._earned = []
+        self._matrix = None
+        self.compile()
+
+    def compile(self):
+        """Derive column coefficients from the current weights."""
+
+        assignment = self.assignment
+        points = Decimal(assignment.grading.points)
+
+        columns = []
+        coefficients = []
+        for problem in assignment.problems:
+            grading = problem.grading
+            if assignment.grading.weight() == 0 or not grading.enabled or grading.weight_total == 0:
+                continue
+
+            # Weights come from the model so that scores can't drift from what it reports
+            problem_weight = problem.weight()
+            for name in CATEGORIES:
+                category = getattr(grading, name)
+                if not self._enabled(grading, name) or category.points == 0:
+                    continue
+                columns.append((problem.short, name))
+                coefficients.append(problem_weight * getattr(grading, f"percentage_{name}") / category.points * points)
+
+        old_columns = getattr(self, "columns", None)
+        self.columns = columns
+        self.coefficients = coefficients
+        self._vector = None
+
+        # Earned points are kept by column, realign them if columns changed
+        if old_columns is not None and old_columns != columns:
+            index = {column: i for i, column in enumerate(old_columns)}
+            self._earned = [
+                [row[index[column]] if column in index else Decimal(0) for column in columns]
+                for row in self._earned]
+            self._matrix = None
+
+    @staticmethod
+    def _enabled(grading: ProblemGrading, name: str) -> bool:
+        """Whether a category counts toward the problem."""
+
+        category = getattr(grading, name)
+        return grading.enabled and category is not None and category.enabled
+
+    def add(self, student: str, earned: Earned):
+        """Record the points a student earned in each problem category."""
+
+        row = []
+        for short, name in self.columns:
+            value = earned.get(short, {}).get(name)
+            row.append(Decimal(value) if value is not None else Decimal(0))
+
+        if student in self.students:
+            self._earned[self.students.index(student)] = row
+        else:
+            self.students.append(student)
+            self._earned.append(row)
+        self._matrix = None
+
+    def update(self, roster: Mapping[str, Earned]):
+        """Record a whole roster at once."""
+
+        for student, earned in roster.items():
+            self.add(student, earned)
+
+    def _decimal_row(self, row: Sequence[Decimal]) -> Dict[str, Decimal]:
+        """Reference scoring of one student in Decimal."""
+
+        scores = {name: Decimal(0) for name in CATEGORIES}
+        for (_, name), coefficient, value in zip(self.columns, self.coefficients, row):
+            scores[name] += coefficient * value
+        return scores
+
+    def _grade(self, scores: Mapping[str, Decimal]) -> Grade:
+        """Round unrounded category scores."""
+
+        return Grade(
+            automated=quantize(scores["automated"]),
+            review=quantize(scores["review"]),
+            manual=quantize(scores["manual"]),
+            total=quantize(sum(scores.values())))
+
+    def _compute_decimal(self) -> Dict[str, Grade]:
+        """Score everyone without NumPy."""
+
+        return {
+            student: self._grade(self._decimal_row(row))
+            for student, row in zip(self.students, self._earned)}
+
+    def _compute_numpy(self, np: Any) -> Dict[str, Grade]:
+        """Score everyone in one batched pass."""
+
+        if self._matrix is None:
+            self._matrix = np.array(self._earned, dtype=np.float64).reshape(len(self.students), len(self.columns))
+        if self._vector is None:
+            # One coefficient column per category so the product splits scores by category
+            vector = np.zeros((len(self.columns), len(CATEGORIES)), dtype=np.float64)
+            for i, ((_, name), coefficient) in enumerate(zip(self.columns, self.coefficients)):
+                vector[i, CATEGORIES.index(name)] = float(coefficient)
+            self._vector = vector
+
+        by_category = self._matrix @ self._vector
+        combined = np.concatenate((by_category, by_category.sum(axis=1, keepdims=True)), axis=1)
+
+        # Rounding half up in floating point is only trustworthy away from ties
+        scaled = combined / float(PLACES)
+        fraction = scaled - np.floor(scaled)
+        ties = np.abs(fraction - 0.5).min(axis=1) < TIE_TOLERANCE
+        rounded = np.floor(scaled + 0.5).astype(np.int64)
+
+        grades = {}
+        for i, student in enumerate(self.students):
+            if ties[i]:
+                grades[student] = self._grade(self._decimal_row(self._earned[i]))
+                continue
+            values = [Decimal(int(value)) * PLACES for value in rounded[i]]
+            grades[student] = Grade(automated=values[0], review=values[1], manual=values[2], total=values[3])
+        return grades
+
+    def compute(self) -> Dict[str, Grade]:
+        """Score the whole roster."""
+
+        np = numpy()
+        if np is None or not self.students:
+            return self._compute_decimal()
+        return self._compute_numpy(np)
@@ -0,0 +1,170 @@
+import os
+import threading
+
+from pathlib import Path
+from contextlib import contextmanager
+from typing import Dict, FrozenSet, Iterable, Iterator, List, Optional, Sequence
+
+__all__ = (
+    "CorePool",
+    "current",
+    "pinned",
+    "physical_cores")
+
+_local = threading.local()
+
+
+def current() -> Optional[FrozenSet[int]]:
+    """CPUs the calling thread is pinned to, or None if not pinned."""
+
+    return getattr(_local, "cpus", None)
+
+
+def available() -> FrozenSet[int]:
+    """CPUs this process may run on."""
+
+    if hasattr(os, "sched_getaffinity"):
+        return frozenset(os.sched_getaffinity(0))
+    return frozenset(range(os.cpu_count() or 1))
+
+
+@contextmanager
+def pinned(cpus: Iterable[int]) -> Iterator[FrozenSet[int]]:
+    """Restrict the calling thread, and children it spawns, to some CPUs.
+
+    On Linux affinity is per thread and inherited by forked or spawned
+    children, so pinning the worker thread pins both the worker and the
+    process it drives. Where affinity isn't supported the CPUs are
+    still recorded but nothing is restricted.
+    """
+
+    cpus = frozenset(cpus)
+    previous = current()
+    supported = hasattr(os, "sched_setaffinity")
+    if supported:
+        mask = os.sched_getaffinity(0)
+        os.sched_setaffinity(0, cpus)
+    _local.cpus = cpus
+    try:
+        yield cpus
+    finally:
+        _local.cpus = previous
+        if supported:
+            os.sched_setaffinity(0, mask)
+
+
+def physical_cores(cpus: Iterable[int]) -> List[FrozenSet[int]]:
+    """Group logical CPUs that share a physical core."""
+
+    cpus = frozenset(cpus)
+    groups: Dict[FrozenSet[int], None] = {}
+    for cpu in sorted(cpus):
+        siblings = frozenset((cpu,))
+        path = Path(f"/sys/devices/system/cpu/cpu{cpu}/topology/thread_siblings_list")
+        try:
+            siblings = parse_cpu_list(path.read_text()) & cpus or siblings
+        except (OSError, ValueError):
+            pass
+        groups.setdefault(siblings, None)
+    return list(groups)
+
+
+def parse_cpu_list(text: str) -> FrozenSet[int]:
+    """Parse the kernel's 0-3,8,10-11 list format."""
+
+    cpus = set()
+    for part in text.strip().split(","):
+        if not part:
+            continue
+        if "-" in part:
+            low, high = part.split("-")
+            cpus.update(range(int(low), int(high) + 1))
+        else:
+            cpus.add(int(part))
+    return frozenset(cpus)
+
+
+class CorePool:
+    """Hands out exclusive cores to timing-sensitive work.
+
+    The pool is split up front into exclusive cores and shared ones, by
+    default half each with at least one shared. Exclusive allocations
+    take a whole physical core, so that no SMT sibling runs anything
+    else, and pin to one of its logical CPUs. Everything else is pinned
+    to the shared cores, which never change, so work already running
+    can't end up on a core handed out later. A pool of a single core has
+    nothing to hold exclusively and runs everything shared.
+    """
+
+    cores: List[FrozenSet[int]]
+    exclusive_cores: List[FrozenSet[int]]
+    shared_cores: List[FrozenSet[int]]
+
+    _free: List[FrozenSet[int]]
+    _held: Dict[int, FrozenSet[int]]
+    _condition: threading.Condition
+
+    def __init__(self, cpus: Iterable[int] = None, cores: Sequence[Iterable[int]] = None, exclusive: int = None):
+        if cores is not None:
+            self.cores = [frozenset(core) for core in cores]
+        else:
+            self.cores = physical_cores(cpus if cpus is not None else available())
+        if exclusive is None:
+            exclusive = len(self.cores) // 2
+        exclusive = max(min(exclusive, len(self.cores) - 1), 0)
+        self.exclusive_cores = self.cores[:exclusive]
+        self.shared_cores = self.cores[exclusive:]
+        self._free = list(self.exclusive_cores)
+        self._held = {}
+        self._condition = threading.Condition()
+
+    @property
+    def cpus(self) -> FrozenSet[int]:
+        """Every CPU in the pool."""
+
+        return frozenset().union(*self.cores)
+
+    def shared(self) -> FrozenSet[int]:
+        """CPUs for work that doesn't need a core of its own."""
+
+        return frozenset().union(*self.shared_cores)
+
+    def acquire(self, timeout: float = None) -> FrozenSet[int]:
+        """Wait for a core to hold exclusively, returning the CPU to pin to."""
+
+        if not self.exclusive_cores:
+            raise ValueError("the pool has no exclusive cores")
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._free, timeout):
+                raise TimeoutError("no core became available")
+            core = self._free.pop(0)
+            cpu = min(core)
+            self._held[cpu] = core
+            return frozenset((cpu,))
+
+    def release(self, cpus: FrozenSet[int]):
+        """Return an exclusive core."""
+
+        with self._condition:
+            for cpu in cpus:
+                core = self._held.pop(cpu, None)
+                if core is not None:
+                    self._free.append(core)
+            self._free.sort(key=min)
+            self._condition.notify_all()
+
+    @contextmanager
+    def pin(self, exclusive: bool = False, timeout: float = None) -> Iterator[FrozenSet[int]]:
+        """Pin the calling thread for the duration of a block."""
+
+        if not exclusive or not self.exclusive_cores:
+            with pinned(self.shared()) as cpus:
+                yield cpus
+            return
+
+        cpus = self.acquire(timeout=timeout)
+        try:
+            with pinned(cpus):
+                yield cpus
+        finally:
+            self.release(cpus)
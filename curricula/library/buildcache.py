@@ -0,0 +1,341 @@
+import os
+import re
+import json
+import time
+import shutil
+import hashlib
+import threading
+
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+from ..log import log
+from .process import run, Runtime
+from .runcache import hash_file_cached, resolve_executable, encode, decode
+
+__all__ = (
+    "BuildCache",
+    "find_headers",
+    "get_build_cache",
+    "set_build_cache",
+    "BUILD_CACHE_ENVIRONMENT_VARIABLE")
+
+BUILD_CACHE_ENVIRONMENT_VARIABLE = "CURRICULA_BUILD_CACHE"
+
+# Bumped whenever the key derivation or entry format changes
+VERSION = 1
+
+INCLUDE_PATTERN = re.compile(rb'^\s*#\s*include\s*([<"])([^>"]+)[>"]', re.MULTILINE)
+
+# Stands in for the output path so that it doesn't change the key
+OUTPUT = "\0output\0"
+
+# Most files whose includes are remembered by _includes
+INCLUDE_MEMO_SIZE = 4096
+
+_includes_memo: "OrderedDict[Tuple[str, int, int, int], List[Tuple[bytes, bytes]]]" = OrderedDict()
+_includes_lock = threading.Lock()
+
+
+def include_paths_from_args(args: Sequence[str], cwd: Optional[Path]) -> List[Path]:
+    """Directories passed to the compiler with -I."""
+
+    paths = []
+    iterator = iter(args)
+    for arg in iterator:
+        if arg == "-I":
+            value = next(iterator, None)
+        elif arg.startswith("-I"):
+            value = arg[2:]
+        else:
+            continue
+        if value:
+            path = Path(value)
+            paths.append(cwd.joinpath(path) if cwd is not None and not path.is_absolute() else path)
+    return paths
+
+
+def _includes(path: Path) -> List[Tuple[bytes, bytes]]:
+    """The includes in a file, reusing the scan while its stat is unchanged."""
+
+    stat = path.stat()
+    stamp = (str(path), stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    with _includes_lock:
+        includes = _includes_memo.get(stamp)
+        if includes is not None:
+            _includes_memo.move_to_end(stamp)
+            return includes
+
+    includes = INCLUDE_PATTERN.findall(path.read_bytes())
+    with _includes_lock:
+        _includes_memo[stamp] = includes
+        while len(_includes_memo) > INCLUDE_MEMO_SIZE:
+            _includes_memo.popitem(last=False)
+    return includes
+
+
+def find_headers(sources: Iterable[Path], include_paths: Sequence[Path]) -> List[Path]:
+    """Every local header reachable from the sources through includes.
+
+    Quoted includes are looked up beside the including file first, and
+    both forms are then looked up in the include paths. Headers that
+    can't be found there are system headers and are covered by keying
+    on the compiler version instead.
+    """
+
+    found: Set[Path] = set()
+    stack = [path.resolve() for path in sources]
+    visited = set(stack)
+    while stack:
+        path = stack.pop()
+        try:
+            includes = _includes(path)
+        except OSError:
+            continue
+
+        for kind, name in includes:
+            name = os.fsdecode(name)
+            candidates = [path.parent] if kind == b'"' else []
+            candidates.extend(include_paths)
+            for directory in candidates:
+                header = directory.joinpath(name)
+                if header.is_file():
+                    header = header.resolve()
+                    if header not in visited:
+                        visited.add(header)
+                        found.add(header)
+                        stack.append(header)
+                    break
+
+    return sorted(found)
+
+
+class BuildCache:
+    """Store of compiled outputs keyed on everything that affects them.
+
+    The key covers the compiler's identity and version, its arguments
+    with the output path and working directory factored out, and the
+    contents of the sources and every local header they include, such
+    as the grading headers under Paths.INCLUDE. On a hit the stored
+    binary is copied to the requested output and the compiler is never
+    run. Failed builds are stored too so that regrading an unchanged
+    submission that didn't compile is just as fast. The least recently
+    used entries are evicted beyond either limit.
+    """
+
+    path: Path
+    max_entries: int
+    max_bytes: int
+
+    hits: int
+    misses: int
+
+    _index: Dict[str, Tuple[float, int]]
+    _size: int
+    _versions: Dict[Tuple[str, int], str]
+    _lock: threading.Lock
+
+    def __init__(self, path: Path, max_entries: int = 10_000, max_bytes: int = 4 << 30):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._versions = {}
+        self._lock = threading.Lock()
+
+        self.path.mkdir(parents=True, exist_ok=True)
+        self._index = {}
+        self._size = 0
+        for entry in self.path.iterdir():
+            if entry.is_dir() and not entry.name.startswith("."):
+                size = sum(file.stat().st_size for file in entry.iterdir())
+                self._index[entry.name] = (entry.stat().st_mtime, size)
+                self._size += size
+
+    def _compiler_version(self, compiler: Path) -> str:
+        """Output of --version, reused until the compiler changes."""
+
+        stat = compiler.stat()
+        stamp = (str(compiler.resolve()), stat.st_mtime_ns)
+        version = self._versions.get(stamp)
+        if version is None:
+            runtime = run(str(compiler), "--version", timeout=30)
+            version = (runtime.stdout or b"").decode(errors="replace") + str(runtime.code)
+            self._versions[stamp] = version
+        return version
+
+    def key(
+            self,
+            args: Sequence[str],
+            output: Path,
+            sources: Sequence[Path],
+            include_paths: Sequence[Path] = (),
+            cwd: Optional[Path] = None) -> Optional[str]:
+        """Derive the cache key, or None if the compiler can't be found."""
+
+        compiler = resolve_executable(args[0], cwd) if args else None
+        if compiler is None:
+            return None
+
+        def normalize(arg: str) -> str:
+            if arg == str(output):
+                return OUTPUT
+            if cwd is not None:
+                return arg.replace(str(cwd), ".")
+            return arg
+
+        sources = [cwd.joinpath(source) if cwd is not None and not source.is_absolute() else source for source in sources]
+        include_paths = list(include_paths) + include_paths_from_args(args, cwd)
+
+        digest = hashlib.sha256()
+        digest.update(json.dumps(dict(
+            version=VERSION,
+            compiler=hash_file_cached(compiler),
+            compiler_version=self._compiler_version(compiler),
+            args=[normalize(arg) for arg in args])).encode())
+
+        for source in sources:
+            digest.update(b"\0source\0" + normalize(str(source)).encode())
+            digest.update(hash_file_cached(source).encode() if source.is_file() else b"missing")
+
+        # Headers are identified by content so that moving an include tree doesn't matter
+        headers = sorted((header.name, hash_file_cached(header)) for header in find_headers(sources, include_paths))
+        for name, header_hash in headers:
+            digest.update(f"\0header\0{name}\0{header_hash}".encode())
+
+        return digest.hexdigest()
+
+    def _entry_path(self, key: str) -> Path:
+        return self.path.joinpath(key)
+
+    def get(self, key: str, output: Path, args: Sequence[str], cwd: Optional[Path]) -> Optional[Runtime]:
+        """Restore a stored build to the output, or None on a miss."""
+
+        entry = self._entry_path(key)
+        try:
+            with entry.joinpath("runtime.json").open() as file:
+                data = json.load(file)
+            binary = entry.joinpath("binary")
+            if data["code"] == 0:
+                output.parent.mkdir(parents=True, exist_ok=True)
+                shutil.copy2(str(binary), str(output))
+        except (OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+
+        try:
+            os.utime(str(entry))
+        except OSError:
+            pass
+        with self._lock:
+            self.hits += 1
+            if key in self._index:
+                self._index[key] = (time.time(), self._index[key][1])
+
+        return Runtime(
+            args=tuple(args),
+            cwd=cwd,
+            stdout=decode(data["stdout"]),
+            stderr=decode(data["stderr"]),
+            elapsed=data["elapsed"],
+            code=data["code"])
+
+    def put(self, key: str, output: Path, runtime: Runtime) -> bool:
+        """Store a finished build, returning whether it was cacheable."""
+
+        if runtime.timed_out or runtime.raised_exception:
+            return False
+        if runtime.code == 0 and not output.is_file():
+            return False
+
+        # Build the entry aside and rename it into place atomically
+        entry = self._entry_path(key)
+        temporary = self.path.joinpath(f".{key}.{os.getpid()}.{threading.get_ident()}")
+        temporary.mkdir()
+        size = 0
+        if runtime.code == 0:
+            shutil.copy2(str(output), str(temporary.joinpath("binary")))
+            size += output.stat().st_size
+        data = json.dumps(dict(
+            stdout=encode(runtime.stdout),
+            stderr=encode(runtime.stderr),
+            elapsed=runtime.elapsed,
+            code=runtime.code)).encode()
+        temporary.joinpath("runtime.json").write_bytes(data)
+        size += len(data)
+
+        try:
+            os.rename(str(temporary), str(entry))
+        except OSError:
+            # Another grader stored the same build first
+            shutil.rmtree(str(temporary), ignore_errors=True)
+            return True
+
+        with self._lock:
+            self._index[key] = (time.time(), size)
+            self._size += size
+            self._evict()
+        return True
+
+    def _evict(self):
+        """Remove least recently used entries until within bounds."""
+
+        if len(self._index) <= self.max_entries and self._size <= self.max_bytes:
+            return
+
+        for key, (_, size) in sorted(self._index.items(), key=lambda item: item[1][0]):
+            if len(self._index) <= self.max_entries and self._size <= self.max_bytes:
+                break
+            shutil.rmtree(str(self._entry_path(key)), ignore_errors=True)
+            del self._index[key]
+            self._size -= size
+
+    def build(
+            self,
+            *args: str,
+            output: Path,
+            sources: Sequence[Path],
+            include_paths: Sequence[Path] = (),
+            cwd: Path = None,
+            timeout: float = None) -> Runtime:
+        """Run a compiler command unless an identical build is stored."""
+
+        key = self.key(args, output, sources, include_paths=include_paths, cwd=cwd)
+        if key is None:
+            return run(*args, cwd=cwd, timeout=timeout, deterministic=False)
+
+        destination = cwd.joinpath(output) if cwd is not None and not output.is_absolute() else output
+        runtime = self.get(key, destination, args, cwd)
+        if runtime is not None:
+            log.debug(f"restored build of {output.name} from cache")
+            return runtime
+
+        runtime = run(*args, cwd=cwd, timeout=timeout, deterministic=False)
+        self.put(key, destination, runtime)
+        return runtime
+
+
+build_cache: Optional[BuildCache] = None
+_configured = False
+
+
+def set_build_cache(new: Optional[BuildCache]):
+    """Set the default build cache."""
+
+    global build_cache, _configured
+    build_cache = new
+    _configured = True
+
+
+def get_build_cache() -> Optional[BuildCache]:
+    """Get the default build cache, configured from CURRICULA_BUILD_CACHE if unset."""
+
+    global build_cache, _configured
+    if not _configured:
+        path = os.environ.get(BUILD_CACHE_ENVIRONMENT_VARIABLE)
+        build_cache = BuildCache(Path(path)) if path else None
+        _configured = True
+    return build_cache
@@ -1,13 +1,18 @@
 import os
+import timeit
 import tempfile
 from pathlib import Path
 from typing import Optional, Tuple
 
-from . import process
+from . import process, metrics
 from .files import delete_file
+from .tracing import Span, span
 
 __all__ = ("count",)
 
+CALLGRIND_RUNS = metrics.counter("curricula_callgrind_runs_total", "Callgrind runs by outcome", ("outcome",))
+CALLGRIND_SECONDS = metrics.histogram("curricula_callgrind_seconds", "Wall time of Callgrind runs including parsing")
+
 
 def read_last_line(path: Path) -> Optional[str]:
     """IR count appears at the end of the callgrind output."""
@@ -25,14 +30,30 @@ def read_last_line(path: Path) -> Optional[str]:
         return file.readlines()[-1].decode()
 
 
+@Span("callgrind.count")
 def count(
         *args: str,
-        stdin: bytes = None,
+        stdin: process.Stdin = None,
         timeout: float = None,
         cwd: Path = None,
         function_name: str = None) -> Tuple[process.Runtime, Optional[int]]:
     """Run callgrind on the program and return IR count."""
 
+    start = timeit.default_timer()
+    runtime, result = _count(*args, stdin=stdin, timeout=timeout, cwd=cwd, function_name=function_name)
+    CALLGRIND_SECONDS.observe(timeit.default_timer() - start)
+    CALLGRIND_RUNS.inc(outcome="counted" if result is not None else "uncounted")
+    return runtime, result
+
+
+def _count(
+        *args: str,
+        stdin: process.Stdin = None,
+        timeout: float = None,
+        cwd: Path = None,
+        function_name: str = None) -> Tuple[process.Runtime, Optional[int]]:
+    """Run callgrind and read the total from its output."""
+
     extra_valgrind_args = []
     if function_name is not None:
         extra_valgrind_args.append(f"--toggle-collect={function_name}")
@@ -48,7 +69,8 @@ def count(
         timeout=timeout,
         cwd=cwd)
     if out_path.exists():
-        last_line = read_last_line(out_path)
+        with span("callgrind.parse"):
+            last_line = read_last_line(out_path)
         if last_line is None:
             return runtime, None
         result = int(last_line.rsplit(maxsplit=1)[1])
@@ -0,0 +1,383 @@
+import os
+import re
+import time
+import selectors
+import subprocess
+
+from abc import ABC, abstractmethod
+from pathlib import Path
+from dataclasses import dataclass
+from collections import Counter
+from typing import Iterable, Optional, Tuple, List, Union
+
+__all__ = (
+    "Mismatch",
+    "Comparator",
+    "ExactComparator",
+    "WhitespaceComparator",
+    "LineSetComparator",
+    "stream_compare")
+
+# Bytes of surrounding output recorded with a mismatch
+CONTEXT = 40
+
+# Size of each read from the child's output
+READ_SIZE = 32768
+
+# Size of each write to the child's input, which is non-blocking
+WRITE_SIZE = 65536
+
+# A run of the bytes that bytes.split treats as separators
+TOKEN = re.compile(rb"[^ \t\n\r\x0b\x0c]+")
+
+
+@dataclass(eq=False)
+class Mismatch:
+    """Where and how output diverged from what was expected."""
+
+    offset: int
+    reason: str
+    expected: bytes
+    actual: bytes
+
+    def dump(self) -> dict:
+        """Serialize, decoding the context leniently."""
+
+        return dict(
+            offset=self.offset,
+            reason=self.reason,
+            expected=self.expected.decode(errors="replace"),
+            actual=self.actual.decode(errors="replace"))
+
+    @classmethod
+    def load(cls, data: dict) -> "Mismatch":
+        """Deserialize."""
+
+        return cls(
+            offset=data["offset"],
+            reason=data["reason"],
+            expected=data["expected"].encode(),
+            actual=data["actual"].encode())
+
+
+class Comparator(ABC):
+    """Incrementally checks output against an expected result.
+
+    Output is fed in chunks as it arrives. Each call returns a Mismatch
+    as soon as the output can no longer match, which lets the caller
+    stop the process early. The first mismatch is remembered.
+    """
+
+    expected: bytes
+    mismatch: Optional[Mismatch]
+
+    def __init__(self, expected: bytes):
+        self.expected = expected
+        self.mismatch = None
+
+    @classmethod
+    def from_path(cls, path: Path) -> "Comparator":
+        """Compare against the contents of a file."""
+
+        return cls(path.read_bytes())
+
+    def feed(self, data: bytes) -> Optional[Mismatch]:
+        """Check the next chunk of output."""
+
+        if self.mismatch is None:
+            self.mismatch = self._feed(data)
+        return self.mismatch
+
+    def finish(self) -> Optional[Mismatch]:
+        """Check once the output has ended."""
+
+        if self.mismatch is None:
+            self.mismatch = self._finish()
+        return self.mismatch
+
+    @abstractmethod
+    def _feed(self, data: bytes) -> Optional[Mismatch]:
+        """Check a chunk, only called until the first mismatch."""
+
+    @abstractmethod
+    def _finish(self) -> Optional[Mismatch]:
+        """Check the end of output, only called without a mismatch."""
+
+
+class ExactComparator(Comparator):
+    """Output must match byte for byte."""
+
+    _offset: int
+    _tail: bytes
+
+    def __init__(self, expected: bytes):
+        super().__init__(expected)
+        self._offset = 0
+        self._tail = b""
+
+    def _feed(self, data: bytes) -> Optional[Mismatch]:
+        expected = self.expected[self._offset:self._offset + len(data)]
+        if data == expected:
+            self._offset += len(data)
+            self._tail = (self._tail + data)[-CONTEXT:]
+            return None
+
+        index = 0
+        while index < len(expected) and data[index] == expected[index]:
+            index += 1
+        offset = self._offset + index
+        before = (self._tail + data[:index])[-CONTEXT:]
+        reason = "unexpected output after end" if index == len(expected) else "output differs"
+        return Mismatch(
+            offset=offset,
+            reason=reason,
+            expected=before + self.expected[offset:offset + CONTEXT],
+            actual=before + data[index:index + CONTEXT])
+
+    def _finish(self) -> Optional[Mismatch]:
+        if self._offset < len(self.expected):
+            return Mismatch(
+                offset=self._offset,
+                reason="output ended early",
+                expected=self._tail + self.expected[self._offset:self._offset + CONTEXT],
+                actual=self._tail)
+        return None
+
+
+class WhitespaceComparator(Comparator):
+    """Output must have the same whitespace-separated tokens."""
+
+    _tokens: List[bytes]
+    _index: int
+    _pending: bytes
+    _pending_offset: int
+    _offset: int
+
+    def __init__(self, expected: bytes):
+        super().__init__(expected)
+        self._tokens = expected.split()
+        self._index = 0
+        self._pending = b""
+        self._pending_offset = 0
+        self._offset = 0
+
+    def _check(self, token: bytes, offset: int) -> Optional[Mismatch]:
+        """Compare one complete token."""
+
+        if self._index >= len(self._tokens):
+            return Mismatch(offset=offset, reason="unexpected output after end", expected=b"", actual=token[:CONTEXT])
+        expected = self._tokens[self._index]
+        if token != expected:
+            return Mismatch(
+                offset=offset,
+                reason=f"token {self._index} differs",
+                expected=b" ".join(self._tokens[self._index:self._index + 4])[:CONTEXT],
+                actual=token[:CONTEXT])
+        self._index += 1
+        return None
+
+    def _check_pending(self) -> Optional[Mismatch]:
+        """Fail early once the unfinished token cannot match."""
+
+        if self._index < len(self._tokens):
+            expected = self._tokens[self._index]
+            if len(self._pending) <= len(expected) and expected.startswith(self._pending):
+                return None
+        return self._check(self._pending, self._pending_offset)
+
+    def _feed(self, data: bytes) -> Optional[Mismatch]:
+        start = self._offset
+        self._offset += len(data)
+
+        # Whitespace at the start of the chunk ends the pending token
+        if self._pending and data and data[:1].isspace():
+            mismatch = self._check(self._pending, self._pending_offset)
+            self._pending = b""
+            if mismatch is not None:
+                return mismatch
+
+        for match in TOKEN.finditer(data):
+            if match.start() == 0 and self._pending:
+                token = self._pending + match.group()
+                offset = self._pending_offset
+            else:
+                token = match.group()
+                offset = start + match.start()
+
+            # The last token may continue in the next chunk
+            if match.end() == len(data):
+                self._pending = token
+                self._pending_offset = offset
+                return self._check_pending()
+
+            self._pending = b""
+            mismatch = self._check(token, offset)
+            if mismatch is not None:
+                return mismatch
+        return None
+
+    def _finish(self) -> Optional[Mismatch]:
+        if self._pending:
+            mismatch = self._check(self._pending, self._pending_offset)
+            self._pending = b""
+            if mismatch is not None:
+                return mismatch
+        if self._index < len(self._tokens):
+            return Mismatch(
+                offset=self._offset,
+                reason="output ended early",
+                expected=b" ".join(self._tokens[self._index:self._index + 4])[:CONTEXT],
+                actual=b"")
+        return None
+
+
+class LineSetComparator(Comparator):
+    """Output must have the same lines in any order."""
+
+    _remaining: Counter
+    _pending: bytes
+    _offset: int
+
+    def __init__(self, expected: bytes):
+        super().__init__(expected)
+        self._remaining = Counter(expected.splitlines())
+        self._pending = b""
+        self._offset = 0
+
+    def _take(self, line: bytes, offset: int) -> Optional[Mismatch]:
+        """Cross off one line."""
+
+        if self._remaining[line] <= 0:
+            return Mismatch(offset=offset, reason="unexpected line", expected=b"", actual=line[:CONTEXT])
+        self._remaining[line] -= 1
+        return None
+
+    def _feed(self, data: bytes) -> Optional[Mismatch]:
+        buffer = self._pending + data
+        offset = self._offset - len(self._pending)
+        self._offset += len(data)
+
+        lines = buffer.split(b"\n")
+        self._pending = lines.pop()
+        for line in lines:
+            mismatch = self._take(line.rstrip(b"\r"), offset)
+            if mismatch is not None:
+                return mismatch
+            offset += len(line) + 1
+        return None
+
+    def _finish(self) -> Optional[Mismatch]:
+        if self._pending:
+            mismatch = self._take(self._pending.rstrip(b"\r"), self._offset - len(self._pending))
+            self._pending = b""
+            if mismatch is not None:
+                return mismatch
+        missing = [line for line, count in self._remaining.items() if count > 0]
+        if missing:
+            return Mismatch(
+                offset=self._offset,
+                reason=f"{sum(self._remaining[line] for line in missing)} expected lines missing",
+                expected=missing[0][:CONTEXT],
+                actual=b"")
+        return None
+
+
+def stream_compare(
+        process: subprocess.Popen,
+        stdin: Optional[Union[bytes, Iterable[bytes]]],
+        timeout: Optional[float],
+        comparator: Optional[Comparator]) -> Tuple[bytes, bytes, bool]:
+    """Feed stdout to the comparator as it arrives.
+
+    The process is killed at the first mismatch. Returns the output
+    collected so far and whether the timeout expired. Works with Popen
+    and with the launcher's spawned processes. Stdin may be an iterable
+    of chunks, which are pulled only as the pipe accepts them, and
+    without a comparator this is just a streaming communicate.
+    """
+
+    deadline = time.monotonic() + timeout if timeout is not None else None
+    stdout: List[bytes] = []
+    stderr: List[bytes] = []
+    chunks = iter((stdin,) if isinstance(stdin, (bytes, bytearray)) else stdin or ())
+    pending = memoryview(b"")
+
+    def refill() -> bool:
+        """Pull the next non-empty chunk, returning whether there is one."""
+
+        nonlocal pending
+        while not pending:
+            chunk = next(chunks, None)
+            if chunk is None:
+                return False
+            pending = memoryview(chunk)
+        return True
+
+    selector = selectors.DefaultSelector()
+    if process.stdin is not None:
+        if refill():
+            os.set_blocking(process.stdin.fileno(), False)
+            selector.register(process.stdin, selectors.EVENT_WRITE)
+        else:
+            process.stdin.close()
+    selector.register(process.stdout, selectors.EVENT_READ, stdout)
+    selector.register(process.stderr, selectors.EVENT_READ, stderr)
+
+    timed_out = False
+    mismatched = False
+    with selector:
+        while selector.get_map():
+            remaining = deadline - time.monotonic() if deadline is not None else None
+            if remaining is not None and remaining <= 0:
+                timed_out = True
+                break
+
+            for key, _ in selector.select(remaining):
+                if key.fileobj is process.stdin:
+                    try:
+                        written = os.write(key.fd, pending[:WRITE_SIZE])
+                    except BlockingIOError:
+                        continue
+                    except BrokenPipeError:
+                        selector.unregister(key.fileobj)
+                        key.fileobj.close()
+                        continue
+                    pending = pending[written:]
+                    if not refill():
+                        selector.unregister(key.fileobj)
+                        key.fileobj.close()
+                    continue
+
+                data = os.read(key.fd, READ_SIZE)
+                if not data:
+                    selector.unregister(key.fileobj)
+                    continue
+                key.data.append(data)
+                if key.fileobj is process.stdout and comparator is not None and comparator.feed(data) is not None:
+                    mismatched = True
+                    break
+
+            # Nothing else is worth reading once the output is wrong
+            if mismatched:
+                break
+
+        else:
+            if comparator is not None:
+                mismatched = comparator.finish() is not None
+
+    for file in (process.stdin, process.stdout, process.stderr):
+        if file is not None and not file.closed:
+            file.close()
+
+    if timed_out or mismatched:
+        process.kill()
+
+    # The child may close its pipes and keep running, so the wait is bounded too
+    remaining = deadline - time.monotonic() if deadline is not None else None
+    try:
+        process.wait(max(remaining, 0) if remaining is not None else None)
+    except subprocess.TimeoutExpired:
+        timed_out = True
+        process.kill()
+        process.wait()
+    return b"".join(stdout), b"".join(stderr), timed_out
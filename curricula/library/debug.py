@@ -1,6 +1,6 @@
-import inspect
+import sys
 
 
 def get_source_location(stack_level: int = 1) -> str:
-    caller = inspect.getframeinfo(inspect.stack()[stack_level][0])
-    return f"{caller.filename}:{caller.lineno}"
+    caller = sys._getframe(stack_level)
+    return f"{caller.f_code.co_filename}:{caller.f_lineno}"
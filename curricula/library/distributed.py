@@ -0,0 +1,413 @@
+import os
+import sys
+import json
+import time
+import uuid
+import socket
+import threading
+
+from pathlib import Path
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
+from ..log import log, install_handler
+from . import process
+from .runcache import encode, decode
+
+__all__ = (
+    "Job",
+    "JobResult",
+    "DirectoryBroker",
+    "Coordinator",
+    "Worker",
+    "register",
+    "HANDLERS")
+
+
+@dataclass(eq=False)
+class Job:
+    """A unit of work and the data needed to run it on any node."""
+
+    kind: str
+    payload: dict
+    id: str = field(default_factory=lambda: f"{time.time_ns():020d}-{uuid.uuid4().hex}")
+    attempts: int = 0
+
+    def dump(self) -> dict:
+        """Serialize to JSON-compatible data."""
+
+        return dict(id=self.id, kind=self.kind, payload=self.payload, attempts=self.attempts)
+
+    @classmethod
+    def load(cls, data: dict) -> "Job":
+        """Deserialize."""
+
+        return cls(id=data["id"], kind=data["kind"], payload=data["payload"], attempts=data["attempts"])
+
+
+@dataclass(eq=False)
+class JobResult:
+    """Outcome of a job, either the handler's dump or an error."""
+
+    id: str
+    kind: str
+    worker: Optional[str]
+    attempts: int
+    result: Optional[dict] = None
+    error: Optional[str] = None
+
+    def dump(self) -> dict:
+        """Serialize to JSON-compatible data."""
+
+        return dict(
+            id=self.id,
+            kind=self.kind,
+            worker=self.worker,
+            attempts=self.attempts,
+            result=self.result,
+            error=self.error)
+
+    @classmethod
+    def load(cls, data: dict) -> "JobResult":
+        """Deserialize."""
+
+        return cls(**data)
+
+    def runtime(self) -> Optional[process.Runtime]:
+        """Load the result of a process job."""
+
+        return process.Runtime.load_encoded(self.result) if self.result is not None else None
+
+
+def run_process_job(payload: dict) -> dict:
+    """Run a process job and dump its runtime with its exact output."""
+
+    return process.run(
+        *payload["args"],
+        stdin=decode(payload.get("stdin")),
+        timeout=payload.get("timeout"),
+        cwd=Path(payload["cwd"]) if payload.get("cwd") is not None else None).dump_encoded()
+
+
+# Handlers by job kind, plugins may register their own such as grading
+HANDLERS: Dict[str, Callable[[dict], dict]] = {"process": run_process_job}
+
+
+def register(kind: str, handler: Callable[[dict], dict]):
+    """Make a job kind runnable by workers in this process."""
+
+    HANDLERS[kind] = handler
+
+
+def write_temporary(path: Path, data: dict) -> Path:
+    """Write JSON beside a path under a name no other writer uses."""
+
+    temporary = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}")
+    with temporary.open("w") as file:
+        json.dump(data, file)
+    return temporary
+
+
+def write_atomic(path: Path, data: dict):
+    """Write JSON so that readers never see a partial file."""
+
+    os.replace(str(write_temporary(path, data)), str(path))
+
+
+class DirectoryBroker:
+    """Work queue kept in a directory that every node can reach.
+
+    Jobs are files in pending/. A worker claims one by atomically
+    renaming it into claimed/ and keeps the claim alive by touching it.
+    A claim that has not been touched within the lease is considered
+    lost and is moved back to pending/ for another attempt, up to a
+    limit. Results are written to results/. A claim that was presumed
+    lost may still finish, so the first result for a job is also linked
+    into done/ and any later one is discarded, even once the first has
+    been collected. This needs nothing but a local or network file
+    system, so it also works on a single machine.
+    """
+
+    path: Path
+    lease: float
+    max_attempts: int
+
+    def __init__(self, path: Path, lease: float = 30, max_attempts: int = 3):
+        self.path = path
+        self.lease = lease
+        self.max_attempts = max_attempts
+        for directory in (self.pending, self.claimed, self.results, self.done):
+            directory.mkdir(parents=True, exist_ok=True)
+
+    @property
+    def pending(self) -> Path:
+        return self.path.joinpath("pending")
+
+    @property
+    def claimed(self) -> Path:
+        return self.path.joinpath("claimed")
+
+    @property
+    def results(self) -> Path:
+        return self.path.joinpath("results")
+
+    @property
+    def done(self) -> Path:
+        return self.path.joinpath("done")
+
+    def _finish(self, result: JobResult) -> bool:
+        """Publish the first result for a job, False if one already was."""
+
+        path = self.results.joinpath(f"{result.id}.json")
+        temporary = write_temporary(path, result.dump())
+        try:
+            # Linking fails if the job is done, which makes this exclusive
+            os.link(str(temporary), str(self.done.joinpath(f"{result.id}.json")))
+        except FileExistsError:
+            os.remove(str(temporary))
+            log.info(f"discarding duplicate result of job {result.id} from {result.worker}")
+            return False
+        os.replace(str(temporary), str(path))
+        return True
+
+    def finished(self, id: str) -> bool:
+        """Whether a job already has a result."""
+
+        return self.done.joinpath(f"{id}.json").exists()
+
+    def submit(self, job: Job):
+        """Add a job to the queue."""
+
+        write_atomic(self.pending.joinpath(f"{job.id}.json"), job.dump())
+
+    def claim(self, worker: str) -> Optional[Job]:
+        """Take the oldest pending job, or None if there are none."""
+
+        for path in sorted(self.pending.glob("*.json")):
+            if self.finished(path.stem):
+                # Requeued before the claim presumed lost finished after all
+                try:
+                    os.remove(str(path))
+                except FileNotFoundError:
+                    pass
+                continue
+            claimed_path = self.claimed.joinpath(f"{path.stem}.{worker}.json")
+            try:
+                os.rename(str(path), str(claimed_path))
+            except FileNotFoundError:
+                continue
+            os.utime(str(claimed_path))
+            with claimed_path.open() as file:
+                return Job.load(json.load(file))
+        return None
+
+    def _claimed_path(self, job: Job, worker: str) -> Path:
+        return self.claimed.joinpath(f"{job.id}.{worker}.json")
+
+    def heartbeat(self, job: Job, worker: str) -> bool:
+        """Extend the lease on a claimed job, False if it was lost."""
+
+        try:
+            os.utime(str(self._claimed_path(job, worker)))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def complete(self, job: Job, worker: str, result: JobResult):
+        """Record the result unless one was already, and release the claim."""
+
+        self._finish(result)
+        try:
+            os.remove(str(self._claimed_path(job, worker)))
+        except FileNotFoundError:
+            pass
+
+    def requeue_expired(self) -> int:
+        """Return lost claims to the queue, failing jobs out of attempts."""
+
+        requeued = 0
+        now = time.time()
+        for path in self.claimed.glob("*.json"):
+            try:
+                if now - path.stat().st_mtime < self.lease:
+                    continue
+                with path.open() as file:
+                    job = Job.load(json.load(file))
+                os.remove(str(path))
+            except (FileNotFoundError, ValueError):
+                continue
+
+            job.attempts += 1
+            worker = path.stem.split(".", 1)[1] if "." in path.stem else None
+            if self.finished(job.id):
+                continue
+            if job.attempts >= self.max_attempts:
+                log.warning(f"job {job.id} failed after {job.attempts} lost attempts")
+                self._finish(JobResult(
+                    id=job.id,
+                    kind=job.kind,
+                    worker=worker,
+                    attempts=job.attempts,
+                    error="worker lost too many times"))
+            else:
+                log.info(f"requeueing job {job.id} lost by {worker}")
+                self.submit(job)
+                requeued += 1
+        return requeued
+
+    def collect(self, ids: Optional[Iterable[str]] = None) -> List[JobResult]:
+        """Remove and return any finished results, optionally filtered."""
+
+        wanted = set(ids) if ids is not None else None
+        results = []
+        for path in sorted(self.results.glob("*.json")):
+            if wanted is not None and path.stem not in wanted:
+                continue
+            try:
+                with path.open() as file:
+                    results.append(JobResult.load(json.load(file)))
+                os.remove(str(path))
+            except (FileNotFoundError, ValueError):
+                continue
+        return results
+
+
+class Coordinator:
+    """Submits jobs and streams back their results."""
+
+    broker: DirectoryBroker
+    poll: float
+
+    def __init__(self, broker: DirectoryBroker, poll: float = 0.05):
+        self.broker = broker
+        self.poll = poll
+
+    def submit(self, kind: str, payload: dict) -> str:
+        """Queue a job of any registered kind."""
+
+        job = Job(kind=kind, payload=payload)
+        self.broker.submit(job)
+        return job.id
+
+    def submit_process(self, *args: str, stdin: bytes = None, timeout: float = None, cwd: Path = None) -> str:
+        """Queue a process.run call."""
+
+        return self.submit("process", dict(
+            args=list(args),
+            stdin=encode(stdin),
+            timeout=timeout,
+            cwd=str(cwd) if cwd is not None else None))
+
+    def results(self, ids: Iterable[str], timeout: float = None) -> Iterator[JobResult]:
+        """Yield results as they arrive until all are in or time runs out."""
+
+        remaining = set(ids)
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while remaining:
+            for result in self.broker.collect(remaining):
+                remaining.discard(result.id)
+                yield result
+            if not remaining:
+                break
+            if deadline is not None and time.monotonic() > deadline:
+                raise TimeoutError(f"{len(remaining)} jobs did not finish in time")
+            self.broker.requeue_expired()
+            time.sleep(self.poll)
+
+
+class Worker:
+    """Claims jobs from a broker and runs them with registered handlers."""
+
+    broker: DirectoryBroker
+    name: str
+    poll: float
+
+    _stopping: threading.Event
+
+    def __init__(self, broker: DirectoryBroker, name: str = None, poll: float = 0.05):
+        self.broker = broker
+        self.name = name or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.poll = poll
+        self._stopping = threading.Event()
+
+    def _keep_alive(self, job: Job, done: threading.Event):
+        """Heartbeat the claim at a fraction of the lease."""
+
+        while not done.wait(self.broker.lease / 3):
+            if not self.broker.heartbeat(job, self.name):
+                break
+
+    def execute(self, job: Job):
+        """Run a single claimed job and report the result."""
+
+        from . import profile
+
+        done = threading.Event()
+        heartbeat = threading.Thread(target=self._keep_alive, args=(job, done), daemon=True)
+        heartbeat.start()
+
+        result = JobResult(id=job.id, kind=job.kind, worker=self.name, attempts=job.attempts + 1)
+        try:
+            handler = HANDLERS.get(job.kind)
+            if handler is None:
+                result.error = f"no handler for job kind {job.kind}"
+            else:
+                with profile.phase(f"job {job.kind}"):
+                    result.result = handler(job.payload)
+        except Exception as exception:
+            log.exception(f"job {job.id} raised an exception")
+            result.error = f"{type(exception).__name__}: {exception}"
+        finally:
+            done.set()
+            heartbeat.join()
+
+        self.broker.complete(job, self.name, result)
+
+    def run(self, max_jobs: int = None, idle_timeout: float = None) -> int:
+        """Process jobs until stopped, out of jobs, or idle too long."""
+
+        count = 0
+        idle_since = time.monotonic()
+        while not self._stopping.is_set() and (max_jobs is None or count < max_jobs):
+            job = self.broker.claim(self.name)
+            if job is None:
+                if idle_timeout is not None and time.monotonic() - idle_since > idle_timeout:
+                    break
+                self.broker.requeue_expired()
+                self._stopping.wait(self.poll)
+                continue
+
+            self.execute(job)
+            count += 1
+            idle_since = time.monotonic()
+        return count
+
+    def stop(self):
+        """Finish the current job and return from run."""
+
+        self._stopping.set()
+
+
+def main() -> int:
+    """Run a worker node against a shared queue directory."""
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run a curricula grading worker")
+    parser.add_argument("path", help="shared queue directory")
+    parser.add_argument("-n", "--name", default=None)
+    parser.add_argument("--lease", type=float, default=30)
+    parser.add_argument("--max-jobs", type=int, default=None)
+    parser.add_argument("--idle-timeout", type=float, default=None)
+    args = parser.parse_args()
+
+    install_handler()
+    broker = DirectoryBroker(Path(args.path), lease=args.lease)
+    worker = Worker(broker, name=args.name)
+    log.info(f"worker {worker.name} serving {broker.path}")
+    worker.run(max_jobs=args.max_jobs, idle_timeout=args.idle_timeout)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
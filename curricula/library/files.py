@@ -1,6 +1,5 @@
 import os
 import shutil
-import distutils.dir_util
 from pathlib import Path
 
 
@@ -46,7 +45,7 @@ def copy_directory(source: Path, destination: Path, merge: bool = False):
     """Copy all files recursively."""
 
     if merge:
-        distutils.dir_util.copy_tree(str(source), str(destination))
+        shutil.copytree(str(source), str(destination), dirs_exist_ok=True)
     else:
         if destination.exists():
             delete(destination)
@@ -1,22 +1,37 @@
 import importlib.util
+import sys
+import threading
 from importlib import import_module
 
 from pathlib import Path
-from typing import Any
+from types import CodeType, ModuleType
+from typing import Any, Callable, Dict, NamedTuple, Optional, Tuple, TypeVar
 
 __all__ = (
     "import_module",
     "import_file_at_path",
     "import_module_at_path",
-    "import_file_or_module_at_path")
+    "import_file_or_module_at_path",
+    "ModuleCache",
+    "module_cache")
+
+T = TypeVar("T")
 
 
 def import_file_at_path(path: Path, module_name: str = None) -> Any:
-    """Assumes the path is a file that exists."""
+    """Assumes the path is a file that exists.
+
+    A module preloaded into module_cache is returned instead of being
+    imported again, see ModuleCache.preloaded.
+    """
 
     if module_name is None:
         module_name = path.parts[-1].split(".", maxsplit=1)[0]
 
+    module = module_cache.preloaded(path, module_name)
+    if module is not None:
+        return module
+
     spec = importlib.util.spec_from_file_location(module_name, str(path))
     module = importlib.util.module_from_spec(spec)
     spec.loader.exec_module(module)
@@ -24,11 +39,15 @@ def import_file_at_path(path: Path, module_name: str = None) -> Any:
 
 
 def import_module_at_path(path: Path, module_name: str = None) -> Any:
-    """Assumes that __init__.py exists in the directory."""
+    """Assumes that __init__.py exists in the directory, preloaded like files."""
 
     if module_name is None:
         module_name = path.parts[-1]
 
+    module = module_cache.preloaded(path.joinpath("__init__.py"), module_name)
+    if module is not None:
+        return module
+
     spec = importlib.util.spec_from_file_location(module_name, str(path.joinpath("__init__.py")))
     module = importlib.util.module_from_spec(spec)
     spec.loader.exec_module(module)
@@ -41,3 +60,182 @@ def import_file_or_module_at_path(path: Path, module_name: str = None) -> Any:
     if path.joinpath("__init__.py").is_file():
         return import_module_at_path(path, module_name=module_name)
     return import_file_at_path(Path(*path.parts[:-1], path.parts[-1] + ".py"), module_name=module_name)
+
+
+class ModuleCacheEntry(NamedTuple):
+    """Compiled code and executed module for a single source file."""
+
+    module_name: str
+    stamp: Tuple[int, int]
+    code: CodeType
+    module: ModuleType
+
+
+class ModuleCache:
+    """Reuse compiled code and imported modules across imports of a file.
+
+    Entries are keyed on the resolved source path and are only reused
+    while the file's modification time and size are unchanged. Imported
+    modules are registered in sys.modules under their module name. If
+    fresh is requested, the cached code object is executed into a new
+    module so that each caller gets clean module state without paying
+    to read and compile the source again. To skip executing it as well,
+    call_forked runs a function against the imported module in a child
+    forked from this process, so whatever it changes is thrown away.
+
+    Modules in the default module_cache are also what the plain import
+    functions return while the source is unchanged. The server preloads
+    tests this way so that each job, forked from it, starts with the
+    module already imported and any state it changes is its own.
+    """
+
+    _entries: Dict[Path, ModuleCacheEntry]
+    _lock: threading.RLock
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def _stamp(path: Path) -> Tuple[int, int]:
+        """Identify the version of a file on disk."""
+
+        stat = path.stat()
+        return stat.st_mtime_ns, stat.st_size
+
+    @staticmethod
+    def _execute(path: Path, module_name: str, code: CodeType) -> ModuleType:
+        """Create a new module from already compiled code."""
+
+        spec = importlib.util.spec_from_file_location(module_name, str(path))
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[module_name] = module
+        try:
+            exec(code, module.__dict__)
+        except BaseException:
+            sys.modules.pop(module_name, None)
+            raise
+        return module
+
+    def _import(self, path: Path, module_name: str, fresh: bool) -> ModuleType:
+        """Check the cache before compiling and executing the source."""
+
+        path = path.resolve()
+        stamp = self._stamp(path)
+
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry.stamp == stamp and entry.module_name == module_name:
+                if not fresh:
+                    sys.modules[module_name] = entry.module
+                    return entry.module
+                return self._execute(path, module_name, entry.code)
+
+            spec = importlib.util.spec_from_file_location(module_name, str(path))
+            code = spec.loader.get_code(module_name)
+            module = self._execute(path, module_name, code)
+            self._entries[path] = ModuleCacheEntry(module_name=module_name, stamp=stamp, code=code, module=module)
+            return module
+
+    def preloaded(self, path: Path, module_name: str) -> Optional[ModuleType]:
+        """The cached module for an unchanged source file, if any."""
+
+        if not self._entries:
+            return None
+        path = path.resolve()
+        with self._lock:
+            entry = self._entries.get(path)
+        if entry is None or entry.module_name != module_name:
+            return None
+        try:
+            if entry.stamp != self._stamp(path):
+                return None
+        except FileNotFoundError:
+            return None
+        sys.modules[module_name] = entry.module
+        return entry.module
+
+    def import_file_at_path(self, path: Path, module_name: str = None, fresh: bool = False) -> Any:
+        """Cached variant of import_file_at_path."""
+
+        if module_name is None:
+            module_name = path.parts[-1].split(".", maxsplit=1)[0]
+        return self._import(path, module_name, fresh)
+
+    def import_module_at_path(self, path: Path, module_name: str = None, fresh: bool = False) -> Any:
+        """Cached variant of import_module_at_path."""
+
+        if module_name is None:
+            module_name = path.parts[-1]
+        return self._import(path.joinpath("__init__.py"), module_name, fresh)
+
+    def import_file_or_module_at_path(self, path: Path, module_name: str = None, fresh: bool = False) -> Any:
+        """Cached variant of import_file_or_module_at_path."""
+
+        if path.joinpath("__init__.py").is_file():
+            return self.import_module_at_path(path, module_name=module_name, fresh=fresh)
+        return self.import_file_at_path(
+            Path(*path.parts[:-1], path.parts[-1] + ".py"),
+            module_name=module_name,
+            fresh=fresh)
+
+    def call_forked(self, path: Path, function: Callable[[ModuleType], T], module_name: str = None) -> T:
+        """Call a function with the module in a forked child.
+
+        The module is imported here first, so the child starts with it
+        executed. The return value, or exception, is pickled back.
+        """
+
+        import os
+        import pickle
+
+        module = self.import_file_or_module_at_path(path, module_name=module_name)
+        read, write = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                os.close(read)
+                try:
+                    outcome = (True, function(module))
+                except BaseException as exception:
+                    outcome = (False, exception)
+                try:
+                    data = pickle.dumps(outcome)
+                except Exception as exception:
+                    data = pickle.dumps((False, RuntimeError(f"unpicklable result: {exception}")))
+                with os.fdopen(write, "wb") as file:
+                    file.write(data)
+            except BaseException:
+                code = 1
+            finally:
+                os._exit(code)
+
+        os.close(write)
+        with os.fdopen(read, "rb") as file:
+            data = file.read()
+        os.waitpid(pid, 0)
+        if not data:
+            raise ChildProcessError(f"child calling into {module.__name__} exited without a result")
+        succeeded, value = pickle.loads(data)
+        if not succeeded:
+            raise value
+        return value
+
+    def invalidate(self, path: Optional[Path] = None):
+        """Drop the entry for a source file or package, or all entries."""
+
+        with self._lock:
+            if path is None:
+                paths = list(self._entries)
+            else:
+                path = path.resolve()
+                paths = [path, path.joinpath("__init__.py"), path.with_name(path.name + ".py")]
+
+            for key in paths:
+                entry = self._entries.pop(key, None)
+                if entry is not None and sys.modules.get(entry.module_name) is entry.module:
+                    del sys.modules[entry.module_name]
+
+
+module_cache = ModuleCache()
@@ -1,5 +1,3 @@
-import inspect
-
 from typing import Callable, TypeVar
 
 __all__ = ("inject",)
@@ -10,6 +8,8 @@ T = TypeVar("T")
 def inject(resources: dict, function: Callable[[None], T]) -> T:
     """Inject resources into the function by name."""
 
+    import inspect
+
     dependencies = {}
     for name, parameter in inspect.signature(function).parameters.items():
         dependency = resources.get(name, parameter.default)
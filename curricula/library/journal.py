@@ -0,0 +1,224 @@
+import os
+import json
+import time
+import zlib
+import threading
+
+from pathlib import Path
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+from ..log import log
+
+__all__ = (
+    "JournalEntry",
+    "Journal")
+
+# Bumped whenever the entry format changes
+VERSION = 1
+
+
+@dataclass(eq=False)
+class JournalEntry:
+    """A completed unit of work and its serialized result."""
+
+    key: str
+    result: Any
+    time: float
+
+    def dump(self) -> dict:
+        """Serialize."""
+
+        return dict(key=self.key, result=self.result, time=self.time)
+
+    @classmethod
+    def load(cls, data: dict) -> "JournalEntry":
+        """Deserialize."""
+
+        return cls(key=data["key"], result=data["result"], time=data["time"])
+
+
+def encode_line(entry: JournalEntry) -> bytes:
+    """One line of JSON prefixed by its checksum."""
+
+    data = json.dumps(entry.dump(), separators=(",", ":")).encode()
+    return b"%08x " % zlib.crc32(data) + data + b"\n"
+
+
+def decode_line(line: bytes) -> Optional[JournalEntry]:
+    """Parse a line, or None if it's torn or corrupt."""
+
+    if len(line) < 10 or not line.endswith(b"\n") or line[8:9] != b" ":
+        return None
+    data = line[9:-1]
+    try:
+        if int(line[:8], 16) != zlib.crc32(data):
+            return None
+        return JournalEntry.load(json.loads(data))
+    except (ValueError, KeyError):
+        return None
+
+
+def read_journal(path: Path) -> Tuple[Dict[str, JournalEntry], int]:
+    """Every intact entry and the offset just past the last one.
+
+    A crash can leave the final line partially written, and everything
+    from the first bad line on is ignored. A file that isn't a journal
+    in this format raises ValueError rather than being overwritten.
+    """
+
+    entries: Dict[str, JournalEntry] = {}
+    offset = 0
+    try:
+        file = path.open("rb")
+    except FileNotFoundError:
+        return entries, 0
+
+    with file:
+        header = file.readline()
+        if not header:
+            return entries, 0
+        if header != b"curricula-journal %d\n" % VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} journal, refusing to overwrite it")
+        offset = len(header)
+        for line in file:
+            entry = decode_line(line)
+            if entry is None:
+                log.warning(f"journal {path} is damaged after {len(entries)} entries, resuming from there")
+                break
+            entries[entry.key] = entry
+            offset += len(line)
+    return entries, offset
+
+
+class Journal:
+    """Append-only record of completed work that survives crashes.
+
+    Each completed unit is appended as one checksummed line of JSON
+    holding its key and serialized result. Appends are flushed to the
+    kernel immediately, so only a machine crash can lose them, and are
+    synced to disk within sync_interval seconds, by a timer if nothing
+    else is recorded meanwhile, bounding what a power loss or reboot can
+    undo. A sync_interval of zero syncs every
+    entry and None only syncs on close. Reopening the journal loads what
+    finished, drops any torn final line and continues appending, so an
+    interrupted batch only redoes work that never made it in.
+    """
+
+    path: Path
+    sync_interval: Optional[float]
+
+    _entries: Dict[str, JournalEntry]
+    _file: Any
+    _last_sync: float
+    _dirty: bool
+    _timer: Optional[threading.Timer]
+    _lock: threading.Lock
+
+    def __init__(self, path: Path, sync_interval: Optional[float] = 1.0):
+        self.path = path
+        self.sync_interval = sync_interval
+        self._lock = threading.Lock()
+        self._timer = None
+        self._entries, offset = read_journal(path)
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        created = not path.exists()
+        self._file = path.open("r+b" if not created else "wb")
+        self._file.truncate(offset)
+        self._file.seek(offset)
+        if offset == 0:
+            self._file.write(b"curricula-journal %d\n" % VERSION)
+        self._sync()
+
+        # Make sure the journal itself survives a crash
+        if created:
+            directory = os.open(str(path.parent), os.O_RDONLY)
+            try:
+                os.fsync(directory)
+            finally:
+                os.close(directory)
+
+        if self._entries:
+            log.info(f"resuming from journal {path} with {len(self._entries)} completed")
+
+    def _sync(self):
+        """Flush and force everything written so far to disk."""
+
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._last_sync = time.monotonic()
+        self._dirty = False
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __iter__(self) -> Iterator[JournalEntry]:
+        return iter(list(self._entries.values()))
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """The result recorded for a key."""
+
+        entry = self._entries.get(key)
+        return entry.result if entry is not None else default
+
+    def results(self) -> Dict[str, Any]:
+        """Every recorded result by key, for rebuilding aggregates."""
+
+        return {key: entry.result for key, entry in self._entries.items()}
+
+    def record(self, key: str, result: Any):
+        """Append a completed unit, its result must be JSON serializable."""
+
+        entry = JournalEntry(key=key, result=result, time=time.time())
+        line = encode_line(entry)
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            self._entries[key] = entry
+            self._dirty = True
+            if self.sync_interval is None:
+                return
+            remaining = self._last_sync + self.sync_interval - time.monotonic()
+            if remaining <= 0:
+                self._sync()
+            elif self._timer is None:
+                # Don't leave the entry unsynced until the next one arrives
+                self._timer = threading.Timer(remaining, self._sync_due)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def _sync_due(self):
+        """Sync entries left pending since the last record, from the timer."""
+
+        with self._lock:
+            self._timer = None
+            if self._dirty and not self._file.closed:
+                self._sync()
+
+    def sync(self):
+        """Force pending entries to disk now."""
+
+        with self._lock:
+            if self._dirty:
+                self._sync()
+
+    def close(self):
+        """Sync and close."""
+
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if not self._file.closed:
+                self._sync()
+                self._file.close()
+
+    def __enter__(self) -> "Journal":
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
@@ -0,0 +1,538 @@
+import os
+import sys
+import json
+import time
+import socket
+import selectors
+import subprocess
+import threading
+
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Optional, Sequence, Tuple, List, Dict, IO, Union
+
+__all__ = (
+    "Launcher",
+    "SpawnedProcess",
+    "PosixSpawnLauncher",
+    "ForkServerLauncher",
+    "get_launcher",
+    "set_launcher",
+    "LAUNCHER_ENVIRONMENT_VARIABLE")
+
+LAUNCHER_ENVIRONMENT_VARIABLE = "CURRICULA_LAUNCHER"
+
+# Size of each read from a child's output pipe
+READ_SIZE = 32768
+
+# Size of each write to a child's input pipe
+WRITE_SIZE = 512
+
+
+class SpawnedProcess(ABC):
+    """A child process started without subprocess.Popen.
+
+    Implements the subset of the Popen interface used by process.run and
+    Interactive, namely the standard stream files, poll, communicate,
+    kill and returncode, so that results are built exactly the same way
+    regardless of how the process was started.
+    """
+
+    args: Tuple[str, ...]
+    pid: int
+    returncode: Optional[int]
+
+    stdin: Optional[IO[bytes]]
+    stdout: IO[bytes]
+    stderr: IO[bytes]
+
+    _input: Optional[memoryview]
+    _output: Dict[IO[bytes], List[bytes]]
+    _selector: Optional[selectors.BaseSelector]
+
+    def __init__(self, args: Tuple[str, ...], pid: int, stdin: Optional[int], stdout: int, stderr: int):
+        self.args = args
+        self.pid = pid
+        self.returncode = None
+        self.stdin = os.fdopen(stdin, "wb") if stdin is not None else None
+        self.stdout = os.fdopen(stdout, "rb")
+        self.stderr = os.fdopen(stderr, "rb")
+        self._input = None
+        self._output = {self.stdout: [], self.stderr: []}
+        self._selector = None
+
+    @abstractmethod
+    def _wait(self, timeout: Optional[float]) -> Optional[int]:
+        """Return the exit code if the process exits within the timeout."""
+
+    def _signal(self, signal_number: int):
+        """Deliver a signal to the process if it has not been reaped."""
+
+        if self.returncode is None:
+            try:
+                os.kill(self.pid, signal_number)
+            except ProcessLookupError:
+                pass
+
+    def poll(self) -> Optional[int]:
+        """Check for exit without blocking."""
+
+        if self.returncode is None:
+            self.returncode = self._wait(0)
+        return self.returncode
+
+    def wait(self, timeout: float = None) -> int:
+        """Block until the process exits."""
+
+        if self.returncode is None:
+            self.returncode = self._wait(timeout)
+            if self.returncode is None:
+                raise subprocess.TimeoutExpired(self.args, timeout)
+        return self.returncode
+
+    def kill(self):
+        """Send SIGKILL."""
+
+        import signal
+        self._signal(signal.SIGKILL)
+
+    def terminate(self):
+        """Send SIGTERM."""
+
+        import signal
+        self._signal(signal.SIGTERM)
+
+    def _start_communication(self, data: Optional[bytes]):
+        """Register the pipes on first call to communicate."""
+
+        self._selector = selectors.DefaultSelector()
+        if self.stdin is not None and not self.stdin.closed:
+            try:
+                self.stdin.flush()
+            except BrokenPipeError:
+                pass
+            if data:
+                self._input = memoryview(data)
+                self._selector.register(self.stdin, selectors.EVENT_WRITE)
+            else:
+                self.stdin.close()
+        for file in (self.stdout, self.stderr):
+            if not file.closed:
+                self._selector.register(file, selectors.EVENT_READ)
+
+    def communicate(self, input: bytes = None, timeout: float = None) -> Tuple[bytes, bytes]:
+        """Send input, collect output until EOF, and wait for exit.
+
+        Like Popen, output collected before a timeout is kept and
+        returned by the next call.
+        """
+
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        if self._selector is None:
+            self._start_communication(input)
+
+        while self._selector.get_map():
+            remaining = deadline - time.monotonic() if deadline is not None else None
+            if remaining is not None and remaining <= 0:
+                raise subprocess.TimeoutExpired(self.args, timeout)
+
+            for key, events in self._selector.select(remaining):
+                if key.fileobj is self.stdin:
+                    try:
+                        written = os.write(key.fd, self._input[:WRITE_SIZE])
+                    except BrokenPipeError:
+                        written = len(self._input)
+                    self._input = self._input[written:]
+                    if not self._input:
+                        self._selector.unregister(key.fileobj)
+                        self.stdin.close()
+                else:
+                    data = os.read(key.fd, READ_SIZE)
+                    if data:
+                        self._output[key.fileobj].append(data)
+                    else:
+                        self._selector.unregister(key.fileobj)
+                        key.fileobj.close()
+        self._selector.close()
+
+        remaining = deadline - time.monotonic() if deadline is not None else None
+        self.wait(max(remaining, 0) if remaining is not None else None)
+        return b"".join(self._output[self.stdout]), b"".join(self._output[self.stderr])
+
+
+# Either whether to pipe stdin or a descriptor to give the child as stdin
+Stdin = Union[bool, int]
+
+
+def _stdin_fd(stdin: Stdin) -> Optional[int]:
+    """The descriptor to give the child directly, if not piping."""
+
+    return stdin if not isinstance(stdin, bool) else None
+
+
+def _pipes(stdin: Stdin) -> Tuple[Optional[Tuple[int, int]], Tuple[int, int], Tuple[int, int]]:
+    """Create non-inheritable pipes for the standard streams."""
+
+    return os.pipe() if stdin is True else None, os.pipe(), os.pipe()
+
+
+def _close(*fds: Optional[int]):
+    """Close each descriptor that is not None."""
+
+    for fd in fds:
+        if fd is not None:
+            os.close(fd)
+
+
+class Launcher:
+    """Base class for strategies that start child processes."""
+
+    def spawn(self, args: Sequence[str], cwd: Optional[Path] = None, stdin: Stdin = True):
+        """Start a process with piped streams, may raise OSError.
+
+        Stdin may instead be an open descriptor, such as a file, which
+        the child reads directly. The caller keeps ownership of it.
+        """
+
+        fd = _stdin_fd(stdin)
+        return subprocess.Popen(
+            args,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            stdin=fd if fd is not None else subprocess.PIPE if stdin else None,
+            cwd=str(cwd) if cwd is not None else None)
+
+    def close(self):
+        """Release any resources held by the launcher."""
+
+
+class PosixSpawnedProcess(SpawnedProcess):
+    """A direct child started by os.posix_spawn."""
+
+    _pidfd: Optional[int] = None
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if hasattr(os, "pidfd_open"):
+            try:
+                self._pidfd = os.pidfd_open(self.pid)
+            except OSError:
+                self._pidfd = None
+
+    def _reap(self, flags: int) -> Optional[int]:
+        """Collect the exit status if available."""
+
+        pid, status = os.waitpid(self.pid, flags)
+        if pid == 0:
+            return None
+        if self._pidfd is not None:
+            os.close(self._pidfd)
+            self._pidfd = None
+        return os.waitstatus_to_exitcode(status)
+
+    def _wait(self, timeout: Optional[float]) -> Optional[int]:
+        """Block on the pidfd if possible, otherwise poll with backoff."""
+
+        if timeout is None:
+            return self._reap(0)
+
+        if self._pidfd is not None:
+            import select
+            readable, _, _ = select.select((self._pidfd,), (), (), timeout)
+            return self._reap(0) if readable else None
+
+        deadline = time.monotonic() + timeout
+        delay = 0.0005
+        while True:
+            returncode = self._reap(os.WNOHANG)
+            if returncode is not None:
+                return returncode
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            time.sleep(min(delay, remaining))
+            delay = min(delay * 2, 0.05)
+
+
+class PosixSpawnLauncher(Launcher):
+    """Start processes with os.posix_spawn when possible.
+
+    posix_spawn avoids copying the parent's page tables and, because
+    Python creates descriptors non-inheritable, it does not need to scan
+    and close open descriptors in the child. It has no way to change
+    the working directory, so those spawns fall back to Popen.
+    """
+
+    def spawn(self, args: Sequence[str], cwd: Optional[Path] = None, stdin: Stdin = True):
+        if cwd is not None or not hasattr(os, "posix_spawnp"):
+            return super().spawn(args, cwd=cwd, stdin=stdin)
+
+        stdin_pipe, stdout_pipe, stderr_pipe = _pipes(stdin)
+        file_actions = [(os.POSIX_SPAWN_DUP2, stdout_pipe[1], 1), (os.POSIX_SPAWN_DUP2, stderr_pipe[1], 2)]
+        if stdin_pipe is not None:
+            file_actions.append((os.POSIX_SPAWN_DUP2, stdin_pipe[0], 0))
+        elif _stdin_fd(stdin) is not None:
+            file_actions.append((os.POSIX_SPAWN_DUP2, _stdin_fd(stdin), 0))
+
+        try:
+            pid = os.posix_spawnp(args[0], list(args), os.environ, file_actions=file_actions)
+        except BaseException:
+            _close(stdout_pipe[0], stderr_pipe[0], stdin_pipe[1] if stdin_pipe else None)
+            raise
+        finally:
+            _close(stdout_pipe[1], stderr_pipe[1], stdin_pipe[0] if stdin_pipe else None)
+
+        return PosixSpawnedProcess(
+            tuple(args),
+            pid,
+            stdin=stdin_pipe[1] if stdin_pipe else None,
+            stdout=stdout_pipe[0],
+            stderr=stderr_pipe[0])
+
+
+def _send(connection: socket.socket, message: dict, fds: Sequence[int] = ()):
+    """Write a newline-delimited JSON message, optionally with descriptors."""
+
+    data = json.dumps(message).encode() + b"\n"
+    if fds:
+        socket.send_fds(connection, [data], list(fds))
+    else:
+        connection.sendall(data)
+
+
+class _MessageReader:
+    """Reassemble newline-delimited JSON messages from a socket."""
+
+    def __init__(self, connection: socket.socket):
+        self.connection = connection
+        self.buffer = b""
+
+    def receive(self, max_fds: int = 0) -> Tuple[Optional[dict], List[int]]:
+        """Block for the next message, returning None on EOF."""
+
+        fds = []
+        while b"\n" not in self.buffer:
+            if max_fds and not fds:
+                data, fds, _, _ = socket.recv_fds(self.connection, 65536, max_fds)
+            else:
+                data = self.connection.recv(65536)
+            if not data:
+                return None, fds
+            self.buffer += data
+
+        line, self.buffer = self.buffer.split(b"\n", 1)
+        return json.loads(line), fds
+
+
+def _serve_connection(connection: socket.socket):
+    """Handle a single spawn request for the fork server."""
+
+    with connection:
+        reader = _MessageReader(connection)
+        request, fds = reader.receive(max_fds=3)
+        if request is None:
+            _close(*fds)
+            return
+
+        stdin = fds[2] if len(fds) > 2 else subprocess.DEVNULL
+        try:
+            child = subprocess.Popen(
+                request["args"],
+                stdin=stdin,
+                stdout=fds[0],
+                stderr=fds[1],
+                cwd=request["cwd"],
+                env=request["env"])
+        except OSError as error:
+            _send(connection, dict(errno=error.errno, strerror=error.strerror))
+            return
+        except (ValueError, subprocess.SubprocessError) as error:
+            _send(connection, dict(errno=None, strerror=str(error)))
+            return
+        finally:
+            _close(*fds)
+
+        _send(connection, dict(pid=child.pid))
+        _send(connection, dict(returncode=child.wait()))
+
+
+def serve(path: str):
+    """Run the fork server until its controlling pipe closes."""
+
+    def watch_parent():
+        sys.stdin.buffer.read()
+        os._exit(0)
+
+    threading.Thread(target=watch_parent, daemon=True).start()
+
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(path)
+    listener.listen(128)
+    while True:
+        connection, _ = listener.accept()
+        threading.Thread(target=_serve_connection, args=(connection,), daemon=True).start()
+
+
+class ForkServerProcess(SpawnedProcess):
+    """A child started by the fork server, which reports its exit."""
+
+    _connection: socket.socket
+    _reader: _MessageReader
+
+    def __init__(self, *args, connection: socket.socket, reader: _MessageReader, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._connection = connection
+        self._reader = reader
+
+    def _wait(self, timeout: Optional[float]) -> Optional[int]:
+        """Wait for the server to send the exit status."""
+
+        self._connection.settimeout(timeout)
+        try:
+            message, _ = self._reader.receive()
+        except (socket.timeout, BlockingIOError):
+            return None
+        finally:
+            self._connection.settimeout(None)
+
+        self._connection.close()
+        if message is None:
+            raise OSError("fork server closed the connection")
+        return message["returncode"]
+
+
+class ForkServerLauncher(Launcher):
+    """Send spawn requests to a small helper process started up front.
+
+    The server is a fresh interpreter that only imports what it needs to
+    spawn, so the cost of each spawn is independent of how large the
+    grading process has grown. Pipes are created here and passed to the
+    server over a Unix socket, and the server reports the child's pid
+    and exit status back. The server exits when this process does.
+    """
+
+    path: Path
+    _directory: Path
+    _server: subprocess.Popen
+
+    def __init__(self, startup_timeout: float = 10):
+        import tempfile
+
+        self._directory = Path(tempfile.mkdtemp(prefix="curricula-fork-server-"))
+        self.path = self._directory.joinpath("socket")
+
+        package_root = str(Path(__file__).absolute().parent.parent.parent)
+        environment = dict(os.environ)
+        environment["PYTHONPATH"] = os.pathsep.join(filter(None, (package_root, environment.get("PYTHONPATH"))))
+        self._server = subprocess.Popen(
+            (sys.executable, "-c", "import sys; from curricula.library.launcher import serve; serve(sys.argv[1])",
+             str(self.path)),
+            stdin=subprocess.PIPE,
+            stdout=subprocess.DEVNULL,
+            env=environment,
+            cwd="/")
+
+        deadline = time.monotonic() + startup_timeout
+        while not self.path.exists():
+            if self._server.poll() is not None or time.monotonic() > deadline:
+                self.close()
+                raise RuntimeError("fork server failed to start")
+            time.sleep(0.001)
+
+    def spawn(self, args: Sequence[str], cwd: Optional[Path] = None, stdin: Stdin = True):
+        stdin_pipe, stdout_pipe, stderr_pipe = _pipes(stdin)
+        child_fds = [stdout_pipe[1], stderr_pipe[1]]
+        if stdin_pipe is not None:
+            child_fds.append(stdin_pipe[0])
+        else:
+            # Duplicate so the caller's descriptor survives closing ours,
+            # falling back to our own stdin like Popen does
+            try:
+                child_fds.append(os.dup(_stdin_fd(stdin) if _stdin_fd(stdin) is not None else 0))
+            except OSError:
+                pass
+        parent_fds = [stdout_pipe[0], stderr_pipe[0]] + ([stdin_pipe[1]] if stdin_pipe else [])
+
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        reader = _MessageReader(connection)
+        try:
+            connection.connect(str(self.path))
+            # The server runs elsewhere, so send what the child would inherit
+            _send(connection, dict(
+                args=list(args),
+                cwd=str(cwd) if cwd is not None else os.getcwd(),
+                env=dict(os.environ)), child_fds)
+            message, _ = reader.receive()
+        except BaseException:
+            connection.close()
+            _close(*parent_fds)
+            raise
+        finally:
+            _close(*child_fds)
+
+        if message is None or "pid" not in message:
+            connection.close()
+            _close(*parent_fds)
+            if message is not None and message["errno"] is not None:
+                raise OSError(message["errno"], message["strerror"])
+            raise subprocess.SubprocessError(message["strerror"] if message else "fork server closed the connection")
+
+        return ForkServerProcess(
+            tuple(args),
+            message["pid"],
+            stdin=stdin_pipe[1] if stdin_pipe else None,
+            stdout=stdout_pipe[0],
+            stderr=stderr_pipe[0],
+            connection=connection,
+            reader=reader)
+
+    def close(self):
+        """Stop the server and remove its socket."""
+
+        import shutil
+
+        if self._server.poll() is None:
+            self._server.stdin.close()
+            try:
+                self._server.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self._server.kill()
+                self._server.wait()
+        shutil.rmtree(str(self._directory), ignore_errors=True)
+
+
+LAUNCHERS = {
+    "subprocess": Launcher,
+    "posix_spawn": PosixSpawnLauncher,
+    "fork_server": ForkServerLauncher,
+}
+
+launcher: Optional[Launcher] = None
+_lock = threading.Lock()
+
+
+def set_launcher(new: Optional[Launcher]):
+    """Replace the launcher used by process.run and Interactive."""
+
+    global launcher
+    with _lock:
+        if launcher is not None and launcher is not new:
+            launcher.close()
+        launcher = new
+
+
+def get_launcher() -> Launcher:
+    """Get the current launcher, creating it from the environment if unset."""
+
+    global launcher
+    if launcher is None:
+        with _lock:
+            if launcher is None:
+                import atexit
+
+                name = os.environ.get(LAUNCHER_ENVIRONMENT_VARIABLE, "subprocess")
+                if name not in LAUNCHERS:
+                    raise ValueError(f"unknown launcher {name}, expected one of {', '.join(LAUNCHERS)}")
+                launcher = LAUNCHERS[name]()
+                atexit.register(lambda: set_launcher(None))
+    return launcher
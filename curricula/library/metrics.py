@@ -0,0 +1,414 @@
+import os
+import math
+import atexit
+import threading
+
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Union, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from http.server import ThreadingHTTPServer
+
+__all__ = (
+    "Counter",
+    "Gauge",
+    "Histogram",
+    "Registry",
+    "registry",
+    "counter",
+    "gauge",
+    "histogram",
+    "enable",
+    "enable_from_environment",
+    "METRICS_ENVIRONMENT_VARIABLE")
+
+METRICS_ENVIRONMENT_VARIABLE = "CURRICULA_METRICS"
+
+# Latency buckets in seconds, from a fast spawn to a slow test
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+Labels = Tuple[str, ...]
+
+
+def escape(value: str) -> str:
+    """Escape a label value for the text format."""
+
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(names: Sequence[str], values: Sequence[str], extra: Iterable[Tuple[str, str]] = ()) -> str:
+    """Render labels as {name="value",...} or nothing."""
+
+    pairs = [f'{name}="{escape(value)}"' for name, value in zip(names, values)]
+    pairs.extend(f'{name}="{escape(value)}"' for name, value in extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def format_value(value: float) -> str:
+    """Render a sample value."""
+
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, int) or value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class Metric(ABC):
+    """Base class for a named family of samples keyed by labels."""
+
+    kind = "untyped"
+
+    name: str
+    help: str
+    label_names: Labels
+
+    _lock: threading.Lock
+
+    def __init__(self, name: str, help: str, label_names: Labels = ()):
+        self.name = name
+        self.help = help
+        self.label_names = label_names
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Labels:
+        """Order label values by the declared names."""
+
+        if len(labels) != len(self.label_names):
+            raise ValueError(f"{self.name} expects labels {self.label_names}")
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def render(self) -> List[str]:
+        """Lines of the text exposition format."""
+
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return lines
+
+    @abstractmethod
+    def _samples(self) -> List[str]:
+        """Sample lines without the header."""
+
+    def reset(self):
+        """Forget every sample, keeping the definition."""
+
+        with self._lock:
+            self._values = {}
+
+    def snapshot(self) -> list:
+        """Every sample as JSON-compatible data for merge."""
+
+        with self._lock:
+            return [[list(key), value] for key, value in self._values.items()]
+
+    @abstractmethod
+    def merge(self, snapshot: list):
+        """Add samples taken from the same metric in another process."""
+
+
+class Counter(Metric):
+    """Monotonically increasing count."""
+
+    kind = "counter"
+
+    _values: Dict[Labels, float]
+
+    def __init__(self, name: str, help: str, label_names: Labels = ()):
+        super().__init__(name, help, label_names)
+        self._values = {} if label_names else {(): 0}
+
+    def inc(self, amount: float = 1, **labels: str):
+        """Add to the count."""
+
+        key = self._key(labels) if labels or self.label_names else ()
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        """Current count."""
+
+        return self._values.get(self._key(labels) if labels or self.label_names else (), 0)
+
+    def merge(self, snapshot: list):
+        """Add counts, gauges are merged the same way as changes."""
+
+        with self._lock:
+            for key, value in snapshot:
+                key = tuple(key)
+                self._values[key] = self._values.get(key, 0) + value
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{format_labels(self.label_names, key)} {format_value(value)}" for key, value in items]
+
+
+class Gauge(Counter):
+    """Value that can go up and down."""
+
+    kind = "gauge"
+
+    def set(self, value: float, **labels: str):
+        """Replace the value."""
+
+        key = self._key(labels) if labels or self.label_names else ()
+        with self._lock:
+            self._values[key] = value
+
+    def dec(self, amount: float = 1, **labels: str):
+        """Subtract from the value."""
+
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    """Distribution of observations in cumulative buckets."""
+
+    kind = "histogram"
+
+    buckets: Tuple[float, ...]
+
+    _values: Dict[Labels, Tuple[List[int], List[float]]]
+
+    def __init__(self, name: str, help: str, label_names: Labels = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, label_names)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {} if label_names else {(): ([0] * (len(self.buckets) + 1), [0.0])}
+
+    def observe(self, value: float, **labels: str):
+        """Record a single observation."""
+
+        key = self._key(labels) if labels or self.label_names else ()
+
+        # Binary search for the first bucket the value fits in
+        low, high = 0, len(self.buckets)
+        while low < high:
+            middle = (low + high) // 2
+            if value <= self.buckets[middle]:
+                high = middle
+            else:
+                low = middle + 1
+
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = ([0] * (len(self.buckets) + 1), [0.0])
+            entry[0][low] += 1
+            entry[1][0] += value
+
+    def count(self, **labels: str) -> int:
+        """Number of observations."""
+
+        entry = self._values.get(self._key(labels) if labels or self.label_names else ())
+        return sum(entry[0]) if entry is not None else 0
+
+    def snapshot(self) -> list:
+        """Every sample as JSON-compatible data for merge."""
+
+        with self._lock:
+            return [[list(key), [list(counts), total[0]]] for key, (counts, total) in self._values.items()]
+
+    def merge(self, snapshot: list):
+        """Add bucket counts and sums."""
+
+        with self._lock:
+            for key, (counts, total) in snapshot:
+                entry = self._values.setdefault(tuple(key), ([0] * (len(self.buckets) + 1), [0.0]))
+                for index, count in enumerate(counts):
+                    entry[0][index] += count
+                entry[1][0] += total
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = sorted((key, (list(counts), total[0])) for key, (counts, total) in self._values.items())
+
+        lines = []
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                labels = format_labels(self.label_names, key, (("le", format_value(bound)),))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = format_labels(self.label_names, key)
+            lines.append(f"{self.name}_sum{labels} {format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    """Every metric in the process and ways to export them.
+
+    Metrics are created once at import time and updated in place, which
+    costs a lock and a dictionary update, so they are always on. The
+    registry renders the Prometheus text exposition format, which can be
+    written to a file for the node exporter's textfile collector or
+    served over HTTP for scraping.
+    """
+
+    _metrics: Dict[str, Metric]
+    _lock: threading.Lock
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric: Metric) -> Metric:
+        """Return an existing metric of the same name or add this one."""
+
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                if type(existing) is not type(metric):
+                    raise ValueError(f"{metric.name} is already registered as a {existing.kind}")
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, help: str, label_names: Labels = ()) -> Counter:
+        """Get or create a counter."""
+
+        return self._register(Counter(name, help, label_names))
+
+    def gauge(self, name: str, help: str, label_names: Labels = ()) -> Gauge:
+        """Get or create a gauge."""
+
+        return self._register(Gauge(name, help, label_names))
+
+    def histogram(
+            self,
+            name: str,
+            help: str,
+            label_names: Labels = (),
+            buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        """Get or create a histogram."""
+
+        return self._register(Histogram(name, help, label_names, buckets))
+
+    def get(self, name: str) -> Optional[Metric]:
+        """Look up a metric by name."""
+
+        return self._metrics.get(name)
+
+    def reset(self):
+        """Forget every sample, such as in a child that reports back."""
+
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            metric.reset()
+
+    def snapshot(self) -> Dict[str, list]:
+        """Samples of every metric that has any, for merge."""
+
+        with self._lock:
+            metrics = list(self._metrics.values())
+        snapshot = {}
+        for metric in metrics:
+            samples = metric.snapshot()
+            if samples:
+                snapshot[metric.name] = samples
+        return snapshot
+
+    def merge(self, snapshot: Dict[str, list]):
+        """Add samples recorded by another process, such as a forked child.
+
+        Only metrics this registry also defines are merged.
+        """
+
+        for name, samples in snapshot.items():
+            metric = self._metrics.get(name)
+            if metric is not None:
+                metric.merge(samples)
+
+    def render(self) -> str:
+        """The whole registry in the text exposition format."""
+
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda metric: metric.name)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: Path):
+        """Write atomically so that collectors never read a partial file."""
+
+        temporary = path.with_name(f".{path.name}.{os.getpid()}")
+        temporary.write_text(self.render())
+        os.replace(str(temporary), str(path))
+
+    def serve(self, port: int, host: str = "127.0.0.1") -> "ThreadingHTTPServer":
+        """Serve /metrics from a daemon thread."""
+
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?", 1)[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = registry.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+        return server
+
+
+registry = Registry()
+
+
+def counter(name: str, help: str, label_names: Labels = ()) -> Counter:
+    """Get or create a counter in the default registry."""
+
+    return registry.counter(name, help, label_names)
+
+
+def gauge(name: str, help: str, label_names: Labels = ()) -> Gauge:
+    """Get or create a gauge in the default registry."""
+
+    return registry.gauge(name, help, label_names)
+
+
+def histogram(name: str, help: str, label_names: Labels = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+    """Get or create a histogram in the default registry."""
+
+    return registry.histogram(name, help, label_names, buckets)
+
+
+def enable(target: str) -> Union[Path, int]:
+    """Export to a file path or serve on http://[host]:port.
+
+    A file is written when the process exits, while an HTTP endpoint is
+    served for as long as the process runs.
+    """
+
+    if target.startswith("http://"):
+        address = target[len("http://"):].rstrip("/")
+        host, _, port = address.rpartition(":")
+        registry.serve(int(port), host=host or "127.0.0.1")
+        return int(port)
+
+    path = Path(target)
+    atexit.register(registry.write, path)
+    return path
+
+
+def enable_from_environment() -> Optional[Union[Path, int]]:
+    """Export if CURRICULA_METRICS names a file or HTTP address."""
+
+    target = os.environ.get(METRICS_ENVIRONMENT_VARIABLE)
+    if not target:
+        return None
+    return enable(target)
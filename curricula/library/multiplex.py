@@ -0,0 +1,432 @@
+import os
+import timeit
+import selectors
+
+from collections import deque
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Deque, Dict, Generator, IO, Iterable, List, Optional, Tuple, Union
+
+from .tracing import span
+from .compare import Comparator
+from .process import Interactive, Interaction, Runtime, ProcessError, TimeoutExpired, OutputMismatch
+
+__all__ = (
+    "Write",
+    "Read",
+    "write",
+    "read",
+    "Session",
+    "SessionResult",
+    "Multiplexer")
+
+# Size of each read from a session's output
+READ_SIZE = 32768
+
+# How often sessions whose output has ended are checked for exit
+EXIT_POLL = 0.001
+
+
+@dataclass(eq=False)
+class Write:
+    """Script step that sends data to the process."""
+
+    data: bytes
+
+
+@dataclass(eq=False)
+class Read:
+    """Script step that waits for output, like Readable.read."""
+
+    condition: Optional[Callable[[bytes], bool]] = None
+    timeout: Optional[float] = None
+
+
+def write(*values: bytes, sep: bytes = b" ", end: bytes = b"\n") -> Write:
+    """Build a write step like Writable.write."""
+
+    return Write(sep.join(values) + end)
+
+
+def read(condition: Callable[[bytes], bool] = None, timeout: float = None) -> Read:
+    """Build a read step like Readable.read."""
+
+    return Read(condition=condition, timeout=timeout)
+
+
+Step = Union[Write, Read]
+Script = Union[Iterable[Step], Generator[Step, Optional[bytes], Any]]
+
+# What a finished read hands back to the script, a value or an exception
+Outcome = Tuple[Optional[bytes], Optional[BaseException]]
+
+
+@dataclass(eq=False)
+class Session:
+    """An interactive process and the exchange to have with it.
+
+    The script is a sequence of steps, or a generator, or a function
+    returning either. Generators are sent what each read returns, and a
+    read that times out or whose output can't match raises
+    TimeoutExpired or OutputMismatch into the generator just as
+    Readable.read would. The timeout covers the whole session including
+    waiting for the process to exit.
+    """
+
+    args: Tuple[str, ...]
+    script: Union[Script, Callable[[], Script]]
+    cwd: Optional[Path] = None
+    compare: Optional[Comparator] = None
+    timeout: Optional[float] = None
+
+
+@dataclass(eq=False)
+class SessionResult:
+    """Records of a finished session."""
+
+    # One per read, covering what was exchanged since the previous one
+    interactions: List[Interaction] = field(default_factory=list)
+    runtime: Optional[Runtime] = None
+
+    # Returned by a generator script
+    result: Any = None
+
+    # Raised out of the script
+    error: Optional[Exception] = None
+
+
+def steps(script: Iterable[Step]) -> Generator[Step, Optional[bytes], None]:
+    """Drive a plain sequence of steps like a generator script."""
+
+    for step in script:
+        yield step
+
+
+class Channel:
+    """A running session's state within the event loop."""
+
+    index: int
+    session: Session
+    interactive: Interactive
+    script: Generator[Step, Optional[bytes], Any]
+    result: SessionResult
+    deadline: Optional[float]
+
+    # Output received while no read was waiting
+    unread: bytes
+
+    # The read in progress, what it has so far and when it gives up
+    step: Optional[Read]
+    buffer: bytes
+    step_deadline: Optional[float]
+
+    # Input not yet accepted by the pipe
+    pending: memoryview
+
+    # Output streams not yet at end of file
+    open_streams: int
+    stdout_ended: bool
+
+    # The script has ended, only output and exit are left
+    draining: bool
+
+    _frame_time: float
+    _frame: Tuple[int, int, int]
+
+    def __init__(self, index: int, session: Session, interactive: Interactive):
+        self.index = index
+        self.session = session
+        self.interactive = interactive
+        script = session.script() if callable(session.script) else session.script
+        self.script = script if hasattr(script, "send") else steps(script)
+        self.result = SessionResult()
+        self.deadline = timeit.default_timer() + session.timeout if session.timeout is not None else None
+        self.unread = b""
+        self.step = None
+        self.buffer = b""
+        self.step_deadline = None
+        self.pending = memoryview(b"")
+        self.open_streams = 2
+        self.stdout_ended = False
+        self.draining = False
+        self._mark()
+
+    @property
+    def files(self) -> Tuple[IO[bytes], IO[bytes], IO[bytes]]:
+        """Standard streams of the process."""
+
+        return self.interactive.stdin.file, self.interactive.stdout.file, self.interactive.stderr.file
+
+    def _mark(self):
+        """Start a new interaction frame."""
+
+        self._frame_time = timeit.default_timer()
+        self._frame = (
+            len(self.interactive.stdin.history),
+            len(self.interactive.stdout.history),
+            len(self.interactive.stderr.history))
+
+    def record(self):
+        """Close the current interaction frame."""
+
+        stdin_index, stdout_index, stderr_index = self._frame
+        self.result.interactions.append(Interaction(
+            args=self.session.args,
+            cwd=self.session.cwd,
+            stdin=self.interactive.stdin.history[stdin_index:],
+            stdout=self.interactive.stdout.history[stdout_index:],
+            stderr=self.interactive.stderr.history[stderr_index:],
+            elapsed=timeit.default_timer() - self._frame_time))
+        self._mark()
+
+    def begin(self, step: Read):
+        """Start waiting on a read."""
+
+        self.step = step
+        self.buffer = b""
+        self.step_deadline = timeit.default_timer() + step.timeout if step.timeout is not None else None
+
+    def end(self, value: bytes = None, error: BaseException = None) -> Outcome:
+        """Finish the read, keeping its buffer like Readable does."""
+
+        self.interactive.stdout.history += self.buffer
+        self.step = None
+        self.buffer = b""
+        self.step_deadline = None
+        self.record()
+        return value, error
+
+    def satisfy(self, data: bytes) -> Optional[Outcome]:
+        """Give output to the read, returning its outcome once done."""
+
+        if not data:
+            return None
+        self.buffer += data
+        try:
+            self.interactive.stdout.check(data)
+        except OutputMismatch as mismatch:
+            return self.end(error=mismatch)
+        if self.step.condition is None or self.step.condition(self.buffer):
+            return self.end(value=self.buffer)
+        return None
+
+    def expire(self) -> Outcome:
+        """Give up on the read."""
+
+        return self.end(error=TimeoutExpired(buffer=self.buffer))
+
+
+class Multiplexer:
+    """Run many interactive sessions from a single thread.
+
+    Each session is an Interactive whose pipes are registered with one
+    selector instead of being polled by a thread of its own. Scripts
+    only advance when output arrives or a timeout passes, so concurrency
+    is bounded by how many processes the machine can run rather than by
+    how many threads the grader can afford. New sessions are started as
+    others finish so that at most the given number run at once. Each
+    read closes an Interaction covering everything exchanged since the
+    previous one, and each session ends with the Runtime its Interactive
+    would have returned from close.
+    """
+
+    concurrency: int
+
+    _selector: Optional[selectors.BaseSelector]
+
+    def __init__(self, concurrency: int = None):
+        self.concurrency = concurrency or os.cpu_count() or 1
+        self._selector = None
+
+    def _registered(self, file: IO[bytes]) -> bool:
+        if file.closed:
+            return False
+        try:
+            self._selector.get_key(file)
+        except KeyError:
+            return False
+        return True
+
+    def _start(self, index: int, session: Session) -> Channel:
+        """Spawn a session and run its script up to the first read."""
+
+        channel = Channel(index, session, Interactive(session.args, cwd=session.cwd, compare=session.compare))
+        stdin, stdout, stderr = channel.files
+        for file in (stdin, stdout, stderr):
+            os.set_blocking(file.fileno(), False)
+        self._selector.register(stdout, selectors.EVENT_READ, channel)
+        self._selector.register(stderr, selectors.EVENT_READ, channel)
+        self._advance(channel)
+        return channel
+
+    def _advance(self, channel: Channel, value: bytes = None, error: BaseException = None):
+        """Resume the script until it waits on output or ends."""
+
+        while True:
+            try:
+                step = channel.script.throw(error) if error is not None else channel.script.send(value)
+            except StopIteration as stop:
+                channel.result.result = stop.value
+                self._drain(channel)
+                return
+            except Exception as exception:
+                channel.result.error = exception
+                channel.interactive.kill()
+                self._drain(channel)
+                return
+
+            if isinstance(step, Write):
+                channel.interactive.stdin.history += step.data
+                channel.pending = memoryview(bytes(channel.pending) + step.data) if channel.pending else memoryview(step.data)
+                self._flush(channel)
+                value, error = None, None
+                continue
+
+            channel.begin(step)
+            data, channel.unread = channel.unread, b""
+            outcome = channel.satisfy(data)
+            if outcome is None and channel.stdout_ended:
+                outcome = channel.expire()
+            if outcome is None:
+                return
+            value, error = outcome
+
+    def _flush(self, channel: Channel):
+        """Write as much pending input as the pipe will take."""
+
+        stdin = channel.interactive.stdin.file
+        if not stdin.closed:
+            try:
+                written = os.write(stdin.fileno(), channel.pending)
+            except BlockingIOError:
+                written = 0
+            except BrokenPipeError:
+                written = len(channel.pending)
+            channel.pending = channel.pending[written:]
+        else:
+            channel.pending = memoryview(b"")
+
+        registered = self._registered(stdin)
+        if channel.pending and not registered:
+            self._selector.register(stdin, selectors.EVENT_WRITE, channel)
+        elif not channel.pending:
+            if registered:
+                self._selector.unregister(stdin)
+            if channel.draining and not stdin.closed:
+                stdin.close()
+
+    def _drain(self, channel: Channel):
+        """Close input once it is written and wait for output to end."""
+
+        channel.draining = True
+        if not channel.pending and not channel.interactive.stdin.file.closed:
+            channel.interactive.stdin.file.close()
+
+    def _receive(self, channel: Channel, file: IO[bytes]):
+        """Read whatever a stream has ready."""
+
+        try:
+            data = os.read(file.fileno(), READ_SIZE)
+        except BlockingIOError:
+            return
+
+        stdout = channel.interactive.stdout.file
+        if not data:
+            self._selector.unregister(file)
+            channel.open_streams -= 1
+            if file is stdout:
+                channel.stdout_ended = True
+                if channel.step is not None:
+                    # Nothing more can arrive, so the read can never be satisfied
+                    self._advance(channel, *channel.expire())
+        elif file is not stdout:
+            channel.interactive.stderr.history += data
+        elif channel.step is not None:
+            outcome = channel.satisfy(data)
+            if outcome is not None:
+                self._advance(channel, *outcome)
+        else:
+            channel.unread += data
+
+    def _complete(self, channel: Channel, timed_out: bool = False) -> SessionResult:
+        """Build the runtime and release the session."""
+
+        for file in channel.files:
+            if self._registered(file):
+                self._selector.unregister(file)
+
+        if timed_out and channel.step is not None:
+            channel.expire()
+        channel.result.runtime = channel.interactive.finish(
+            channel.unread,
+            b"",
+            timeout=channel.session.timeout,
+            timed_out=timed_out)
+        if timed_out:
+            channel.interactive.kill()
+
+        for file in channel.files:
+            if not file.closed:
+                file.close()
+        return channel.result
+
+    def _failed(self, session: Session, error: OSError) -> SessionResult:
+        """Result for a session whose process couldn't be started."""
+
+        return SessionResult(runtime=Runtime(
+            args=session.args,
+            cwd=session.cwd,
+            timeout=session.timeout,
+            raised_exception=True,
+            exception=ProcessError.from_os_error(error)))
+
+    def run(self, sessions: Iterable[Session]) -> List[SessionResult]:
+        """Run every session, returning results in order."""
+
+        waiting: Deque[Tuple[int, Session]] = deque(enumerate(sessions))
+        count = len(waiting)
+        results: Dict[int, SessionResult] = {}
+        running: List[Channel] = []
+
+        from . import profile
+
+        with span("multiplex.run", sessions=count), profile.phase("multiplex"), selectors.DefaultSelector() as self._selector:
+            while waiting or running:
+                while waiting and len(running) < self.concurrency:
+                    index, session = waiting.popleft()
+                    try:
+                        running.append(self._start(index, session))
+                    except OSError as error:
+                        results[index] = self._failed(session, error)
+
+                # Sleep until the nearest timeout, or briefly while waiting on exits
+                now = timeit.default_timer()
+                delays = [
+                    deadline - now
+                    for channel in running
+                    for deadline in (channel.deadline, channel.step_deadline)
+                    if deadline is not None]
+                if any(channel.draining and channel.open_streams == 0 for channel in running):
+                    delays.append(EXIT_POLL)
+                timeout = max(min(delays), 0) if delays else None
+
+                for key, events in self._selector.select(timeout):
+                    if events & selectors.EVENT_WRITE:
+                        self._flush(key.data)
+                    else:
+                        self._receive(key.data, key.fileobj)
+
+                now = timeit.default_timer()
+                for channel in list(running):
+                    if channel.deadline is not None and now >= channel.deadline:
+                        results[channel.index] = self._complete(channel, timed_out=True)
+                        running.remove(channel)
+                        continue
+                    if channel.step_deadline is not None and now >= channel.step_deadline:
+                        self._advance(channel, *channel.expire())
+                    if channel.draining and channel.open_streams == 0 and not channel.interactive.poll():
+                        results[channel.index] = self._complete(channel)
+                        running.remove(channel)
+
+        self._selector = None
+        return [results[index] for index in range(count)]
@@ -1,16 +1,73 @@
+import os
+import stat
+import hashlib
+import functools
 import subprocess
 import timeit
 import time
 
 from ..log import log
 from .debug import get_source_location
+from . import metrics
 
-from typing import Optional, Tuple, Callable, IO, TypeVar, Any
-from dataclasses import dataclass, asdict, field
+from typing import Optional, Tuple, Callable, IO, TypeVar, Any, Union, Sequence, Iterable, Iterator, FrozenSet, TYPE_CHECKING
+from dataclasses import dataclass, asdict, field, replace
 from contextlib import contextmanager
 from functools import lru_cache
 from pathlib import Path
 
+# Tracing, launching, caching, comparison and pinning are imported on use
+if TYPE_CHECKING:
+    from .launcher import SpawnedProcess
+    from .runcache import RunCache
+    from .compare import Comparator, Mismatch
+
+
+PROCESSES = metrics.counter("curricula_processes_total", "Processes run to completion or timeout")
+PROCESS_FAILURES = metrics.counter("curricula_process_start_failures_total", "Processes that failed to start")
+PROCESS_TIMEOUTS = metrics.counter("curricula_process_timeouts_total", "Processes killed for timing out")
+PROCESS_MISMATCHES = metrics.counter("curricula_process_mismatches_total", "Processes stopped on an output mismatch")
+PROCESS_CACHE = metrics.counter("curricula_process_cache_total", "Run cache lookups", ("result",))
+PROCESS_BYTES = metrics.counter("curricula_process_bytes_total", "Bytes piped to and from processes", ("stream",))
+PROCESS_SECONDS = metrics.histogram("curricula_process_seconds", "Wall time of finished processes")
+INTERACTIVE_SESSIONS = metrics.counter("curricula_interactive_sessions_total", "Interactive sessions started")
+INTERACTIVE_ACTIVE = metrics.gauge("curricula_interactive_active", "Interactive sessions currently open")
+INTERACTIVE_POLLS = metrics.counter("curricula_interactive_polls_total", "Polling iterations spent reading interactive output")
+INTERACTIVE_TIMEOUTS = metrics.counter("curricula_interactive_timeouts_total", "Interactive reads and closes that timed out")
+INTERACTIVE_BYTES = metrics.counter("curricula_interactive_bytes_total", "Bytes piped to and from interactive sessions", ("stream",))
+INTERACTIVE_SECONDS = metrics.histogram("curricula_interactive_seconds", "Lifetime of closed interactive sessions")
+
+
+def record_cpus(runtime: "Runtime") -> "Runtime":
+    """Note the CPUs the calling thread is pinned to."""
+
+    from . import affinity
+
+    cpus = affinity.current()
+    runtime.cpus = tuple(sorted(cpus)) if cpus is not None else None
+    return runtime
+
+
+def record_runtime(runtime: "Runtime") -> "Runtime":
+    """Note the CPUs the run was pinned to and update metrics."""
+
+    record_cpus(runtime)
+    if runtime.raised_exception:
+        PROCESS_FAILURES.inc()
+        return runtime
+
+    PROCESSES.inc()
+    if runtime.timed_out:
+        PROCESS_TIMEOUTS.inc()
+    if runtime.mismatch is not None:
+        PROCESS_MISMATCHES.inc()
+    if runtime.elapsed is not None:
+        PROCESS_SECONDS.observe(runtime.elapsed)
+    PROCESS_BYTES.inc(stdin_size(runtime.stdin), stream="stdin")
+    PROCESS_BYTES.inc(len(runtime.stdout or b""), stream="stdout")
+    PROCESS_BYTES.inc(len(runtime.stderr or b""), stream="stderr")
+    return runtime
+
 
 @dataclass(eq=False)
 class ProcessError:
@@ -35,6 +92,12 @@ class ProcessError:
 
         return asdict(self)
 
+    @classmethod
+    def load(cls, data: dict) -> "ProcessError":
+        """Deserialize."""
+
+        return cls(description=data["description"], error_number=data.get("error_number"))
+
 
 T = TypeVar("T")
 
@@ -46,6 +109,50 @@ def nullable(function: Callable[[Any], T]) -> Callable[[Optional[Any]], Optional
     return lambda value: function(value) if value is not None else None
 
 
+@dataclass(eq=False)
+class StdinReference:
+    """Stands in for stdin that was streamed rather than held in memory."""
+
+    path: Optional[Path] = None
+    size: Optional[int] = None
+    digest: Optional[str] = None
+
+    def dump(self) -> dict:
+        """Serialize."""
+
+        return dict(path=nullable(str)(self.path), size=self.size, digest=self.digest)
+
+    @classmethod
+    def load(cls, data: dict) -> "StdinReference":
+        """Deserialize."""
+
+        return cls(path=nullable(Path)(data["path"]), size=data["size"], digest=data["digest"])
+
+
+def stdin_size(stdin: Optional[Union[bytes, StdinReference]]) -> int:
+    """Number of bytes given to a process, zero if unknown."""
+
+    if isinstance(stdin, StdinReference):
+        return stdin.size or 0
+    return len(stdin or b"")
+
+
+def dump_stdin(stdin: Optional[Union[bytes, StdinReference]]) -> Optional[Union[str, dict]]:
+    """Decode bytes or dump a reference."""
+
+    if isinstance(stdin, StdinReference):
+        return stdin.dump()
+    return nullable(bytes.decode)(stdin)
+
+
+def load_stdin(data: Optional[Union[str, dict]]) -> Optional[Union[bytes, StdinReference]]:
+    """Inverse of dump_stdin."""
+
+    if isinstance(data, dict):
+        return StdinReference.load(data)
+    return nullable(str.encode)(data)
+
+
 @dataclass(eq=False)
 class ProcessCreation:
     """Information about how a process was started."""
@@ -67,7 +174,8 @@ class ProcessCreation:
 class ProcessStreams:
     """Container for streamed data."""
 
-    stdin: Optional[bytes] = None
+    # Runs given a file or stream record a reference instead
+    stdin: Optional[Union[bytes, StdinReference]] = None
     stdout: Optional[bytes] = None
     stderr: Optional[bytes] = None
 
@@ -76,7 +184,7 @@ class ProcessStreams:
 
         dump = getattr(super(), "dump", dict)()
         dump.update(
-            stdin=nullable(bytes.decode)(self.stdin),
+            stdin=dump_stdin(self.stdin),
             stdout=nullable(bytes.decode)(self.stdout),
             stderr=nullable(bytes.decode)(self.stderr))
         return dump
@@ -114,6 +222,12 @@ class Runtime(ProcessStreams, ProcessCreation):
     raised_exception: bool = False
     exception: Optional[ProcessError] = None
 
+    # First divergence from the expected output, if compared
+    mismatch: Optional["Mismatch"] = None
+
+    # CPUs the process was restricted to, if pinned
+    cpus: Optional[Tuple[int, ...]] = None
+
     def dump(self) -> dict:
         """Make the runtime JSON serializable."""
 
@@ -124,8 +238,191 @@ class Runtime(ProcessStreams, ProcessCreation):
         dump.update(timed_out=self.timed_out)
         dump.update(raised_exception=self.raised_exception)
         dump.update(exception=self.exception.dump() if self.exception is not None else None)
+        dump.update(mismatch=self.mismatch.dump() if self.mismatch is not None else None)
+        dump.update(cpus=list(self.cpus) if self.cpus is not None else None)
+        return dump
+
+    @classmethod
+    def load(cls, data: dict) -> "Runtime":
+        """Inverse of dump, streams are encoded back to bytes."""
+
+        from .compare import Mismatch
+
+        return cls(
+            args=tuple(data["args"]),
+            cwd=nullable(Path)(data["cwd"]),
+            stdin=load_stdin(data["stdin"]),
+            stdout=nullable(str.encode)(data["stdout"]),
+            stderr=nullable(str.encode)(data["stderr"]),
+            elapsed=data["elapsed"],
+            code=data["code"],
+            timeout=data["timeout"],
+            timed_out=data["timed_out"],
+            raised_exception=data["raised_exception"],
+            exception=nullable(ProcessError.load)(data["exception"]),
+            mismatch=nullable(Mismatch.load)(data.get("mismatch")),
+            cpus=nullable(tuple)(data.get("cpus")))
+
+    def dump_encoded(self) -> dict:
+        """Serialize with streams in base64 so that no output is lost.
+
+        Dump decodes streams as text for readability, which fails on
+        output that isn't UTF-8, such as a submission printing garbage.
+        """
+
+        from .runcache import encode
+
+        dump = replace(self, stdin=None, stdout=None, stderr=None).dump()
+        dump.update(
+            stdin=self.stdin.dump() if isinstance(self.stdin, StdinReference) else encode(self.stdin),
+            stdout=encode(self.stdout),
+            stderr=encode(self.stderr))
         return dump
 
+    @classmethod
+    def load_encoded(cls, data: dict) -> "Runtime":
+        """Inverse of dump_encoded."""
+
+        from .runcache import decode
+
+        runtime = cls.load(dict(data, stdin=None, stdout=None, stderr=None))
+        runtime.stdin = StdinReference.load(data["stdin"]) if isinstance(data["stdin"], dict) else decode(data["stdin"])
+        runtime.stdout = decode(data["stdout"])
+        runtime.stderr = decode(data["stderr"])
+        return runtime
+
+
+# Anything process.run accepts as stdin
+Stdin = Union[bytes, Path, IO[bytes], Iterable[bytes]]
+
+# Size of each read when streaming a file object without a descriptor
+STDIN_CHUNK_SIZE = 1 << 20
+
+class StdinSource:
+    """Stdin for a single run, prepared for the launcher.
+
+    Bytes are piped to the child as before. A path or a file object with
+    a real descriptor is handed to the child as its stdin directly, so
+    the contents are never read into this process, though a file is
+    hashed once per change for the record. Other file objects and
+    iterables of chunks are streamed through the pipe as the child
+    consumes them. Everything but bytes is recorded on the runtime as a
+    StdinReference.
+    """
+
+    data: Optional[bytes]
+    fd: Optional[int]
+    chunks: Optional[Iterator[bytes]]
+    reference: Optional[StdinReference]
+
+    _opened: Optional[IO[bytes]]
+
+    def __init__(self, stdin: Optional[Stdin]):
+        from .runcache import hash_file_cached
+
+        self.data = None
+        self.fd = None
+        self.chunks = None
+        self.reference = None
+        self._opened = None
+
+        if stdin is None or isinstance(stdin, (bytes, bytearray)):
+            self.data = stdin
+        elif isinstance(stdin, Path):
+            self._opened = stdin.open("rb")
+            self.fd = self._opened.fileno()
+            self.reference = StdinReference(path=stdin, size=os.fstat(self.fd).st_size, digest=hash_file_cached(stdin))
+        elif hasattr(stdin, "read"):
+            try:
+                self.fd = stdin.fileno()
+            except (AttributeError, OSError, ValueError):
+                self.reference = StdinReference(size=0)
+                self.chunks = self._record(iter(functools.partial(stdin.read, STDIN_CHUNK_SIZE), b""))
+            else:
+                self.reference = self._describe(stdin, self.fd)
+        else:
+            self.reference = StdinReference(size=0)
+            self.chunks = self._record(iter(stdin))
+
+    @staticmethod
+    def _describe(file: IO[bytes], fd: int) -> StdinReference:
+        """Reference a file the child will read from its current position."""
+
+        from .runcache import hash_file_cached
+
+        name = getattr(file, "name", None)
+        path = Path(name) if isinstance(name, str) else None
+        info = os.fstat(fd)
+        if not stat.S_ISREG(info.st_mode):
+            return StdinReference(path=path)
+
+        position = os.lseek(fd, 0, os.SEEK_CUR)
+        digest = None
+        if path is not None and position == 0 and path.is_file() and os.path.samestat(path.stat(), info):
+            digest = hash_file_cached(path)
+        return StdinReference(path=path, size=info.st_size - position, digest=digest)
+
+    def _record(self, chunks: Iterator[bytes]) -> Iterator[bytes]:
+        """Count and hash chunks as they are streamed."""
+
+        reference = self.reference
+        digest = hashlib.sha256()
+        for chunk in chunks:
+            reference.size += len(chunk)
+            digest.update(chunk)
+            yield chunk
+        reference.digest = digest.hexdigest()
+
+    @property
+    def launcher_stdin(self) -> Union[bool, int]:
+        """What to pass the launcher, a descriptor or whether to pipe."""
+
+        if self.fd is not None:
+            return self.fd
+        return self.data is not None or self.chunks is not None
+
+    @property
+    def recorded(self) -> Optional[Union[bytes, StdinReference]]:
+        """What the runtime keeps."""
+
+        return self.reference if self.reference is not None else self.data
+
+    @property
+    def cacheable(self) -> bool:
+        """Whether the contents are known before the run."""
+
+        return self.chunks is None and (self.reference is None or self.reference.digest is not None)
+
+    def close(self):
+        """Close a file opened from a path."""
+
+        if self._opened is not None:
+            self._opened.close()
+            self._opened = None
+
+    def __enter__(self) -> "StdinSource":
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
+
+
+def pin_child(process: Union[subprocess.Popen, "SpawnedProcess"]):
+    """Apply the calling thread's pinning to a child explicitly.
+
+    Children normally inherit it, but not ones started on our behalf by
+    another process such as the fork server.
+    """
+
+    from . import affinity
+
+    cpus = affinity.current()
+    if cpus is not None and hasattr(os, "sched_setaffinity"):
+        try:
+            os.sched_setaffinity(process.pid, cpus)
+        except OSError:
+            pass
+
 
 @dataclass(eq=False)
 class TimeoutExpired(RuntimeError):
@@ -135,6 +432,13 @@ class TimeoutExpired(RuntimeError):
     buffer: bytes
 
 
+@dataclass(eq=False)
+class OutputMismatch(RuntimeError):
+    """Raised reading output that can no longer match what's expected."""
+
+    mismatch: "Mismatch"
+
+
 @dataclass(eq=False)
 class Stream:
     """Base class for a process stream wrapper."""
@@ -152,28 +456,60 @@ class Readable(Stream):
     # Poll rate for reading
     POLL: float = 0.001
 
+    # Checks output as it is read
+    comparator: Optional["Comparator"] = None
+
+    # Called once on the first mismatch, used to stop the process
+    on_mismatch: Optional[Callable[["Mismatch"], None]] = None
+
+    def check(self, data: bytes):
+        """Feed the comparator and stop at the first mismatch."""
+
+        if self.comparator is None or self.comparator.mismatch is not None:
+            return
+        mismatch = self.comparator.feed(data)
+        if mismatch is not None:
+            if self.on_mismatch is not None:
+                self.on_mismatch(mismatch)
+            raise OutputMismatch(mismatch=mismatch)
+
     def _read_block(self, condition: Callable[[bytes], bool] = None, timeout: float = None) -> Optional[bytes]:
         """Block until something besides None is returned."""
 
-        buffer = b""
+        from .tracing import span
 
-        timeout_time = None
-        if timeout is not None:
-            timeout_time = timeit.default_timer() + timeout
+        with span("interactive.read"):
+            buffer = b""
 
-        while True:
-            data = self.file.read()
-            if data is not None:
-                buffer += data
-                if condition is None or condition(buffer):
-                    break
-            if timeout is not None and timeit.default_timer() >= timeout_time:
-                self.history += buffer
-                raise TimeoutExpired(buffer=buffer)
-            time.sleep(self.POLL)
+            timeout_time = None
+            if timeout is not None:
+                timeout_time = timeit.default_timer() + timeout
 
-        self.history += buffer
-        return buffer
+            polls = 0
+            try:
+                while True:
+                    polls += 1
+                    data = self.file.read()
+                    if data is not None:
+                        buffer += data
+                        try:
+                            self.check(data)
+                        except OutputMismatch:
+                            self.history += buffer
+                            raise
+                        if condition is None or condition(buffer):
+                            break
+                    if timeout is not None and timeit.default_timer() >= timeout_time:
+                        self.history += buffer
+                        INTERACTIVE_TIMEOUTS.inc()
+                        raise TimeoutExpired(buffer=buffer)
+                    time.sleep(self.POLL)
+            finally:
+                INTERACTIVE_POLLS.inc(polls)
+                INTERACTIVE_BYTES.inc(len(buffer), stream="output")
+
+            self.history += buffer
+            return buffer
 
     def read(
             self,
@@ -216,7 +552,8 @@ class Interactive:
     """An interactive runtime session."""
 
     _args: Tuple[str, ...]
-    _process: subprocess.Popen
+    _process: Union[subprocess.Popen, "SpawnedProcess"]
+    _cpus: Optional[FrozenSet[int]]
     _start_time: float
     cwd: Optional[Path]
     stdin: Writable
@@ -225,27 +562,42 @@ class Interactive:
 
     _recording: Optional[Interaction] = None
 
-    def __init__(self, args: Tuple[str, ...], cwd: Path = None):
-        """Start up the new process."""
+    def __init__(self, args: Tuple[str, ...], cwd: Path = None, compare: "Comparator" = None):
+        """Start up the new process.
+
+        If a comparator is passed, stdout is checked as it is read and
+        the process is killed on the first mismatch, which then raises
+        OutputMismatch from the read.
+        """
+
+        from .tracing import span
+        from .launcher import get_launcher
+        from . import affinity
 
         self._args = args
-        self._process = subprocess.Popen(
-            args=args,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            stdin=subprocess.PIPE,
-            cwd=str(cwd) if cwd is not None else None)
+        with span("interactive.spawn", executable=args[0] if args else None):
+            self._process = get_launcher().spawn(args, cwd=cwd, stdin=True)
+            pin_child(self._process)
+        self._cpus = affinity.current()
         self.cwd = cwd
         self.stdin = Writable(self._process.stdin)
-        self.stdout = Readable(self._process.stdout)
+        self.stdout = Readable(self._process.stdout, comparator=compare, on_mismatch=lambda _: self._process.kill())
         self.stderr = Readable(self._process.stderr)
         self._start_time = timeit.default_timer()
+        INTERACTIVE_SESSIONS.inc()
+        INTERACTIVE_ACTIVE.inc()
 
     def poll(self) -> bool:
         """Check whether the interactive has terminated."""
 
         return self._process.poll() is None
 
+    def kill(self):
+        """Stop the process immediately and reap it."""
+
+        self._process.kill()
+        self._process.wait()
+
     @contextmanager
     def recording(self) -> Interaction:
         """Record a frame of all process streams."""
@@ -270,21 +622,50 @@ class Interactive:
     def close(self, timeout: float = None) -> Runtime:
         """Block until exit."""
 
-        raised_exception = False
-        exception = None
-        timed_out = False
-        stdout = b""
-        stderr = b""
+        from .tracing import span
 
-        try:
-            stdout, stderr = self._process.communicate(timeout=timeout)
-        except subprocess.TimeoutExpired:
-            timed_out = True
-        except OSError as error:
-            raised_exception = True
-            exception = ProcessError.from_os_error(error)
+        with span("interactive.close"):
+            exception = None
+            timed_out = False
+            stdout = b""
+            stderr = b""
+
+            try:
+                stdout, stderr = self._process.communicate(timeout=timeout)
+            except subprocess.TimeoutExpired:
+                timed_out = True
+            except OSError as error:
+                exception = ProcessError.from_os_error(error)
+
+            return self.finish(stdout, stderr, timeout=timeout, timed_out=timed_out, exception=exception)
+
+    def finish(
+            self,
+            stdout: Optional[bytes],
+            stderr: Optional[bytes],
+            timeout: float = None,
+            timed_out: bool = False,
+            exception: Optional[ProcessError] = None) -> Runtime:
+        """Build the runtime once the process has been waited on.
+
+        Takes whatever output was left unread. Used by close and by
+        anything else that waits on the process itself.
+        """
+
+        raised_exception = exception is not None
+        comparator = self.stdout.comparator
+        if comparator is not None and not timed_out and not raised_exception:
+            if stdout:
+                comparator.feed(stdout)
+            comparator.finish()
 
         stop_time = timeit.default_timer()
+        INTERACTIVE_ACTIVE.dec()
+        INTERACTIVE_SECONDS.observe(stop_time - self._start_time)
+        INTERACTIVE_BYTES.inc(len(self.stdin.history), stream="stdin")
+        INTERACTIVE_BYTES.inc(len(stdout or b"") + len(stderr or b""), stream="output")
+        if timed_out:
+            INTERACTIVE_TIMEOUTS.inc()
         return Runtime(
             args=self._args,
             cwd=self.cwd,
@@ -292,83 +673,201 @@ class Interactive:
             code=self._process.returncode,
             elapsed=stop_time - self._start_time,
             stdin=self.stdin.history,
-            stdout=self.stdout.history + stdout,
-            stderr=self.stderr.history + stderr,
+            stdout=self.stdout.history + (stdout or b""),
+            stderr=self.stderr.history + (stderr or b""),
             raised_exception=raised_exception,
             exception=exception,
-            timed_out=timed_out)
+            timed_out=timed_out,
+            mismatch=comparator.mismatch if comparator is not None else None,
+            cpus=tuple(sorted(self._cpus)) if self._cpus is not None else None)
 
 
-def run(*args: str, stdin: bytes = None, timeout: float = None, cwd: Path = None) -> Runtime:
+def _run(
+        args: Tuple[str, ...],
+        stdin: StdinSource = None,
+        timeout: float = None,
+        cwd: Path = None,
+        compare: "Comparator" = None) -> Runtime:
+    """Spawn the process and wait for it to finish."""
+
+    from .tracing import span
+    from .launcher import get_launcher
+    from .compare import stream_compare
+
+    with span("process.run"):
+        source = stdin if stdin is not None else StdinSource(None)
+        recorded = source.recorded
+
+        # Spawn the process, access stdout and stderr
+        try:
+            with span("process.spawn", executable=args[0] if args else None):
+                process = get_launcher().spawn(args, cwd=cwd, stdin=source.launcher_stdin)
+                pin_child(process)
+
+        # Catch common errors
+        except OSError as error:
+            exception = ProcessError.from_os_error(error)
+            return Runtime(args=args, cwd=cwd, timeout=timeout, stdin=recorded, raised_exception=True, exception=exception)
+        except ValueError:
+            exception = ProcessError(description="failed to open process")
+            return Runtime(args=args, cwd=cwd, timeout=timeout, stdin=recorded, raised_exception=True, exception=exception)
+        except subprocess.SubprocessError as exception:
+            exception = ProcessError(description=str(exception))
+            return Runtime(args=args, cwd=cwd, timeout=timeout, stdin=recorded, raised_exception=True, exception=exception)
+
+        # The child has its own copy of a file descriptor
+        source.close()
+
+        # Wait for the process to finish with timeout
+        start = timeit.default_timer()
+        if compare is not None or source.chunks is not None:
+            with span("process.compare" if compare is not None else "process.stream"):
+                feed = source.chunks if source.chunks is not None else source.data
+                stdout, stderr, timed_out = stream_compare(process, feed, timeout, compare)
+            return Runtime(
+                args=args,
+                cwd=cwd,
+                timeout=timeout,
+                code=None if timed_out else process.returncode,
+                elapsed=None if timed_out else timeit.default_timer() - start,
+                stdin=recorded,
+                stdout=stdout,
+                stderr=stderr,
+                timed_out=timed_out,
+                mismatch=compare.mismatch if compare is not None else None)
+
+        with span("process.wait"):
+            try:
+                stdout, stderr = process.communicate(input=source.data, timeout=timeout)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+                # Recover data
+                try:
+                    stdout, stderr = process.communicate(timeout=1)
+                except subprocess.TimeoutExpired:
+                    stdout, stderr = None, None
+
+                return Runtime(args=args, cwd=cwd, timeout=timeout, stdin=recorded, stdout=stdout, stderr=stderr, timed_out=True)
+
+            # Check elapsed
+            elapsed = timeit.default_timer() - start
+        return Runtime(
+            args=args,
+            cwd=cwd,
+            timeout=timeout,
+            code=process.returncode,
+            elapsed=elapsed,
+            stdin=recorded,
+            stdout=stdout,
+            stderr=stderr)
+
+
+def run(
+        *args: str,
+        stdin: Stdin = None,
+        timeout: float = None,
+        cwd: Path = None,
+        inputs: Sequence[Path] = (),
+        deterministic: bool = False,
+        cache: Optional["RunCache"] = None,
+        compare: "Comparator" = None,
+        cpus: Iterable[int] = None) -> Runtime:
     """Run an executable with a list of command line arguments.
 
     The provided path must be absolute in order to properly execute
     the program. Args provided are passed as they would be from the
     command line. The timeout is measured in seconds.
 
-    The process_setup callable is invoked within the spawned process
-    prior to the execution of the command.
+    Caching is opt in per call. Runs marked deterministic reuse the
+    result of a previous run with identical executable, arguments,
+    stdin, and declared input files from the passed or configured run
+    cache. Only the declared inputs are checked, so anything else the
+    process reads must be listed there. Other runs always execute.
+
+    If a comparator is passed, stdout is checked as it arrives and the
+    process is killed at the first mismatch, which is recorded on the
+    runtime. Compared runs bypass the cache since the output stored
+    there may be cut short.
+
+    Stdin may be bytes, or for large inputs a path, a file object or an
+    iterable of byte chunks. Paths and files are given to the process
+    directly and iterables are streamed, and the runtime records a
+    reference to the input rather than a copy. Streamed runs bypass the
+    cache since their contents aren't known up front.
+
+    If CPUs are passed, both the calling thread and the process are
+    pinned to them for the duration of the run. Runs made while the
+    thread is already pinned, for example by a CorePool, record the
+    CPUs on the runtime either way.
     """
 
+    if cpus is not None:
+        from . import affinity
+
+        with affinity.pinned(cpus):
+            return run(
+                *args,
+                stdin=stdin,
+                timeout=timeout,
+                cwd=cwd,
+                inputs=inputs,
+                deterministic=deterministic,
+                cache=cache,
+                compare=compare)
+
     if timeout is None:
         log.warning(f"process.run has been invoked without a timeout from {get_source_location()}")
 
-    # Spawn the process, access stdout and stderr
-    try:
-        if stdin is not None:
-            process = subprocess.Popen(
-                args,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                stdin=subprocess.PIPE,
-                cwd=str(cwd) if cwd is not None else None)
-        else:
-            process = subprocess.Popen(
-                args,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                cwd=str(cwd) if cwd is not None else None)
-
-    # Catch common errors
-    except OSError as error:
-        exception = ProcessError.from_os_error(error)
-        return Runtime(args=args, cwd=cwd, timeout=timeout, stdin=stdin, raised_exception=True, exception=exception)
-    except ValueError:
-        exception = ProcessError(description="failed to open process")
-        return Runtime(args=args, cwd=cwd, timeout=timeout, stdin=stdin, raised_exception=True, exception=exception)
-    except subprocess.SubprocessError as exception:
-        exception = ProcessError(description=str(exception))
-        return Runtime(args=args, cwd=cwd, timeout=timeout, stdin=stdin, raised_exception=True, exception=exception)
-
-    # Wait for the process to finish with timeout
-    start = timeit.default_timer()
-    try:
-        stdout, stderr = process.communicate(input=stdin, timeout=timeout)
-    except subprocess.TimeoutExpired:
-        process.kill()
-
-        # Recover data
-        try:
-            stdout, stderr = process.communicate(timeout=1)
-        except subprocess.TimeoutExpired:
-            stdout, stderr = None, None
-
-        return Runtime(args=args, cwd=cwd, timeout=timeout, stdin=stdin, stdout=stdout, stderr=stderr, timed_out=True)
-
-    # Check elapsed
-    elapsed = timeit.default_timer() - start
-    return Runtime(
-        args=args,
-        cwd=cwd,
-        timeout=timeout,
-        code=process.returncode,
-        elapsed=elapsed,
-        stdin=stdin,
-        stdout=stdout,
-        stderr=stderr)
-
-
-def interact(*args: str) -> Interactive:
+    if cache is None:
+        from .runcache import get_cache
+
+        cache = get_cache()
+    with StdinSource(stdin) as source:
+        if compare is not None:
+            return record_runtime(_run(args, stdin=source, timeout=timeout, cwd=cwd, compare=compare))
+        if cache is None or not deterministic or not source.cacheable:
+            return record_runtime(_run(args, stdin=source, timeout=timeout, cwd=cwd))
+
+        key = cache.key(args, stdin=source.recorded, cwd=cwd, inputs=inputs)
+        if key is None:
+            return record_runtime(_run(args, stdin=source, timeout=timeout, cwd=cwd))
+
+        runtime = cache.get(key, timeout=timeout)
+        if runtime is not None:
+            PROCESS_CACHE.inc(result="hit")
+            runtime.stdin = source.recorded
+            return record_cpus(runtime)
+
+        PROCESS_CACHE.inc(result="miss")
+        runtime = record_runtime(_run(args, stdin=source, timeout=timeout, cwd=cwd))
+        cache.put(key, runtime)
+        return runtime
+
+
+def build(
+        *args: str,
+        output: Path,
+        sources: Sequence[Path],
+        include_paths: Sequence[Path] = (),
+        cwd: Path = None,
+        timeout: float = None) -> Runtime:
+    """Run a compiler command, reusing a stored build if one matches.
+
+    The build cache is configured with CURRICULA_BUILD_CACHE or
+    set_build_cache. Without one this is just run. The output and the
+    sources it is built from are needed to key and restore the build.
+    """
+
+    from .buildcache import get_build_cache
+
+    cache = get_build_cache()
+    if cache is None:
+        return run(*args, cwd=cwd, timeout=timeout)
+    return cache.build(*args, output=output, sources=sources, include_paths=include_paths, cwd=cwd, timeout=timeout)
+
+
+def interact(*args: str, compare: "Comparator" = None) -> Interactive:
     """Shorthand for interactive, makes the interface nicer."""
 
-    return Interactive(args=args)
+    return Interactive(args=args, compare=compare)
@@ -1,13 +1,22 @@
+import atexit
+import json
 import linecache
-import tracemalloc
+import os
+import threading
+import timeit
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Iterator, List, Optional, TYPE_CHECKING
 
+if TYPE_CHECKING:
+    import tracemalloc
 
-def summarize(snapshot: tracemalloc.Snapshot, key_type: str, limit: int):
+
+def summarize(snapshot: "tracemalloc.Snapshot", key_type: str, limit: int):
     """Summarize snapshot in console."""
 
-    snapshot = snapshot.filter_traces((
-        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
-        tracemalloc.Filter(False, "<unknown>"),))
+    snapshot = _filter(snapshot)
     top_statistics = snapshot.statistics(key_type)
 
     for i, statistic in enumerate(top_statistics[:limit], 1):
@@ -23,3 +32,267 @@ def summarize(snapshot: tracemalloc.Snapshot, key_type: str, limit: int):
         print("%s other: %.1f KiB" % (len(other), size / 1024))
     total = sum(statistic.size for statistic in top_statistics)
     print("Total allocated size: %.1f KiB" % (total / 1024))
+
+
+PROFILE_ENVIRONMENT_VARIABLE = "CURRICULA_PROFILE"
+PROFILE_FRAMES_ENVIRONMENT_VARIABLE = "CURRICULA_PROFILE_FRAMES"
+
+
+def _filter(snapshot: "tracemalloc.Snapshot") -> "tracemalloc.Snapshot":
+    """Hide allocations made by the import machinery."""
+
+    import tracemalloc
+
+    return snapshot.filter_traces((
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        tracemalloc.Filter(False, "<unknown>"),
+        tracemalloc.Filter(False, tracemalloc.__file__),))
+
+
+@dataclass(eq=False)
+class ProfilePhase:
+    """Memory usage recorded between two points in a session."""
+
+    name: str
+    depth: int
+    thread: str
+    start_time: float
+    snapshot: Any = field(repr=False, default=None)
+
+    elapsed: Optional[float] = None
+    size_before: Optional[int] = None
+    size_after: Optional[int] = None
+    peak: int = 0
+    statistics: List[dict] = field(default_factory=list)
+
+    def dump(self) -> dict:
+        """Serialize without the snapshot."""
+
+        return dict(
+            name=self.name,
+            depth=self.depth,
+            thread=self.thread,
+            elapsed=self.elapsed,
+            size_before=self.size_before,
+            size_after=self.size_after,
+            size_delta=self.size_after - self.size_before if self.size_after is not None else None,
+            peak=self.peak,
+            statistics=self.statistics)
+
+
+class ProfileSession:
+    """Track memory across named phases of a long-running process.
+
+    Each phase takes a tracemalloc snapshot when it begins and ends, and
+    records the allocation sites that grew the most in between as well
+    as the peak traced memory while it was open. Phases may be nested,
+    and each thread nests its own, so workers can open phases at once.
+    Results are written to a JSON file on stop if a path is provided.
+    """
+
+    frames: int
+    key_type: str
+    limit: int
+    path: Optional[Path]
+
+    phases: List[ProfilePhase]
+    _open: List[ProfilePhase]
+    _local: threading.local
+    _lock: threading.Lock
+    _started_tracing: bool
+
+    def __init__(self, path: Path = None, frames: int = 1, key_type: str = "lineno", limit: int = 10):
+        self.path = path
+        self.frames = frames
+        self.key_type = key_type
+        self.limit = limit
+        self.phases = []
+        self._open = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._started_tracing = False
+
+    @property
+    def _stack(self) -> List[ProfilePhase]:
+        """Phases opened by the current thread, innermost last."""
+
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    @property
+    def running(self) -> bool:
+        return self._started_tracing
+
+    def start(self):
+        """Begin tracing allocations if not already."""
+
+        import tracemalloc
+
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+            self._started_tracing = True
+        tracemalloc.reset_peak()
+
+    def stop(self):
+        """Close open phases, stop tracing, and write results."""
+
+        import tracemalloc
+
+        with self._lock:
+            still_open = list(reversed(self._open))
+        for phase in still_open:
+            self._close(phase)
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+        if self.path is not None:
+            self.write(self.path)
+
+    def _update_peak(self):
+        """Fold the traced peak into every open phase, hold the lock."""
+
+        import tracemalloc
+
+        peak = tracemalloc.get_traced_memory()[1]
+        for phase in self._open:
+            phase.peak = max(phase.peak, peak)
+        tracemalloc.reset_peak()
+
+    def begin(self, name: str) -> ProfilePhase:
+        """Open a new phase nested in the current one."""
+
+        import tracemalloc
+
+        if not tracemalloc.is_tracing():
+            self.start()
+
+        snapshot = _filter(tracemalloc.take_snapshot())
+        stack = self._stack
+        with self._lock:
+            self._update_peak()
+            current = tracemalloc.get_traced_memory()[0]
+            phase = ProfilePhase(
+                name=name,
+                depth=len(stack),
+                thread=threading.current_thread().name,
+                start_time=timeit.default_timer(),
+                snapshot=snapshot,
+                size_before=current,
+                peak=current)
+            self._open.append(phase)
+            self.phases.append(phase)
+        stack.append(phase)
+        return phase
+
+    def end(self, name: str) -> ProfilePhase:
+        """Close the innermost phase, which must match the name."""
+
+        stack = self._stack
+        if not stack or stack[-1].name != name:
+            raise RuntimeError(f"phase {name} is not the innermost open phase")
+        return self._close(stack.pop())
+
+    def _close(self, phase: ProfilePhase) -> ProfilePhase:
+        """Record the end of a phase already removed from its stack."""
+
+        import tracemalloc
+
+        with self._lock:
+            if phase not in self._open:
+                return phase
+            self._update_peak()
+            self._open.remove(phase)
+            phase.elapsed = timeit.default_timer() - phase.start_time
+            phase.size_after = tracemalloc.get_traced_memory()[0]
+
+        snapshot = _filter(tracemalloc.take_snapshot())
+        differences = snapshot.compare_to(phase.snapshot, self.key_type)
+        phase.snapshot = None
+
+        # Replace in one step so dump never sees a partial list
+        phase.statistics = [
+            dict(
+                traceback=[dict(file=frame.filename, line=frame.lineno) for frame in difference.traceback],
+                size=difference.size,
+                size_diff=difference.size_diff,
+                count=difference.count,
+                count_diff=difference.count_diff)
+            for difference in differences[:self.limit]]
+        return phase
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[ProfilePhase]:
+        """Record a phase around a block of code."""
+
+        phase = self.begin(name)
+        try:
+            yield phase
+        finally:
+            self.end(name)
+
+    def dump(self) -> dict:
+        """Serialize all closed phases."""
+
+        return dict(
+            frames=self.frames,
+            key_type=self.key_type,
+            limit=self.limit,
+            phases=[phase.dump() for phase in self._closed()])
+
+    def _closed(self) -> List[ProfilePhase]:
+        """Phases that have ended, in the order they began."""
+
+        with self._lock:
+            return [phase for phase in self.phases if phase.elapsed is not None]
+
+    def write(self, path: Path):
+        """Write results as JSON."""
+
+        with path.open("w") as file:
+            json.dump(self.dump(), file, indent=2)
+
+
+session: Optional[ProfileSession] = None
+
+
+def enable(path: Path = None, frames: int = 1, key_type: str = "lineno", limit: int = 10) -> ProfileSession:
+    """Start the process-wide session used by phase()."""
+
+    global session
+    if session is None:
+        session = ProfileSession(path=path, frames=frames, key_type=key_type, limit=limit)
+        session.start()
+        atexit.register(disable)
+    return session
+
+
+def disable():
+    """Stop the process-wide session and write its results."""
+
+    global session
+    if session is not None:
+        session, stopping = None, session
+        stopping.stop()
+
+
+def enable_from_environment() -> Optional[ProfileSession]:
+    """Enable profiling if CURRICULA_PROFILE names an output file."""
+
+    path = os.environ.get(PROFILE_ENVIRONMENT_VARIABLE)
+    if not path:
+        return None
+    frames = int(os.environ.get(PROFILE_FRAMES_ENVIRONMENT_VARIABLE, 1))
+    return enable(path=Path(path), frames=frames)
+
+
+@contextmanager
+def phase(name: str) -> Iterator[Optional[ProfilePhase]]:
+    """Record a phase in the process-wide session, if enabled."""
+
+    if session is None:
+        yield None
+    else:
+        with session.phase(name) as recorded:
+            yield recorded
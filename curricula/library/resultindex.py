@@ -0,0 +1,359 @@
+import os
+import sys
+import json
+import sqlite3
+import statistics
+
+from pathlib import Path
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from ..log import log
+
+__all__ = (
+    "IndexedResult",
+    "ResultIndex",
+    "find_results",
+    "main")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    submission TEXT NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL);
+
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY,
+    file_id INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+    submission TEXT NOT NULL,
+    problem TEXT,
+    test TEXT NOT NULL,
+    location TEXT NOT NULL,
+    passing INTEGER,
+    elapsed REAL,
+    code INTEGER,
+    timeout REAL,
+    timed_out INTEGER,
+    raised_exception INTEGER,
+    stdout_size INTEGER,
+    stderr_size INTEGER,
+    mismatch_offset INTEGER);
+
+CREATE INDEX IF NOT EXISTS results_file ON results(file_id);
+CREATE INDEX IF NOT EXISTS results_test ON results(test, timed_out, passing);
+CREATE INDEX IF NOT EXISTS results_problem ON results(problem, test, elapsed);
+CREATE INDEX IF NOT EXISTS results_submission ON results(submission);
+"""
+
+# Bumped whenever the schema or extraction changes, forcing a rebuild
+VERSION = 1
+
+
+@dataclass(eq=False)
+class IndexedResult:
+    """A single test result pulled out of a result dump."""
+
+    problem: Optional[str]
+    test: str
+    location: str
+    passing: Optional[bool]
+    runtime: Optional[dict]
+
+    def row(self) -> tuple:
+        """Column values for the runtime fields."""
+
+        runtime = self.runtime or {}
+        mismatch = runtime.get("mismatch") or {}
+        stdout = runtime.get("stdout")
+        stderr = runtime.get("stderr")
+        return (
+            self.problem,
+            self.test,
+            self.location,
+            self.passing,
+            runtime.get("elapsed"),
+            runtime.get("code"),
+            runtime.get("timeout"),
+            runtime.get("timed_out"),
+            runtime.get("raised_exception"),
+            len(stdout) if isinstance(stdout, str) else None,
+            len(stderr) if isinstance(stderr, str) else None,
+            mismatch.get("offset"))
+
+
+def is_runtime(value: Any) -> bool:
+    """Whether a value looks like a dumped Runtime."""
+
+    return isinstance(value, dict) and "args" in value and "timed_out" in value
+
+
+def find_runtime(value: Any) -> Optional[dict]:
+    """The first dumped Runtime nested anywhere in a value."""
+
+    if is_runtime(value):
+        return value
+    children = value.values() if isinstance(value, dict) else value if isinstance(value, list) else ()
+    for child in children:
+        runtime = find_runtime(child)
+        if runtime is not None:
+            return runtime
+    return None
+
+
+def find_results(data: Any, problem: Optional[str] = None, location: str = "") -> Iterator[IndexedResult]:
+    """Walk a result dump for anything with a pass or fail outcome.
+
+    Results are dictionaries with a boolean passing or passed field,
+    named by their key or their own name field. The problem is taken
+    from the nearest enclosing key under a problems mapping. A bare
+    dumped Runtime is also indexed, since that is what process jobs
+    produce.
+    """
+
+    if isinstance(data, dict):
+        outcome = data.get("passing", data.get("passed"))
+        if isinstance(outcome, bool):
+            name = data.get("name") or location.rsplit("/", 1)[-1] or "result"
+            yield IndexedResult(
+                problem=problem,
+                test=str(name),
+                location=location or "/",
+                passing=outcome,
+                runtime=find_runtime(data))
+            return
+        if is_runtime(data):
+            yield IndexedResult(
+                problem=problem,
+                test=location.rsplit("/", 1)[-1] or "runtime",
+                location=location or "/",
+                passing=None,
+                runtime=data)
+            return
+
+        for key, value in data.items():
+            child_problem = key if location.rsplit("/", 1)[-1] == "problems" else problem
+            yield from find_results(value, child_problem, f"{location}/{key}")
+
+    elif isinstance(data, list):
+        for i, value in enumerate(data):
+            yield from find_results(value, problem, f"{location}/{i}")
+
+
+class ResultIndex:
+    """SQLite index over a directory of result dumps.
+
+    Each dump is recorded with its modification time and size, so an
+    update only parses files that are new or changed and removes rows
+    for files that disappeared. Results are stored one row per test
+    with the runtime fields worth filtering on as indexed columns.
+    """
+
+    path: Path
+    connection: sqlite3.Connection
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.connection = sqlite3.connect(str(path))
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA foreign_keys=ON")
+
+        version = self.connection.execute("PRAGMA user_version").fetchone()[0]
+        if version != VERSION:
+            self.connection.executescript("DROP TABLE IF EXISTS results; DROP TABLE IF EXISTS files;")
+        self.connection.executescript(SCHEMA)
+        self.connection.execute(f"PRAGMA user_version={VERSION}")
+
+    def close(self):
+        """Close the database."""
+
+        self.connection.close()
+
+    def __enter__(self) -> "ResultIndex":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _ingest(self, path: Path, stat: os.stat_result) -> int:
+        """Replace the rows of a single file, returning results found."""
+
+        try:
+            with path.open() as file:
+                data = json.load(file)
+        except (OSError, ValueError) as error:
+            log.warning(f"skipping unreadable result {path}: {error}")
+            return 0
+
+        submission = data.get("submission") if isinstance(data, dict) else None
+        if not isinstance(submission, str):
+            submission = path.stem
+
+        cursor = self.connection.execute("DELETE FROM files WHERE path = ?", (str(path),))
+        cursor = self.connection.execute(
+            "INSERT INTO files (path, submission, mtime_ns, size) VALUES (?, ?, ?, ?)",
+            (str(path), submission, stat.st_mtime_ns, stat.st_size))
+        file_id = cursor.lastrowid
+
+        rows = [(file_id, submission) + result.row() for result in find_results(data)]
+        self.connection.executemany(
+            "INSERT INTO results (file_id, submission, problem, test, location, passing, elapsed, code, timeout,"
+            " timed_out, raised_exception, stdout_size, stderr_size, mismatch_offset)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            rows)
+        return len(rows)
+
+    def update(self, directory: Path, pattern: str = "**/*.json") -> Dict[str, int]:
+        """Bring the index up to date with the dumps in a directory."""
+
+        known = {
+            path: (mtime_ns, size)
+            for path, mtime_ns, size in self.connection.execute("SELECT path, mtime_ns, size FROM files")}
+        root = str(directory.resolve())
+
+        counts = dict(added=0, updated=0, removed=0, unchanged=0, results=0)
+        seen = set()
+        with self.connection:
+            for path in sorted(directory.resolve().glob(pattern)):
+                if not path.is_file():
+                    continue
+                key = str(path)
+                seen.add(key)
+                stat = path.stat()
+                previous = known.get(key)
+                if previous == (stat.st_mtime_ns, stat.st_size):
+                    counts["unchanged"] += 1
+                    continue
+                counts["updated" if previous is not None else "added"] += 1
+                counts["results"] += self._ingest(path, stat)
+
+            for key in known:
+                if key not in seen and (key.startswith(root + os.sep)):
+                    self.connection.execute("DELETE FROM files WHERE path = ?", (key,))
+                    counts["removed"] += 1
+
+        return counts
+
+    def query(self, sql: str, parameters: Sequence[Any] = ()) -> List[sqlite3.Row]:
+        """Run arbitrary SQL against the index."""
+
+        self.connection.row_factory = sqlite3.Row
+        try:
+            return self.connection.execute(sql, parameters).fetchall()
+        finally:
+            self.connection.row_factory = None
+
+    def timed_out(self, test: str, problem: Optional[str] = None) -> List[str]:
+        """Submissions that timed out on a test."""
+
+        sql = "SELECT DISTINCT submission FROM results WHERE test = ? AND timed_out = 1"
+        parameters: Tuple[Any, ...] = (test,)
+        if problem is not None:
+            sql += " AND problem = ?"
+            parameters += (problem,)
+        return [row[0] for row in self.connection.execute(sql + " ORDER BY submission", parameters)]
+
+    def failed(self, test: str, problem: Optional[str] = None) -> List[str]:
+        """Submissions that did not pass a test."""
+
+        sql = "SELECT DISTINCT submission FROM results WHERE test = ? AND passing = 0"
+        parameters: Tuple[Any, ...] = (test,)
+        if problem is not None:
+            sql += " AND problem = ?"
+            parameters += (problem,)
+        return [row[0] for row in self.connection.execute(sql + " ORDER BY submission", parameters)]
+
+    def elapsed(self, problem: Optional[str] = None, test: Optional[str] = None) -> Dict[str, Optional[float]]:
+        """Distribution of elapsed time across submissions."""
+
+        sql = "SELECT elapsed FROM results WHERE elapsed IS NOT NULL"
+        parameters: Tuple[Any, ...] = ()
+        if problem is not None:
+            sql += " AND problem = ?"
+            parameters += (problem,)
+        if test is not None:
+            sql += " AND test = ?"
+            parameters += (test,)
+        values = sorted(row[0] for row in self.connection.execute(sql, parameters))
+        if not values:
+            return dict(count=0, min=None, median=None, p90=None, max=None, mean=None)
+
+        return dict(
+            count=len(values),
+            min=values[0],
+            median=statistics.median(values),
+            p90=values[min(len(values) - 1, int(len(values) * 0.9))],
+            max=values[-1],
+            mean=statistics.fmean(values))
+
+    def summary(self, problem: Optional[str] = None) -> List[dict]:
+        """Per test counts of passes, failures and timeouts."""
+
+        sql = (
+            "SELECT problem, test, COUNT(*), SUM(passing = 1), SUM(passing = 0), SUM(timed_out = 1), AVG(elapsed)"
+            " FROM results")
+        parameters: Tuple[Any, ...] = ()
+        if problem is not None:
+            sql += " WHERE problem = ?"
+            parameters += (problem,)
+        sql += " GROUP BY problem, test ORDER BY problem, test"
+        return [
+            dict(problem=row[0], test=row[1], count=row[2], passed=row[3], failed=row[4], timed_out=row[5], mean_elapsed=row[6])
+            for row in self.connection.execute(sql, parameters)]
+
+
+def main(argv: Iterable[str] = None) -> int:
+    """Update and query a result index from the command line."""
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Index and query curricula grading results")
+    parser.add_argument("database", help="path of the SQLite index")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    update = subparsers.add_parser("update", help="ingest new and changed result dumps")
+    update.add_argument("directories", nargs="+")
+    update.add_argument("--pattern", default="**/*.json")
+
+    timed_out = subparsers.add_parser("timed-out", help="submissions that timed out on a test")
+    timed_out.add_argument("test")
+    timed_out.add_argument("-p", "--problem", default=None)
+
+    failed = subparsers.add_parser("failed", help="submissions that failed a test")
+    failed.add_argument("test")
+    failed.add_argument("-p", "--problem", default=None)
+
+    elapsed = subparsers.add_parser("elapsed", help="distribution of elapsed time")
+    elapsed.add_argument("-p", "--problem", default=None)
+    elapsed.add_argument("-t", "--test", default=None)
+
+    summary = subparsers.add_parser("summary", help="pass, fail and timeout counts per test")
+    summary.add_argument("-p", "--problem", default=None)
+
+    sql = subparsers.add_parser("sql", help="run a query and print rows as JSON")
+    sql.add_argument("query")
+
+    args = parser.parse_args(argv)
+    with ResultIndex(Path(args.database)) as index:
+        if args.command == "update":
+            for directory in args.directories:
+                output = index.update(Path(directory), pattern=args.pattern)
+                print(json.dumps(dict(directory=directory, **output)))
+        elif args.command == "timed-out":
+            print("\n".join(index.timed_out(args.test, problem=args.problem)))
+        elif args.command == "failed":
+            print("\n".join(index.failed(args.test, problem=args.problem)))
+        elif args.command == "elapsed":
+            print(json.dumps(index.elapsed(problem=args.problem, test=args.test), indent=2))
+        elif args.command == "summary":
+            for row in index.summary(problem=args.problem):
+                print(json.dumps(row))
+        elif args.command == "sql":
+            for row in index.query(args.query):
+                print(json.dumps(dict(row)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
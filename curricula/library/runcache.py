@@ -0,0 +1,286 @@
+import os
+import json
+import time
+import base64
+import shutil
+import hashlib
+import threading
+
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Sequence, Tuple, Union, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .process import Runtime, StdinReference
+
+__all__ = (
+    "RunCache",
+    "get_cache",
+    "set_cache",
+    "RUN_CACHE_ENVIRONMENT_VARIABLE")
+
+RUN_CACHE_ENVIRONMENT_VARIABLE = "CURRICULA_RUN_CACHE"
+
+# Bumped whenever the key derivation or entry format changes
+VERSION = 1
+
+# Most file hashes remembered by hash_file_cached
+HASH_MEMO_SIZE = 4096
+
+_hashes: "OrderedDict[Tuple[str, int, int, int], str]" = OrderedDict()
+_hashes_lock = threading.Lock()
+
+
+def hash_file(path: Path) -> str:
+    """Compute the SHA-256 of a file's contents."""
+
+    digest = hashlib.sha256()
+    with path.open("rb") as file:
+        while True:
+            chunk = file.read(1 << 20)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def hash_file_cached(path: Path) -> str:
+    """Hash a file, reusing the result while its stat is unchanged.
+
+    The inode is part of the stamp so that a file replaced by a rename
+    isn't mistaken for the original, and only the most recently used
+    hashes are kept.
+    """
+
+    stat = path.stat()
+    stamp = (str(path.resolve()), stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    with _hashes_lock:
+        digest = _hashes.get(stamp)
+        if digest is not None:
+            _hashes.move_to_end(stamp)
+            return digest
+
+    digest = hash_file(path)
+    with _hashes_lock:
+        _hashes[stamp] = digest
+        while len(_hashes) > HASH_MEMO_SIZE:
+            _hashes.popitem(last=False)
+    return digest
+
+
+def resolve_executable(executable: str, cwd: Optional[Path]) -> Optional[Path]:
+    """Find the file that would be executed for the first argument."""
+
+    if os.sep in executable:
+        path = Path(executable)
+        if not path.is_absolute() and cwd is not None:
+            path = cwd.joinpath(path)
+        return path if path.is_file() else None
+    found = shutil.which(executable)
+    return Path(found) if found is not None else None
+
+
+def encode(data: Optional[bytes]) -> Optional[str]:
+    """Store bytes losslessly in JSON."""
+
+    return base64.b64encode(data).decode() if data is not None else None
+
+
+def decode(data: Optional[str]) -> Optional[bytes]:
+    """Inverse of encode."""
+
+    return base64.b64decode(data) if data is not None else None
+
+
+class RunCache:
+    """Content-addressed store of completed process runs.
+
+    A run is keyed on a hash of the executable's bytes, the arguments,
+    stdin, and the contents of each declared input file, so a hit means
+    the process would be given exactly the same inputs. Entries are JSON
+    files in a directory and the least recently used are evicted once
+    either the entry or byte limit is exceeded. Runs that timed out or
+    failed to start are never stored.
+    """
+
+    path: Path
+    max_entries: int
+    max_bytes: int
+
+    hits: int
+    misses: int
+
+    _index: Dict[str, Tuple[float, int]]
+    _size: int
+    _lock: threading.Lock
+
+    def __init__(self, path: Path, max_entries: int = 100_000, max_bytes: int = 1 << 30):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        self.path.mkdir(parents=True, exist_ok=True)
+        self._index = {}
+        self._size = 0
+        for entry in self.path.glob("*.json"):
+            stat = entry.stat()
+            self._index[entry.stem] = (stat.st_mtime, stat.st_size)
+            self._size += stat.st_size
+
+    def key(
+            self,
+            args: Sequence[str],
+            stdin: "Optional[Union[bytes, StdinReference]]" = None,
+            cwd: Optional[Path] = None,
+            inputs: Iterable[Path] = ()) -> Optional[str]:
+        """Derive the cache key, or None if the executable can't be found."""
+
+        executable = resolve_executable(args[0], cwd) if args else None
+        if executable is None:
+            return None
+
+        digest = hashlib.sha256()
+        digest.update(json.dumps(dict(
+            version=VERSION,
+            executable=hash_file_cached(executable),
+            args=list(args),
+            cwd=str(cwd) if cwd is not None else None)).encode())
+        if stdin is None or isinstance(stdin, (bytes, bytearray)):
+            digest.update(b"\0stdin\0" if stdin is not None else b"\0nostdin\0")
+            digest.update(stdin or b"")
+        else:
+            # Files given as stdin are identified by their hash
+            digest.update(f"\0stdinfile\0{stdin.digest}".encode())
+
+        for path in sorted(inputs):
+            if cwd is not None and not path.is_absolute():
+                path = cwd.joinpath(path)
+            digest.update(f"\0input\0{path}\0".encode())
+            digest.update(hash_file_cached(path).encode() if path.is_file() else b"missing")
+
+        return digest.hexdigest()
+
+    def _entry_path(self, key: str) -> Path:
+        return self.path.joinpath(f"{key}.json")
+
+    def get(self, key: str, timeout: Optional[float] = None) -> "Optional[Runtime]":
+        """Load a stored runtime, ignoring it if it would now time out."""
+
+        from .process import Runtime, StdinReference
+
+        try:
+            with self._entry_path(key).open() as file:
+                data = json.load(file)
+        except (OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+
+        if timeout is not None and data["elapsed"] is not None and data["elapsed"] >= timeout:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        try:
+            os.utime(str(self._entry_path(key)))
+        except OSError:
+            pass
+        with self._lock:
+            self.hits += 1
+            if key in self._index:
+                self._index[key] = (time.time(), self._index[key][1])
+
+        return Runtime(
+            args=tuple(data["args"]),
+            cwd=Path(data["cwd"]) if data["cwd"] is not None else None,
+            stdin=StdinReference.load(data["stdin"]) if isinstance(data["stdin"], dict) else decode(data["stdin"]),
+            stdout=decode(data["stdout"]),
+            stderr=decode(data["stderr"]),
+            elapsed=data["elapsed"],
+            code=data["code"],
+            timeout=timeout)
+
+    def put(self, key: str, runtime: "Runtime") -> bool:
+        """Store a completed runtime, returning whether it was cacheable."""
+
+        if runtime.timed_out or runtime.raised_exception:
+            return False
+
+        data = json.dumps(dict(
+            args=list(runtime.args),
+            cwd=str(runtime.cwd) if runtime.cwd is not None else None,
+            stdin=runtime.stdin.dump() if hasattr(runtime.stdin, "dump") else encode(runtime.stdin),
+            stdout=encode(runtime.stdout),
+            stderr=encode(runtime.stderr),
+            elapsed=runtime.elapsed,
+            code=runtime.code)).encode()
+
+        # Write atomically so concurrent graders never see partial entries
+        path = self._entry_path(key)
+        temporary = path.with_name(f".{key}.{os.getpid()}.{threading.get_ident()}")
+        temporary.write_bytes(data)
+        os.replace(str(temporary), str(path))
+
+        with self._lock:
+            previous = self._index.get(key)
+            if previous is not None:
+                self._size -= previous[1]
+            self._index[key] = (time.time(), len(data))
+            self._size += len(data)
+            self._evict()
+        return True
+
+    def _evict(self):
+        """Remove least recently used entries until within bounds."""
+
+        if len(self._index) <= self.max_entries and self._size <= self.max_bytes:
+            return
+
+        for key, (_, size) in sorted(self._index.items(), key=lambda item: item[1][0]):
+            if len(self._index) <= self.max_entries and self._size <= self.max_bytes:
+                break
+            try:
+                os.remove(str(self._entry_path(key)))
+            except FileNotFoundError:
+                pass
+            del self._index[key]
+            self._size -= size
+
+    def invalidate(self, key: Optional[str] = None):
+        """Drop one entry or clear the cache."""
+
+        with self._lock:
+            keys = [key] if key is not None else list(self._index)
+            for each in keys:
+                try:
+                    os.remove(str(self._entry_path(each)))
+                except FileNotFoundError:
+                    pass
+                _, size = self._index.pop(each, (None, 0))
+                self._size -= size
+
+
+cache: Optional[RunCache] = None
+_configured = False
+
+
+def set_cache(new: Optional[RunCache]):
+    """Set the cache used by process.run when none is passed."""
+
+    global cache, _configured
+    cache = new
+    _configured = True
+
+
+def get_cache() -> Optional[RunCache]:
+    """Get the default cache, configured from CURRICULA_RUN_CACHE if unset."""
+
+    global cache, _configured
+    if not _configured:
+        path = os.environ.get(RUN_CACHE_ENVIRONMENT_VARIABLE)
+        cache = RunCache(Path(path)) if path else None
+        _configured = True
+    return cache
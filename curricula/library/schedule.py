@@ -0,0 +1,321 @@
+import json
+import heapq
+import timeit
+import threading
+import contextlib
+
+from pathlib import Path
+from dataclasses import dataclass, field, replace
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from ..log import log
+from .process import Runtime
+from .affinity import CorePool
+from .journal import Journal
+
+__all__ = (
+    "History",
+    "Task",
+    "TaskResult",
+    "Scheduler",
+    "LONGEST_FIRST",
+    "FASTEST_FIRST")
+
+LONGEST_FIRST = "longest"
+FASTEST_FIRST = "fastest"
+
+
+class History:
+    """Running estimate of how long each task takes.
+
+    Estimates are an exponential moving average of observed durations
+    so that they follow changes in the tests without being thrown off
+    by a single slow run. The history is kept in a JSON file so that it
+    carries over between grading runs.
+    """
+
+    path: Optional[Path]
+    alpha: float
+
+    _estimates: Dict[str, Dict[str, float]]
+    _lock: threading.Lock
+
+    def __init__(self, path: Path = None, alpha: float = 0.3):
+        self.path = path
+        self.alpha = alpha
+        self._estimates = {}
+        self._lock = threading.Lock()
+        if path is not None and path.exists():
+            with path.open() as file:
+                self._estimates = json.load(file)
+
+    def estimate(self, name: str, default: Optional[float] = None) -> Optional[float]:
+        """Expected duration in seconds, or the default if never seen."""
+
+        entry = self._estimates.get(name)
+        return entry["mean"] if entry is not None else default
+
+    def record(self, name: str, elapsed: float):
+        """Fold a new observation into the estimate."""
+
+        with self._lock:
+            entry = self._estimates.get(name)
+            if entry is None:
+                self._estimates[name] = dict(mean=elapsed, count=1)
+            else:
+                entry["mean"] += self.alpha * (elapsed - entry["mean"])
+                entry["count"] += 1
+
+    def save(self):
+        """Write the estimates back to the file."""
+
+        if self.path is not None:
+            with self._lock, self.path.open("w") as file:
+                json.dump(self._estimates, file, indent=2)
+
+
+def runtime_passed(result: Any) -> bool:
+    """Default pass check, runtimes must exit cleanly."""
+
+    if isinstance(result, Runtime):
+        return not result.timed_out and not result.raised_exception and result.code == 0
+    if isinstance(result, bool):
+        return result
+    return getattr(result, "passing", True)
+
+
+@dataclass(eq=False)
+class Task:
+    """Something to run, such as a build step or test case."""
+
+    name: str
+    function: Callable[[], Any]
+
+    # Names of tasks that must pass before this one runs
+    dependencies: Tuple[str, ...] = ()
+
+    # Used as the cost estimate when there is no history
+    timeout: Optional[float] = None
+
+    # Decide whether the result counts as passing
+    passed: Callable[[Any], bool] = runtime_passed
+
+    # Run on an exclusive core when the scheduler has a core pool
+    timing_sensitive: bool = False
+
+
+@dataclass(eq=False)
+class TaskResult:
+    """What happened to a task."""
+
+    name: str
+    result: Any = None
+    passed: bool = False
+    skipped: bool = False
+    reason: Optional[str] = None
+    elapsed: Optional[float] = None
+
+    def dump(self) -> dict:
+        """Serialize, dumping the result if it supports it."""
+
+        dump = getattr(self.result, "dump", None)
+        return dict(
+            name=self.name,
+            result=dump() if dump is not None else self.result,
+            passed=self.passed,
+            skipped=self.skipped,
+            reason=self.reason,
+            elapsed=self.elapsed)
+
+    def dump_encoded(self) -> dict:
+        """Serialize losslessly, runtimes keep their exact output."""
+
+        if not isinstance(self.result, Runtime):
+            return self.dump()
+        dump = replace(self, result=None).dump()
+        dump.update(result=self.result.dump_encoded(), runtime=True)
+        return dump
+
+    @classmethod
+    def load(cls, data: dict) -> "TaskResult":
+        """Deserialize either dump, other results are left as they were dumped."""
+
+        return cls(
+            name=data["name"],
+            result=Runtime.load_encoded(data["result"]) if data.get("runtime") else data["result"],
+            passed=data["passed"],
+            skipped=data["skipped"],
+            reason=data["reason"],
+            elapsed=data["elapsed"])
+
+
+@dataclass(eq=False)
+class Scheduler:
+    """Run tasks on a worker pool in an order informed by history.
+
+    With LONGEST_FIRST, ready tasks are started in decreasing order of
+    expected duration, which keeps the pool busy and shortens the
+    overall run. With FASTEST_FIRST, quick tasks go first so failures
+    surface as early as possible. A task whose dependency failed or was
+    skipped is itself skipped with a recorded reason, and fail_fast
+    skips everything not yet started once any task fails.
+
+    Given a core pool, each worker pins itself, and therefore the
+    processes its task runs, for the duration of the task. Timing
+    sensitive tasks wait for one of its exclusive cores while the rest
+    share its shared cores.
+
+    Given a journal, every finished task is recorded as it completes and
+    tasks already in the journal are restored instead of run, so an
+    interrupted batch resumes where it stopped. Restored runtimes are
+    exact while other results hold what they dumped.
+    """
+
+    history: History = field(default_factory=History)
+    workers: int = 1
+    order: str = LONGEST_FIRST
+    fail_fast: bool = False
+
+    # Cost assumed for tasks with neither history nor timeout
+    default_cost: float = 1.0
+
+    # Cores to pin workers to, if any
+    cores: Optional[CorePool] = None
+
+    # Record of finished tasks to resume from, if any
+    journal: Optional[Journal] = None
+
+    def cost(self, task: Task) -> float:
+        """Expected duration used for ordering."""
+
+        return self.history.estimate(task.name, task.timeout if task.timeout is not None else self.default_cost)
+
+    def _priority(self, task: Task, index: int) -> Tuple[float, int]:
+        """Heap key, declaration order breaks ties."""
+
+        cost = self.cost(task)
+        return (-cost if self.order == LONGEST_FIRST else cost), index
+
+    def _execute(self, task: Task) -> TaskResult:
+        """Run one task and time it."""
+
+        pin = self.cores.pin(exclusive=task.timing_sensitive) if self.cores is not None else contextlib.nullcontext()
+        start = timeit.default_timer()
+        try:
+            with pin:
+                # Waiting for an exclusive core isn't part of the task
+                start = timeit.default_timer()
+                result = task.function()
+        except Exception as exception:
+            log.exception(f"task {task.name} raised an exception")
+            return TaskResult(
+                name=task.name,
+                passed=False,
+                reason=f"{type(exception).__name__}: {exception}",
+                elapsed=timeit.default_timer() - start)
+
+        elapsed = timeit.default_timer() - start
+        if isinstance(result, Runtime):
+            if result.timed_out and result.timeout is not None:
+                elapsed = result.timeout
+            elif result.elapsed is not None:
+                elapsed = result.elapsed
+
+        passed = task.passed(result)
+        return TaskResult(name=task.name, result=result, passed=passed, elapsed=elapsed)
+
+    def run(self, tasks: Iterable[Task]) -> Dict[str, TaskResult]:
+        """Run everything, returning results in declaration order."""
+
+        tasks = list(tasks)
+        by_name = {task.name: task for task in tasks}
+        index = {task.name: i for i, task in enumerate(tasks)}
+        for task in tasks:
+            for dependency in task.dependencies:
+                if dependency not in by_name:
+                    raise ValueError(f"task {task.name} depends on unknown task {dependency}")
+
+        results: Dict[str, TaskResult] = {}
+        waiting = {task.name: set(task.dependencies) for task in tasks}
+        dependents: Dict[str, List[str]] = {task.name: [] for task in tasks}
+        for task in tasks:
+            for dependency in task.dependencies:
+                dependents[dependency].append(task.name)
+
+        ready: List[Tuple[Tuple[float, int], str]] = []
+        for task in tasks:
+            if not task.dependencies:
+                heapq.heappush(ready, (self._priority(task, index[task.name]), task.name))
+
+        failed = False
+
+        def skip(name: str, reason: str):
+            """Skip a task and everything that depends on it."""
+
+            if name in results:
+                return
+            results[name] = TaskResult(name=name, skipped=True, reason=reason)
+            for dependent in dependents[name]:
+                skip(dependent, f"dependency {name} was skipped")
+
+        def finish(result: TaskResult, restored: bool = False):
+            """Record a result and release or skip dependents."""
+
+            nonlocal failed
+            results[result.name] = result
+            if not restored:
+                if result.elapsed is not None:
+                    self.history.record(result.name, result.elapsed)
+                if self.journal is not None:
+                    # Failing to journal only costs rerunning the task on resume
+                    try:
+                        self.journal.record(result.name, result.dump_encoded())
+                    except Exception:
+                        log.exception(f"failed to journal the result of task {result.name}")
+            if not result.passed:
+                failed = True
+                for dependent in dependents[result.name]:
+                    skip(dependent, f"dependency {result.name} failed")
+                return
+            for dependent in dependents[result.name]:
+                waiting[dependent].discard(result.name)
+                if not waiting[dependent] and dependent not in results:
+                    heapq.heappush(ready, (self._priority(by_name[dependent], index[dependent]), dependent))
+
+        from . import profile
+
+        # Keep what was learned about durations even if interrupted
+        try:
+            running: Dict[Future, str] = {}
+            with profile.phase("schedule"), ThreadPoolExecutor(max_workers=self.workers) as executor:
+                while ready or running:
+                    while ready and len(running) < self.workers:
+                        _, name = heapq.heappop(ready)
+                        if name in results:
+                            continue
+                        if failed and self.fail_fast:
+                            skip(name, "an earlier task failed")
+                            continue
+                        if self.journal is not None and name in self.journal:
+                            finish(TaskResult.load(self.journal.get(name)), restored=True)
+                            continue
+                        running[executor.submit(self._execute, by_name[name])] = name
+
+                    if not running:
+                        continue
+
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        running.pop(future)
+                        finish(future.result())
+
+            for task in tasks:
+                if task.name not in results:
+                    skip(task.name, "dependencies were never satisfied")
+        finally:
+            self.history.save()
+            if self.journal is not None:
+                self.journal.sync()
+
+        return {task.name: results[task.name] for task in tasks}
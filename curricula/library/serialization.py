@@ -1,6 +1,8 @@
 import json
 from typing import Any, TextIO
 
+from .tracing import Span
+
 
 def truncate(string: str, length: int, append: str = "...") -> str:
     """Shorthand for cutting off long strings.
@@ -28,6 +30,7 @@ def descend_and_truncate(o: Any, length: int, append: str = "..."):
     return o
 
 
+@Span("serialization.dump")
 def dump(o: Any, file: TextIO, no_truncate: bool = False, **options):
     """Write an object to a file."""
 
@@ -36,6 +39,7 @@ def dump(o: Any, file: TextIO, no_truncate: bool = False, **options):
     json.dump(o, file, **options)
 
 
+@Span("serialization.load")
 def load(file: TextIO):
     """Read data from a file."""
 
@@ -1,8 +1,13 @@
-import jinja2
 import logging
 from decimal import Decimal
+from functools import lru_cache
 from pathlib import Path
-from typing import Any, Dict
+from typing import Any, Dict, TYPE_CHECKING
+
+from .tracing import Span, span
+
+if TYPE_CHECKING:
+    import jinja2
 
 root = Path(__file__).absolute().parent
 log = logging.getLogger("curricula")
@@ -34,13 +39,28 @@ JINJA2_FILTERS = {
 }
 
 
+@lru_cache(maxsize=None)
+def traced_template_class(base: type) -> type:
+    """Subclass a jinja2 template class so that rendering is traced."""
+
+    class TracedTemplate(base):
+        def render(self, *args, **kwargs) -> str:
+            with span("template.render", template=self.name):
+                return super().render(*args, **kwargs)
+
+    return TracedTemplate
+
+
+@Span("template.environment")
 def jinja2_create_environment(
         default_template_path: Path,
         custom_template_path: Path = None,
         assignment_path: Path = None,
-        problem_paths: Dict[str, Path] = None) -> jinja2.Environment:
+        problem_paths: Dict[str, Path] = None) -> "jinja2.Environment":
     """Configure a jinja2 environment."""
 
+    import jinja2
+
     log.debug("creating jinja2 environment")
 
     # Create a loader in the order of arguments
@@ -72,5 +92,6 @@ def jinja2_create_environment(
 
     # Custom filters
     environment.filters.update(JINJA2_FILTERS)
+    environment.template_class = traced_template_class(environment.template_class)
 
     return environment
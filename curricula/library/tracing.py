@@ -0,0 +1,208 @@
+import os
+import sys
+import time
+import atexit
+import threading
+from contextvars import ContextVar
+from functools import wraps
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, TypeVar
+
+__all__ = (
+    "Tracer",
+    "Span",
+    "span",
+    "enable",
+    "disable",
+    "enable_from_environment",
+    "TRACE_ENVIRONMENT_VARIABLE")
+
+TRACE_ENVIRONMENT_VARIABLE = "CURRICULA_TRACE"
+
+# Flag set on code objects of async def functions
+CO_COROUTINE = 0x80
+
+T = TypeVar("T")
+
+
+class Tracer:
+    """Collects completed spans as Chrome trace events.
+
+    Events use the trace-event "complete" phase so that each span is a
+    single record. Threads map to their own track, and spans opened in
+    an asyncio task are given a track per task so that interleaved
+    coroutines on one thread still nest correctly in the viewer.
+    """
+
+    path: Optional[Path]
+    events: List[dict]
+
+    _pid: int
+    _lanes: Dict[Any, int]
+    _lock: threading.Lock
+
+    def __init__(self, path: Path = None):
+        self.path = path
+        self.events = []
+        self._pid = os.getpid()
+        self._lanes = {}
+        self._lock = threading.Lock()
+
+    def lane(self) -> int:
+        """Get the track id for the current thread or task."""
+
+        key = threading.get_ident()
+        name = threading.current_thread().name
+
+        # Only check for a task if asyncio is already in use
+        asyncio = sys.modules.get("asyncio")
+        if asyncio is not None:
+            try:
+                task = asyncio.current_task()
+            except RuntimeError:
+                task = None
+            if task is not None:
+                key = (key, id(task))
+                name = f"{name}: {task.get_name()}"
+
+        lane = self._lanes.get(key)
+        if lane is None:
+            with self._lock:
+                lane = self._lanes.get(key)
+                if lane is None:
+                    lane = self._lanes[key] = len(self._lanes) + 1
+                    self.events.append(dict(name="thread_name", ph="M", pid=self._pid, tid=lane, args=dict(name=name)))
+        return lane
+
+    def record(self, name: str, category: str, start: float, end: float, lane: int, args: Optional[dict]):
+        """Add a complete event, times in seconds."""
+
+        event = dict(name=name, cat=category, ph="X", ts=start * 1e6, dur=(end - start) * 1e6, pid=self._pid, tid=lane)
+        if args:
+            event["args"] = args
+        self.events.append(event)
+
+    def dump(self) -> dict:
+        """Chrome trace-event JSON object format."""
+
+        return dict(traceEvents=list(self.events), displayTimeUnit="ms")
+
+    def write(self, path: Path):
+        """Write the trace to a file loadable by chrome://tracing or Perfetto."""
+
+        import json
+
+        with path.open("w") as file:
+            json.dump(self.dump(), file)
+
+
+tracer: Optional[Tracer] = None
+current: ContextVar[Optional["Span"]] = ContextVar("curricula_span", default=None)
+
+
+class Span:
+    """A timed region that can be used as a context manager or decorator.
+
+    When no tracer is enabled, entering and exiting a span does nothing
+    beyond a global check. The current span is kept in a context
+    variable, so nesting is tracked separately per thread and per
+    asyncio task.
+    """
+
+    __slots__ = ("name", "category", "args", "parent", "_start", "_lane", "_token")
+
+    def __init__(self, name: str, category: str = "curricula", args: Optional[dict] = None):
+        self.name = name
+        self.category = category
+        self.args = args
+        self.parent = None
+        self._start = None
+        self._token = None
+
+    def __enter__(self) -> "Span":
+        if tracer is not None:
+            self.parent = current.get()
+            self._token = current.set(self)
+            self._lane = tracer.lane()
+            self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._start is not None:
+            end = time.perf_counter()
+            current.reset(self._token)
+            if exc_type is not None:
+                self.annotate(exception=exc_type.__name__)
+            if tracer is not None:
+                tracer.record(self.name, self.category, self._start, end, self._lane, self.args)
+            self._start = None
+            self._token = None
+
+    def annotate(self, **args):
+        """Attach extra arguments shown with the event."""
+
+        if self.args is None:
+            self.args = args
+        else:
+            self.args.update(args)
+
+    def __call__(self, function: Callable[..., T]) -> Callable[..., T]:
+        """Decorate a function so that each call is its own span.
+
+        Spans are only created while a tracer is enabled, otherwise the
+        call goes straight through.
+        """
+
+        name, category, args = self.name, self.category, self.args
+
+        if function.__code__.co_flags & CO_COROUTINE:
+            @wraps(function)
+            async def wrapped(*a, **k):
+                if tracer is None:
+                    return await function(*a, **k)
+                with Span(name, category, dict(args) if args else None):
+                    return await function(*a, **k)
+        else:
+            @wraps(function)
+            def wrapped(*a, **k):
+                if tracer is None:
+                    return function(*a, **k)
+                with Span(name, category, dict(args) if args else None):
+                    return function(*a, **k)
+
+        return wrapped
+
+
+def span(name: str, category: str = "curricula", **args) -> Span:
+    """Shorthand for creating a span with arguments."""
+
+    return Span(name, category, args or None)
+
+
+def enable(path: Path = None) -> Tracer:
+    """Start recording spans, writing them on exit if a path is given."""
+
+    global tracer
+    if tracer is None:
+        tracer = Tracer(path=path)
+        atexit.register(disable)
+    return tracer
+
+
+def disable() -> Optional[Tracer]:
+    """Stop recording spans and write the trace."""
+
+    global tracer
+    stopping, tracer = tracer, None
+    if stopping is not None and stopping.path is not None:
+        stopping.write(stopping.path)
+    return stopping
+
+
+def enable_from_environment() -> Optional[Tracer]:
+    """Enable tracing if CURRICULA_TRACE names an output file."""
+
+    path = os.environ.get(TRACE_ENVIRONMENT_VARIABLE)
+    if not path:
+        return None
+    return enable(path=Path(path))
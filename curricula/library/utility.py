@@ -2,6 +2,8 @@ import timeit
 from typing import Callable
 from functools import wraps
 
+from .tracing import span
+
 
 def name_from_doc(test: Callable):
     """Get a function's name from it's docstring.
@@ -24,7 +26,8 @@ def timed(name: str = "", printer: Callable[[str], None] = print):
         @wraps(func)
         def wrapped(*args, **kwargs):
             start = timeit.default_timer()
-            result = func(*args, **kwargs)
+            with span(name or func.__name__):
+                result = func(*args, **kwargs)
             elapsed = timeit.default_timer() - start
             printer(f"{name} finished in {round(elapsed, 5)} seconds")
             return result
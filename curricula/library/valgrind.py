@@ -1,14 +1,22 @@
 import os
-from xml.etree.ElementTree import Element, parse, ParseError
-from typing import Optional, List
+import timeit
+from typing import Optional, List, TextIO, TYPE_CHECKING
 from dataclasses import dataclass, field
 from pathlib import Path
 
-from . import process
+from . import process, metrics
+from .tracing import Span, span
+
+if TYPE_CHECKING:
+    from xml.etree.ElementTree import Element
 
 VALGRIND_ARGS = ("valgrind", "--tool=memcheck", "--leak-check=yes", "--xml=yes")
 VALGRIND_XML_FILE = "valgrind.xml"
 
+VALGRIND_RUNS = metrics.counter("curricula_valgrind_runs_total", "Valgrind runs by outcome", ("outcome",))
+VALGRIND_ERRORS = metrics.counter("curricula_valgrind_errors_total", "Errors found in Valgrind reports")
+VALGRIND_SECONDS = metrics.histogram("curricula_valgrind_seconds", "Wall time of Valgrind runs including parsing")
+
 
 @dataclass
 class ValgrindWhat:
@@ -18,7 +26,7 @@ class ValgrindWhat:
     fields: dict = field(default_factory=dict)
 
     @classmethod
-    def load(cls, element: Optional[Element]) -> "Optional[ValgrindWhat]":
+    def load(cls, element: "Optional[Element]") -> "Optional[ValgrindWhat]":
         """Load either what or xwhat."""
 
         if element is None:
@@ -47,7 +55,7 @@ class ValgrindError:
     what: Optional[ValgrindWhat]
 
     @classmethod
-    def load(cls, element: Element) -> "ValgrindError":
+    def load(cls, element: "Element") -> "ValgrindError":
         """Load an error from an element."""
 
         unique = int(element.find("unique").text, 16)
@@ -77,9 +85,38 @@ class ValgrindReport:
         return leaked_blocks, leaked_bytes
 
 
-def run(*args: str, stdin: bytes = None, timeout: float = None, cwd: Path = None) -> Optional[ValgrindReport]:
+def parse_errors(file: TextIO) -> List[ValgrindError]:
+    """Collect the errors in a Valgrind XML report, may raise ParseError."""
+
+    from xml.etree.ElementTree import parse
+
+    errors = []
+    for child in parse(file).getroot():
+        if child.tag == "error":
+            errors.append(ValgrindError.load(child))
+    return errors
+
+
+@Span("valgrind.run")
+def run(*args: str, stdin: process.Stdin = None, timeout: float = None, cwd: Path = None) -> Optional[ValgrindReport]:
     """Run valgrind on the program and return IR count."""
 
+    start = timeit.default_timer()
+    report = _run(*args, stdin=stdin, timeout=timeout, cwd=cwd)
+    VALGRIND_SECONDS.observe(timeit.default_timer() - start)
+    if report.valgrind_errors is not None:
+        VALGRIND_RUNS.inc(outcome="parsed")
+        VALGRIND_ERRORS.inc(len(report.valgrind_errors))
+    else:
+        VALGRIND_RUNS.inc(outcome="unparsed")
+    return report
+
+
+def _run(*args: str, stdin: process.Stdin = None, timeout: float = None, cwd: Path = None) -> ValgrindReport:
+    """Run valgrind and parse its XML report."""
+
+    from xml.etree.ElementTree import ParseError
+
     runtime = process.run(
         *VALGRIND_ARGS,
         f"--xml-file={VALGRIND_XML_FILE}",
@@ -88,15 +125,11 @@ def run(*args: str, stdin: bytes = None, timeout: float = None, cwd: Path = None
         timeout=timeout,
         cwd=cwd)
     if os.path.exists(VALGRIND_XML_FILE):
-        errors = []
-        with open(VALGRIND_XML_FILE) as file:
+        with open(VALGRIND_XML_FILE) as file, span("valgrind.parse"):
             try:
-                root = parse(file).getroot()
+                errors = parse_errors(file)
             except ParseError:
                 return ValgrindReport(runtime, None, error="cannot parse valgrind xml")
-            for child in root:
-                if child.tag == "error":
-                    errors.append(ValgrindError.load(child))
         os.remove(VALGRIND_XML_FILE)
         return ValgrindReport(runtime=runtime, valgrind_errors=errors)
     return ValgrindReport(runtime=runtime, valgrind_errors=None, error="valgrind did not write to output")
@@ -0,0 +1,237 @@
+import os
+import stat
+import queue
+import shutil
+import tempfile
+import timeit
+
+from pathlib import Path
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+from ..log import log
+from . import metrics
+from .tracing import span
+
+__all__ = (
+    "Workspace",
+    "WorkspacePool",
+    "TMPFS")
+
+# Memory-backed file system present on most Linux machines
+TMPFS = Path("/dev/shm")
+
+WORKSPACE_SECONDS = metrics.histogram("curricula_workspace_seconds", "Time to stage or reset a workspace", ("operation",))
+WORKSPACE_FILES = metrics.counter("curricula_workspace_files_total", "Files removed or restored by resets", ("action",))
+WORKSPACE_RESTAGES = metrics.counter("curricula_workspace_restages_total", "Resets that fell back to staging again")
+
+# Enough of a stat to tell whether a file was touched since staging
+Stamp = Tuple[int, int, int, int]
+
+
+def stamp(path: Path) -> Stamp:
+    """Inode, size, mode and change time, any write updates the last."""
+
+    result = path.lstat()
+    return result.st_ino, result.st_size, result.st_mode, result.st_ctime_ns
+
+
+def make_accessible(path: Path):
+    """Give the owner full access to every directory below the path.
+
+    Submissions may chmod staged directories, which would otherwise stop
+    them from being listed or emptied.
+    """
+
+    stack = [str(path)]
+    while stack:
+        directory = stack.pop()
+        try:
+            os.chmod(directory, stat.S_IMODE(os.lstat(directory).st_mode) | stat.S_IRWXU)
+            with os.scandir(directory) as entries:
+                stack.extend(entry.path for entry in entries if entry.is_dir(follow_symlinks=False))
+        except OSError:
+            continue
+
+
+class Workspace:
+    """A sandbox directory with the skeleton staged, used as cwd."""
+
+    path: Path
+    skeleton: Optional[Path]
+
+    _baseline: Dict[str, Stamp]
+    _directories: Set[str]
+
+    def __init__(self, path: Path, skeleton: Optional[Path]):
+        self.path = path
+        self.skeleton = skeleton
+        self._baseline = {}
+        self._directories = set()
+
+    def stage(self):
+        """Copy the skeleton in and remember what it looked like."""
+
+        if self.path.exists():
+            make_accessible(self.path)
+            shutil.rmtree(str(self.path))
+        if self.skeleton is not None:
+            shutil.copytree(str(self.skeleton), str(self.path), symlinks=True)
+        else:
+            self.path.mkdir(parents=True)
+        self._snapshot()
+
+    def _snapshot(self):
+        """Record the stamp of every staged file."""
+
+        self._baseline = {}
+        self._directories = set()
+        for directory, directories, files in os.walk(self.path):
+            relative = os.path.relpath(directory, self.path)
+            if relative != ".":
+                self._directories.add(relative)
+            for name in files:
+                path = Path(directory, name)
+                self._baseline[os.path.normpath(os.path.join(relative, name))] = stamp(path)
+
+    def reset(self) -> Tuple[int, int]:
+        """Undo changes since staging, returning files removed and restored.
+
+        Files that are new or were modified are deleted, then modified or
+        deleted skeleton files are copied back. Untouched files are left
+        alone, which is what makes this cheaper than restaging. Raises
+        OSError if anything can't be listed or removed, in which case the
+        workspace should be staged again.
+        """
+
+        removed = 0
+        restore = set(self._baseline)
+        errors = []
+        for directory, directories, files in os.walk(self.path, topdown=True, onerror=errors.append):
+            relative = os.path.relpath(directory, self.path)
+            for name in list(directories):
+                key = os.path.normpath(os.path.join(relative, name))
+                path = Path(directory, name)
+                if key not in self._directories or path.is_symlink():
+                    if path.is_symlink():
+                        path.unlink()
+                    else:
+                        shutil.rmtree(str(path))
+                    directories.remove(name)
+                    removed += 1
+            for name in files:
+                key = os.path.normpath(os.path.join(relative, name))
+                path = Path(directory, name)
+                expected = self._baseline.get(key)
+                if expected is not None and stamp(path) == expected:
+                    restore.discard(key)
+                    continue
+                path.unlink()
+                removed += 1
+
+        # The walk skips directories it can't read, leaving their files behind
+        if errors:
+            raise errors[0]
+
+        for key in sorted(self._directories):
+            self.path.joinpath(key).mkdir(parents=True, exist_ok=True)
+        for key in restore:
+            shutil.copy2(str(self.skeleton.joinpath(key)), str(self.path.joinpath(key)), follow_symlinks=False)
+            self._baseline[key] = stamp(self.path.joinpath(key))
+
+        return removed, len(restore)
+
+
+class WorkspacePool:
+    """Pre-provisioned workspaces handed out per submission.
+
+    Creating a directory, copying the skeleton in and deleting it again
+    for every submission can take as long as the tests themselves on
+    slow disks. The pool stages a fixed number of workspaces up front,
+    optionally in memory on tmpfs, and resets each one on release by
+    removing only what the submission changed.
+    """
+
+    root: Path
+    skeleton: Optional[Path]
+    size: int
+
+    _workspaces: List[Workspace]
+    _available: "queue.Queue[Workspace]"
+    _owned: bool
+
+    def __init__(self, skeleton: Optional[Path] = None, size: int = 4, root: Path = None, tmpfs: bool = False):
+        self.skeleton = skeleton
+        self.size = size
+
+        self._owned = root is None
+        if root is None:
+            parent = None
+            if tmpfs:
+                if TMPFS.is_dir() and os.access(str(TMPFS), os.W_OK):
+                    parent = str(TMPFS)
+                else:
+                    log.info(f"{TMPFS} is not available, creating workspaces on disk")
+            root = Path(tempfile.mkdtemp(prefix="curricula-workspaces-", dir=parent))
+        self.root = root
+
+        self._workspaces = []
+        self._available = queue.Queue()
+        for i in range(size):
+            workspace = Workspace(root.joinpath(str(i)), skeleton)
+            start = timeit.default_timer()
+            with span("workspace.setup"):
+                workspace.stage()
+            WORKSPACE_SECONDS.observe(timeit.default_timer() - start, operation="setup")
+            self._workspaces.append(workspace)
+            self._available.put(workspace)
+
+    def acquire(self, timeout: float = None) -> Workspace:
+        """Take a clean workspace, waiting for one if all are in use."""
+
+        try:
+            return self._available.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError("no workspace became available") from None
+
+    def release(self, workspace: Workspace):
+        """Reset a workspace and return it to the pool."""
+
+        start = timeit.default_timer()
+        try:
+            with span("workspace.reset"):
+                removed, restored = workspace.reset()
+        except OSError:
+            log.exception(f"failed to reset {workspace.path}, staging it again")
+            WORKSPACE_RESTAGES.inc()
+            workspace.stage()
+            removed, restored = 0, len(workspace._baseline)
+        WORKSPACE_SECONDS.observe(timeit.default_timer() - start, operation="reset")
+        WORKSPACE_FILES.inc(removed, action="removed")
+        WORKSPACE_FILES.inc(restored, action="restored")
+        self._available.put(workspace)
+
+    @contextmanager
+    def workspace(self, timeout: float = None) -> Iterator[Workspace]:
+        """Borrow a workspace for the duration of a block."""
+
+        workspace = self.acquire(timeout=timeout)
+        try:
+            yield workspace
+        finally:
+            self.release(workspace)
+
+    def close(self):
+        """Delete every workspace if the pool created the root."""
+
+        if self._owned:
+            shutil.rmtree(str(self.root), ignore_errors=True)
+        else:
+            for workspace in self._workspaces:
+                shutil.rmtree(str(workspace.path), ignore_errors=True)
+
+    def __enter__(self) -> "WorkspacePool":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
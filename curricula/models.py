@@ -1,12 +1,14 @@
+import json
 import time
 import datetime
+import threading
 
 from decimal import Decimal
 from pathlib import Path
 from dataclasses import dataclass, asdict, field
-from typing import Optional, List, Callable, TypeVar
+from typing import Dict, Optional, List, Callable, Tuple, TypeVar
 from abc import ABC, abstractmethod
-from functools import lru_cache
+from functools import wraps
 
 from .version import version
 
@@ -41,10 +43,57 @@ def some(value: Optional[T], method: Callable[[T], U]) -> Optional[U]:
     return method(value)
 
 
+# Bumped whenever any model attribute is assigned
+_generation = 0
+
+
+def invalidate():
+    """Discard every derived value.
+
+    Assigning a model attribute does this automatically, but changing a
+    container in place, such as appending to an assignment's problems,
+    doesn't and should be followed by a call.
+    """
+
+    global _generation
+    _generation += 1
+
+
+def derived(method: Callable[[T], U]) -> Callable[[T], U]:
+    """Cache a method's result on the instance until any model changes.
+
+    Unlike lru_cache, the value lives and dies with the instance and is
+    recomputed after an edit anywhere in the model, since derived values
+    such as weights depend on other objects. Edits are rare once an
+    assignment is loaded, so in practice each is computed once.
+    """
+
+    name = f"_derived_{method.__name__}"
+
+    @wraps(method)
+    def wrapper(self: T) -> U:
+        generation = _generation
+        entry = self.__dict__.get(name)
+        if entry is not None and entry[0] == generation:
+            return entry[1]
+        value = method(self)
+        self.__dict__[name] = (generation, value)
+        return value
+
+    return wrapper
+
+
 @dataclass(eq=False)
 class Model(ABC):
     """Provide some default behaviors."""
 
+    def __setattr__(self, name: str, value):
+        """Invalidate derived values on any public change."""
+
+        super().__setattr__(name, value)
+        if not name.startswith("_"):
+            invalidate()
+
     def dump(self) -> dict:
         return asdict(self)
 
@@ -130,7 +179,7 @@ class ProblemGrading(Model):
         return self.enabled and self.manual is not None and self.manual.enabled
 
     @property
-    @lru_cache(maxsize=1)
+    @derived
     def weight_total(self) -> Decimal:
         return sum((
             self.automated.weight if self.automated and self.automated.enabled else 0,
@@ -138,14 +187,17 @@ class ProblemGrading(Model):
             self.manual.weight if self.manual and self.manual.enabled else 0))
 
     @property
+    @derived
     def percentage_automated(self) -> Decimal:
         return self.automated.weight / self.weight_total
 
     @property
+    @derived
     def percentage_review(self) -> Decimal:
         return self.review.weight / self.weight_total
 
     @property
+    @derived
     def percentage_manual(self) -> Decimal:
         return self.manual.weight / self.weight_total
 
@@ -203,6 +255,7 @@ class Problem(Model):
     # Backlink
     assignment: "Assignment" = None
 
+    @derived
     def weight(self) -> Decimal:
         """Percentage weight of the problem in the assignment."""
 
@@ -254,7 +307,7 @@ class AssignmentGrading(Model):
 
         return cls(points=data["points"], assignment=assignment)
 
-    @lru_cache(maxsize=1)
+    @derived
     def weight(self) -> Decimal:
         """Compute cumulative weight of all problems."""
 
@@ -339,3 +392,51 @@ class Assignment(Model):
             extra=self.extra,
             notes=self.notes,
             meta=self.meta.dump())
+
+
+class AssignmentCache:
+    """Parsed assignments reused while their JSON is unchanged.
+
+    Entries are keyed on the resolved path and only reused while the
+    file's modification time and size are unchanged. The grading server
+    fills this before forking, so jobs get the parsed model for free.
+    """
+
+    _entries: Dict[Path, Tuple[Tuple[int, int], Assignment]]
+    _lock: threading.Lock
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, path: Path) -> Assignment:
+        """Load an assignment, parsing only if the file changed."""
+
+        path = path.resolve()
+        stat = path.stat()
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry[0] == stamp:
+                return entry[1]
+
+        with path.open() as file:
+            assignment = Assignment.load(json.load(file))
+        with self._lock:
+            self._entries[path] = (stamp, assignment)
+        return assignment
+
+    def clear(self):
+        """Forget every parsed assignment."""
+
+        with self._lock:
+            self._entries.clear()
+
+
+assignment_cache = AssignmentCache()
+
+
+def load_assignment(path: Path) -> Assignment:
+    """Load an assignment's JSON, reusing the parsed model if unchanged."""
+
+    return assignment_cache.get(path)
@@ -0,0 +1,243 @@
+import os
+import json
+import zipfile
+import hashlib
+
+from pathlib import Path
+from dataclasses import dataclass, field
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from .log import log
+from .structure import Artifact, Artifacts
+
+__all__ = (
+    "PackagedFile",
+    "PackagedArtifact",
+    "Manifest",
+    "package",
+    "extract",
+    "COMPRESSED_SUFFIXES")
+
+# File types that gain nothing from another round of compression
+COMPRESSED_SUFFIXES = frozenset((
+    ".7z", ".bz2", ".gz", ".jar", ".jpeg", ".jpg", ".mov", ".mp3", ".mp4",
+    ".ogg", ".pdf", ".png", ".rar", ".tgz", ".webm", ".webp", ".whl", ".xz",
+    ".zip", ".zst"))
+
+# Size of each chunk streamed into an archive
+CHUNK_SIZE = 1 << 20
+
+
+@dataclass(eq=False)
+class PackagedFile:
+    """A single file inside an artifact archive."""
+
+    size: int
+    sha256: str
+    stored: bool
+
+    def dump(self) -> dict:
+        """Serialize."""
+
+        return dict(size=self.size, sha256=self.sha256, stored=self.stored)
+
+    @classmethod
+    def load(cls, data: dict) -> "PackagedFile":
+        """Deserialize."""
+
+        return cls(size=data["size"], sha256=data["sha256"], stored=data["stored"])
+
+
+@dataclass(eq=False)
+class PackagedArtifact:
+    """An artifact archive and the files it contains."""
+
+    archive: str
+    size: int
+    sha256: str
+    files: Dict[str, PackagedFile] = field(default_factory=dict)
+
+    def dump(self) -> dict:
+        """Serialize."""
+
+        return dict(
+            archive=self.archive,
+            size=self.size,
+            sha256=self.sha256,
+            files={name: file.dump() for name, file in self.files.items()})
+
+    @classmethod
+    def load(cls, data: dict) -> "PackagedArtifact":
+        """Deserialize."""
+
+        return cls(
+            archive=data["archive"],
+            size=data["size"],
+            sha256=data["sha256"],
+            files={name: PackagedFile.load(file) for name, file in data["files"].items()})
+
+
+@dataclass(eq=False)
+class Manifest:
+    """Hashes of every packaged artifact, kept beside the grading index."""
+
+    artifacts: Dict[str, PackagedArtifact] = field(default_factory=dict)
+
+    def dump(self) -> dict:
+        """Serialize."""
+
+        return dict(artifacts={name: artifact.dump() for name, artifact in self.artifacts.items()})
+
+    @classmethod
+    def load(cls, data: dict) -> "Manifest":
+        """Deserialize."""
+
+        return cls(artifacts={name: PackagedArtifact.load(artifact) for name, artifact in data["artifacts"].items()})
+
+    @classmethod
+    def read(cls, path: Path) -> "Manifest":
+        """Load from a manifest file."""
+
+        with path.open() as file:
+            return cls.load(json.load(file))
+
+    def write(self, path: Path):
+        """Save to a manifest file."""
+
+        with path.open("w") as file:
+            json.dump(self.dump(), file, indent=2)
+
+
+def hash_path(path: Path) -> str:
+    """SHA-256 of a file's contents."""
+
+    digest = hashlib.sha256()
+    with path.open("rb") as file:
+        for chunk in iter(lambda: file.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def walk(root: Path) -> Iterator[Path]:
+    """Every file under a directory in a stable order."""
+
+    for directory, directories, files in os.walk(root):
+        directories.sort()
+        for name in sorted(files):
+            yield Path(directory, name)
+
+
+def package_artifact(
+        artifact: Artifact,
+        archive_path: Path,
+        compression_level: int = 6,
+        exclude: Iterable[Path] = ()) -> PackagedArtifact:
+    """Stream one artifact directory into a zip archive.
+
+    Each file is read once, being hashed as it is written. Files that
+    are already compressed are stored as is.
+    """
+
+    exclude = set(exclude)
+    files = {}
+    with zipfile.ZipFile(archive_path, "w", compresslevel=compression_level) as archive:
+        for path in walk(artifact.path):
+            if path in exclude:
+                continue
+            name = path.relative_to(artifact.path).as_posix()
+            info = zipfile.ZipInfo.from_file(path, name)
+            stored = path.suffix.lower() in COMPRESSED_SUFFIXES
+            info.compress_type = zipfile.ZIP_STORED if stored else zipfile.ZIP_DEFLATED
+
+            digest = hashlib.sha256()
+            size = 0
+            with path.open("rb") as source, archive.open(info, "w", force_zip64=True) as destination:
+                for chunk in iter(lambda: source.read(CHUNK_SIZE), b""):
+                    digest.update(chunk)
+                    destination.write(chunk)
+                    size += len(chunk)
+            files[name] = PackagedFile(size=size, sha256=digest.hexdigest(), stored=stored)
+
+    return PackagedArtifact(
+        archive=archive_path.name,
+        size=archive_path.stat().st_size,
+        sha256=hash_path(archive_path),
+        files=files)
+
+
+def package(
+        artifacts: Artifacts,
+        destination: Path,
+        workers: int = 4,
+        compression_level: int = 6) -> Manifest:
+    """Archive every built artifact in parallel and write the manifest.
+
+    Archives are written to the destination as one zip per artifact.
+    The manifest is written next to the grading index and is never
+    included in the grading archive itself.
+    """
+
+    named: List[Tuple[str, Artifact]] = [
+        ("instructions", artifacts.instructions),
+        ("resources", artifacts.resources),
+        ("solution", artifacts.solution),
+        ("grading", artifacts.grading)]
+    named = [(name, artifact) for name, artifact in named if artifact.path.is_dir()]
+
+    destination.mkdir(parents=True, exist_ok=True)
+    manifest = Manifest()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            name: executor.submit(
+                package_artifact,
+                artifact,
+                destination.joinpath(f"{name}.zip"),
+                compression_level,
+                (artifacts.grading.manifest_path,))
+            for name, artifact in named}
+        for name, future in futures.items():
+            manifest.artifacts[name] = future.result()
+            log.debug(f"packaged {name} with {len(manifest.artifacts[name].files)} files")
+
+    manifest.write(artifacts.grading.manifest_path)
+    return manifest
+
+
+def extract(
+        manifest: Manifest,
+        name: str,
+        archive_directory: Path,
+        destination: Path,
+        files: Optional[Iterable[str]] = None) -> List[Path]:
+    """Extract some or all files from an artifact archive and verify them.
+
+    Raises ValueError if the archive or any extracted file does not
+    match the manifest.
+    """
+
+    packaged = manifest.artifacts[name]
+    archive_path = archive_directory.joinpath(packaged.archive)
+    if hash_path(archive_path) != packaged.sha256:
+        raise ValueError(f"archive {archive_path} does not match the manifest")
+
+    names = list(files) if files is not None else list(packaged.files)
+    extracted = []
+    with zipfile.ZipFile(archive_path) as archive:
+        for file_name in names:
+            expected = packaged.files.get(file_name)
+            if expected is None:
+                raise ValueError(f"{file_name} is not in the {name} artifact")
+
+            path = destination.joinpath(file_name)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            digest = hashlib.sha256()
+            with archive.open(file_name) as source, path.open("wb") as target:
+                for chunk in iter(lambda: source.read(CHUNK_SIZE), b""):
+                    digest.update(chunk)
+                    target.write(chunk)
+            if digest.hexdigest() != expected.sha256:
+                raise ValueError(f"{file_name} in the {name} artifact does not match the manifest")
+            extracted.append(path)
+
+    return extracted
@@ -0,0 +1,255 @@
+import io
+import os
+import json
+import time
+import signal
+import socket
+import select
+import threading
+import contextlib
+
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set
+
+from .log import log
+from .models import load_assignment
+from .library import metrics
+from .library.importance import module_cache
+from .library.distributed import Job, JobResult, HANDLERS
+
+__all__ = (
+    "Server",
+    "request",
+    "run_command")
+
+
+def run_command(payload: dict) -> dict:
+    """Run a curricula subcommand as if from the command line."""
+
+    from .shell import Curricula, dispatch, create_parser
+
+    curricula = Curricula()
+    parser = create_parser(curricula)
+    stdout = io.StringIO()
+    stderr = io.StringIO()
+    with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+        try:
+            code = dispatch(curricula, parser, vars(parser.parse_args(payload["args"])))
+        except SystemExit as exit:
+            code = exit.code if isinstance(exit.code, int) else 1
+    return dict(code=code, stdout=stdout.getvalue(), stderr=stderr.getvalue())
+
+
+# Jobs the server runs in addition to the ones workers know about
+COMMANDS = {"command": run_command}
+
+
+def read_message(connection: socket.socket) -> dict:
+    """Read a whole JSON message, the peer shuts down writing after it."""
+
+    chunks = []
+    while True:
+        chunk = connection.recv(1 << 16)
+        if not chunk:
+            break
+        chunks.append(chunk)
+    return json.loads(b"".join(chunks))
+
+
+class Server:
+    """Grading daemon that keeps plugins, assignments and tests warm.
+
+    Jobs arrive over a Unix socket, one per connection, as a dumped Job.
+    Each is run in a child forked from the warm server so that it starts
+    with every plugin, assignment and test module already loaded, but
+    nothing it does leaks into the next job. Assignments are parsed into
+    the models' assignment_cache, which load_assignment consults, and
+    tests are preloaded into module_cache, which the importance
+    functions consult, so jobs get the warm copies for free. The
+    child writes back the dumped JobResult, then sends the metrics it
+    recorded to the server over a pipe so they are exported with the
+    server's own.
+    """
+
+    path: Path
+    workers: int
+
+    _children: Set[int]
+    _reports: Dict[int, List[bytes]]
+    _stopping: threading.Event
+
+    def __init__(self, path: Path, workers: int = os.cpu_count() or 1):
+        self.path = path
+        self.workers = workers
+        self._children = set()
+        self._reports = {}
+        self._stopping = threading.Event()
+
+    def warm(self, assignment_paths: Iterable[Path] = (), test_paths: Iterable[Path] = ()):
+        """Import plugins and preload assignments and tests jobs will need."""
+
+        from .shell import Curricula
+        from .shell.plugin import LazyPlugin
+        from .library import profile
+
+        with profile.phase("warm"):
+            for plugin in Curricula().plugins:
+                if isinstance(plugin, LazyPlugin):
+                    plugin.plugin
+            for path in assignment_paths:
+                load_assignment(path)
+                log.info(f"loaded assignment {path}")
+            for path in test_paths:
+                module_cache.import_file_or_module_at_path(path)
+                log.info(f"imported tests {path}")
+
+    def _reap(self, block: bool = False):
+        """Collect finished children."""
+
+        while self._children:
+            try:
+                pid, _ = os.waitpid(-1, 0 if block else os.WNOHANG)
+            except ChildProcessError:
+                self._children.clear()
+                return
+            if pid == 0:
+                return
+            self._children.discard(pid)
+            if block:
+                return
+
+    def _receive(self, fd: int):
+        """Read a child's metrics report, merging it once complete."""
+
+        chunk = os.read(fd, 1 << 16)
+        if chunk:
+            self._reports[fd].append(chunk)
+            return
+
+        os.close(fd)
+        data = b"".join(self._reports.pop(fd))
+        if data:
+            try:
+                metrics.registry.merge(json.loads(data))
+            except ValueError:
+                log.warning("discarding a malformed metrics report from a job")
+
+    def _execute(self, connection: socket.socket):
+        """Handle one job, runs in the forked child."""
+
+        result = JobResult(id="", kind="", worker=f"serve-{os.getpid()}", attempts=1)
+        try:
+            job = Job.load(read_message(connection))
+            result.id = job.id
+            result.kind = job.kind
+            handler = COMMANDS.get(job.kind) or HANDLERS.get(job.kind)
+            if handler is None:
+                result.error = f"no handler for job kind {job.kind}"
+            else:
+                result.result = handler(job.payload)
+        except Exception as exception:
+            log.exception("job raised an exception")
+            result.error = f"{type(exception).__name__}: {exception}"
+        connection.sendall(json.dumps(result.dump()).encode())
+
+    def _fork(self, connection: socket.socket, listener: socket.socket):
+        """Run a job in a child process."""
+
+        report_read, report_write = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                signal.signal(signal.SIGINT, signal.SIG_DFL)
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                listener.close()
+                os.close(report_read)
+                for fd in self._reports:
+                    os.close(fd)
+
+                # Count only what this job records, the server adds it to its own
+                metrics.registry.reset()
+                try:
+                    self._execute(connection)
+                finally:
+                    with os.fdopen(report_write, "wb") as report:
+                        report.write(json.dumps(metrics.registry.snapshot()).encode())
+            except BaseException:
+                code = 1
+            finally:
+                try:
+                    connection.close()
+                finally:
+                    os._exit(code)
+
+        os.close(report_write)
+        self._reports[report_read] = []
+        self._children.add(pid)
+        connection.close()
+
+    def serve(self):
+        """Accept jobs until stopped."""
+
+        if self.path.exists():
+            self.path.unlink()
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(str(self.path))
+        listener.listen(self.workers * 4)
+        log.info(f"serving on {self.path} with {self.workers} workers")
+
+        try:
+            while not self._stopping.is_set():
+                self._reap()
+
+                # Stop accepting while every worker is busy, reports still arrive
+                waiting = list(self._reports)
+                if len(self._children) < self.workers:
+                    waiting.append(listener)
+                readable, _, _ = select.select(waiting, [], [], 0.1)
+                for ready in readable:
+                    if ready is listener:
+                        connection, _ = listener.accept()
+                        self._fork(connection, listener)
+                    else:
+                        self._receive(ready)
+        finally:
+            listener.close()
+            with contextlib.suppress(FileNotFoundError):
+                self.path.unlink()
+            while self._reports:
+                self._receive(next(iter(self._reports)))
+            while self._children:
+                self._reap(block=True)
+
+    def stop(self):
+        """Stop accepting jobs and wait for running ones."""
+
+        self._stopping.set()
+
+
+def request(path: Path, kind: str, payload: dict, timeout: Optional[float] = None) -> JobResult:
+    """Submit a job to a running server and wait for the result."""
+
+    job = Job(kind=kind, payload=payload)
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.settimeout(timeout)
+        connection.connect(str(path))
+        connection.sendall(json.dumps(job.dump()).encode())
+        connection.shutdown(socket.SHUT_WR)
+        return JobResult.load(read_message(connection))
+
+
+def serve(path: Path, workers: int, assignment_paths: Iterable[Path] = (), test_paths: Iterable[Path] = ()) -> int:
+    """Warm up and serve until interrupted."""
+
+    server = Server(path, workers=workers)
+    start = time.monotonic()
+    server.warm(assignment_paths, test_paths)
+    log.info(f"warmed up in {time.monotonic() - start:.3f} seconds")
+
+    signal.signal(signal.SIGTERM, lambda *_: server.stop())
+    try:
+        server.serve()
+    except KeyboardInterrupt:
+        server.stop()
+    return 0
@@ -1,8 +1,36 @@
 import argparse
 import logging
+import os
+from pathlib import Path
 
-from .plugin import Plugin, PluginDispatcher
-from ..log import log
+from .plugin import Plugin, LazyPlugin, PluginDispatcher
+from ..log import log, install_handler, create_handler
+from ..library import tracing, metrics
+
+
+class Serve(Plugin):
+    """Grading daemon, the heavy lifting is imported on use."""
+
+    name = "serve"
+    help = "keep plugins, assignments and tests loaded and run jobs sent over a Unix socket"
+
+    def setup(self, parser: argparse.ArgumentParser):
+        """Socket and what to preload."""
+
+        parser.add_argument("socket", help="path of the Unix socket to listen on")
+        parser.add_argument("-j", "--workers", type=int, default=os.cpu_count() or 1, help="concurrent jobs")
+        parser.add_argument("-a", "--assignment", action="append", default=[], help="assignment JSON to preload")
+        parser.add_argument("-t", "--tests", action="append", default=[], help="test file or package to preload")
+
+    def main(self, parser: argparse.ArgumentParser, args: dict) -> int:
+        """Warm up and serve."""
+
+        from ..server import serve
+        return serve(
+            Path(args["socket"]),
+            workers=args["workers"],
+            assignment_paths=[Path(path) for path in args["assignment"]],
+            test_paths=[Path(path) for path in args["tests"]])
 
 
 class Curricula(PluginDispatcher):
@@ -11,30 +39,68 @@ class Curricula(PluginDispatcher):
     name = "command"
     help = "the subcommand corresponding to the desired module"
     plugins = (
-        Plugin.find("curricula_grade", "grade"),
-        Plugin.find("curricula_compile", "compile"))
+        LazyPlugin("curricula_grade", "grade", "grade submissions against an assignment"),
+        LazyPlugin("curricula_compile", "compile", "build assignment artifacts from material"),
+        Serve())
 
 
-def main() -> int:
-    """Create the parser."""
+def dispatch(curricula: Curricula, parser: argparse.ArgumentParser, args: dict) -> int:
+    """Run the chosen subcommand within a top-level span."""
+
+    with tracing.span(args[f"{curricula.name}:subcommand"], category="command"):
+        return curricula.main(parser, args)
+
+
+def create_parser(curricula: Curricula) -> argparse.ArgumentParser:
+    """Build the top-level parser with every plugin bound."""
 
     parser = argparse.ArgumentParser(prog="curricula", description="Command line interface for Curricula")
     group = parser.add_mutually_exclusive_group()
     group.add_argument("-v", "--verbose", action="store_true", default=False)
     group.add_argument("-q", "--quiet", action="store_true", default=False)
-    parser.add_argument("-l", "--log", default=None)
+    parser.add_argument("-l", "--log", default=None, help="log file path, or json:PATH for structured records")
+    parser.add_argument("--profile", default=None, help="write a per-phase memory profile to this JSON file")
+    parser.add_argument("--trace", default=None, help="write timing spans to this Chrome trace JSON file")
+    parser.add_argument("--metrics", default=None, help="write Prometheus metrics to this file, or http://HOST:PORT")
+    curricula.setup(parser)
+    return parser
+
+
+def main() -> int:
+    """Create the parser."""
 
     curricula = Curricula()
-    curricula.setup(parser)
+    parser = create_parser(curricula)
 
     args = vars(parser.parse_args())
+    if not (args["log"] or "").startswith("json:"):
+        install_handler()
     if args["verbose"]:
         log.setLevel(logging.DEBUG)
     elif args["quiet"]:
         log.setLevel(logging.WARNING)
 
     if args["log"]:
-        handler_stream = logging.FileHandler(args["log"])
-        log.addHandler(handler_stream)
+        log.addHandler(create_handler(args["log"]))
+
+    if args["trace"]:
+        tracing.enable(path=Path(args["trace"]))
+    else:
+        tracing.enable_from_environment()
+
+    if args["metrics"]:
+        metrics.enable(args["metrics"])
+    else:
+        metrics.enable_from_environment()
+
+    from ..library import profile
+
+    if args["profile"] or os.environ.get(profile.PROFILE_ENVIRONMENT_VARIABLE):
+        if args["profile"]:
+            profile.enable(path=Path(args["profile"]))
+        else:
+            profile.enable_from_environment()
+        with profile.phase(args[f"{curricula.name}:subcommand"]):
+            return dispatch(curricula, parser, args)
 
-    return curricula.main(parser, args)
+    return dispatch(curricula, parser, args)
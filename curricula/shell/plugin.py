@@ -1,13 +1,15 @@
 import abc
 import argparse
-from typing import Iterable, Dict
+from typing import Iterable, Dict, Callable, Optional
 
 from ..library.importance import import_module
 
 __all__ = (
     "PluginException",
     "Plugin",
-    "PluginDispatcher",)
+    "LazyPlugin",
+    "PluginDispatcher",
+    "DeferredArgumentParser",)
 
 
 class PluginException(BaseException):
@@ -69,6 +71,71 @@ class UnavailablePlugin(Plugin):
         return -1
 
 
+class LazyPlugin(Plugin):
+    """Registry entry for a plugin that is imported only when dispatched.
+
+    The name and help text are recorded up front so that the top-level
+    parser and its help output can be built without importing the
+    plugin package. The module is imported the first time the plugin's
+    sub-parser is used or its main is invoked.
+    """
+
+    name = "lazy"
+    help = "this plugin has not been imported yet"
+    module_name: str
+
+    _plugin: Optional[Plugin] = None
+
+    def __init__(self, module_name: str, name: str, help: str):
+        self.module_name = module_name
+        self.name = name
+        self.help = help
+
+    @property
+    def plugin(self) -> Plugin:
+        """Import and instantiate the actual plugin on first access."""
+
+        if self._plugin is None:
+            self._plugin = Plugin.find(self.module_name, self.name)
+        return self._plugin
+
+    def setup(self, parser: argparse.ArgumentParser):
+        """Defer binding the sub-parser until it is actually parsed."""
+
+        if isinstance(parser, DeferredArgumentParser):
+            parser.deferred_setup = self.plugin_setup
+        else:
+            self.plugin_setup(parser)
+
+    def plugin_setup(self, parser: argparse.ArgumentParser):
+        """Import the plugin and let it bind its sub-parser."""
+
+        self.plugin.setup(parser)
+
+    def main(self, parser: argparse.ArgumentParser, args: dict) -> int:
+        """Dispatch to the imported plugin."""
+
+        return self.plugin.main(parser, args)
+
+
+class DeferredArgumentParser(argparse.ArgumentParser):
+    """Argument parser that runs a setup hook right before first use.
+
+    Sub-parsers are only asked to parse when their subcommand is chosen,
+    so this allows expensive setup to be skipped for every other one.
+    """
+
+    deferred_setup: Optional[Callable[[argparse.ArgumentParser], None]] = None
+
+    def parse_known_args(self, args=None, namespace=None):
+        """Run the deferred setup, if any, then parse."""
+
+        if self.deferred_setup is not None:
+            deferred_setup, self.deferred_setup = self.deferred_setup, None
+            deferred_setup(self)
+        return super().parse_known_args(args, namespace)
+
+
 class PluginDispatcher(Plugin, abc.ABC):
     """A coordinator for plugins."""
 
@@ -90,7 +157,11 @@ class PluginDispatcher(Plugin, abc.ABC):
     def setup(self, parser: argparse.ArgumentParser):
         """Bind all plugins."""
 
-        subparsers = parser.add_subparsers(required=True, dest=self._key, description=self.help)
+        subparsers = parser.add_subparsers(
+            required=True,
+            dest=self._key,
+            description=self.help,
+            parser_class=DeferredArgumentParser)
         for plugin in self._plugins.values():
             plugin.setup(subparsers.add_parser(plugin.name, help=plugin.help))
 
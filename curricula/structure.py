@@ -41,6 +41,7 @@ class Files:
     GRADING = "grading.json"
     TESTS = "tests.py"
     INDEX = "index.json"
+    MANIFEST = "manifest.json"
 
 
 class Artifact:
@@ -69,6 +70,10 @@ class GradingArtifact(Artifact):
     def index_path(self) -> Path:
         return self.path.joinpath(Files.INDEX)
 
+    @property
+    def manifest_path(self) -> Path:
+        return self.path.joinpath(Files.MANIFEST)
+
 
 class Artifacts:
     """Bundled artifacts produced by curricula_compile."""
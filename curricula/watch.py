@@ -0,0 +1,379 @@
+import os
+import time
+import struct
+import select
+import threading
+
+from pathlib import Path
+from dataclasses import dataclass, field
+from typing import Callable, Dict, FrozenSet, Iterable, List, Optional, Set, Tuple
+
+from .log import log
+from .structure import Paths, Files
+
+__all__ = (
+    "Change",
+    "Affected",
+    "classify",
+    "group",
+    "InotifyBackend",
+    "PollingBackend",
+    "create_backend",
+    "Watcher",
+    "ARTIFACTS")
+
+# Names of the artifacts a change can affect, matching Artifacts
+ARTIFACTS: FrozenSet[str] = frozenset(("instructions", "resources", "solution", "grading"))
+
+# Material subdirectories and the artifact each one feeds
+SUBDIRECTORIES = {
+    Paths.ASSETS.name: "instructions",
+    Paths.INSTRUCTIONS.name: "instructions",
+    Paths.RESOURCES.name: "resources",
+    Paths.SOLUTION.name: "solution",
+    Paths.GRADING.name: "grading"}
+
+# Top level files and the artifact each one feeds
+FILES = {
+    Files.README: "instructions",
+    Files.GRADING: "grading",
+    Files.TESTS: "grading"}
+
+
+def ignored(path: Path, root: Path) -> bool:
+    """Skip editor scratch files and build output under the root.
+
+    Only the part of the path below the root is checked, so a root that
+    itself lives under a directory named like the build output is still
+    watched.
+    """
+
+    name = path.name
+    try:
+        parts = path.relative_to(root).parts
+    except ValueError:
+        parts = path.parts
+    return (
+        name.startswith(".")
+        or name.endswith(("~", ".swp", ".swx", ".tmp"))
+        or name == "4913"
+        or Paths.ARTIFACTS.name in parts)
+
+
+@dataclass(eq=False)
+class Change:
+    """A changed file and what it belongs to.
+
+    The assignment is None for material shared by every assignment, and
+    the problem is None for files belonging to the assignment itself.
+    """
+
+    path: Path
+    assignment: Optional[Path]
+    problem: Optional[Path]
+    artifacts: FrozenSet[str]
+
+
+@dataclass(eq=False)
+class Affected:
+    """Everything that needs rebuilding in one assignment."""
+
+    assignment: Path
+
+    # Artifacts to rebuild for the assignment as a whole
+    artifacts: Set[str] = field(default_factory=set)
+
+    # Artifacts to rebuild per problem directory
+    problems: Dict[Path, Set[str]] = field(default_factory=dict)
+
+
+def artifacts_for(parts: Tuple[str, ...]) -> FrozenSet[str]:
+    """Guess which artifacts a file feeds from its path within a unit."""
+
+    if len(parts) > 1 and parts[0] in SUBDIRECTORIES:
+        return frozenset((SUBDIRECTORIES[parts[0]],))
+    if len(parts) == 1 and parts[0] in FILES:
+        return frozenset((FILES[parts[0]],))
+    return ARTIFACTS
+
+
+def find_problem(path: Path, assignment: Path) -> Optional[Path]:
+    """The innermost directory containing a problem file, if any."""
+
+    directory = path if path.name != Files.PROBLEM else path.parent
+    while directory != assignment and assignment in directory.parents:
+        if directory.joinpath(Files.PROBLEM).exists() or (path.name == Files.PROBLEM and path.parent == directory):
+            return directory
+        directory = directory.parent
+    return None
+
+
+def classify(material_path: Path, path: Path) -> Change:
+    """Map a changed path to the assignment, problem and artifacts it affects."""
+
+    assignments = material_path.joinpath(Paths.ASSIGNMENT)
+    try:
+        relative = path.relative_to(assignments)
+    except ValueError:
+        return Change(path=path, assignment=None, problem=None, artifacts=ARTIFACTS)
+    if not relative.parts:
+        return Change(path=path, assignment=None, problem=None, artifacts=ARTIFACTS)
+
+    assignment = assignments.joinpath(relative.parts[0])
+    problem = find_problem(path, assignment)
+    if problem is not None:
+        return Change(path=path, assignment=assignment, problem=problem, artifacts=artifacts_for(path.relative_to(problem).parts))
+    return Change(path=path, assignment=assignment, problem=None, artifacts=artifacts_for(relative.parts[1:]))
+
+
+def group(material_path: Path, changes: Iterable[Change]) -> List[Affected]:
+    """Coalesce changes into one rebuild per assignment."""
+
+    affected: Dict[Path, Affected] = {}
+    shared: Set[str] = set()
+    for change in changes:
+        if change.assignment is None:
+            shared |= change.artifacts
+            continue
+        entry = affected.setdefault(change.assignment, Affected(assignment=change.assignment))
+        if change.problem is None:
+            entry.artifacts |= change.artifacts
+        else:
+            entry.problems.setdefault(change.problem, set()).update(change.artifacts)
+
+    # Shared material such as templates affects every assignment
+    if shared:
+        for assignment in Paths.glob_assignments(material_path):
+            affected.setdefault(assignment, Affected(assignment=assignment)).artifacts |= shared
+
+    # Whole-assignment rebuilds subsume the same artifact per problem
+    for entry in affected.values():
+        for problem, artifacts in list(entry.problems.items()):
+            artifacts -= entry.artifacts
+            if not artifacts:
+                del entry.problems[problem]
+
+    return sorted(affected.values(), key=lambda entry: entry.assignment)
+
+
+class InotifyBackend:
+    """Recursive file change notifications from the Linux kernel."""
+
+    IN_ATTRIB = 0x4
+    IN_CLOSE_WRITE = 0x8
+    IN_MOVED_FROM = 0x40
+    IN_MOVED_TO = 0x80
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    IN_DELETE_SELF = 0x400
+    IN_Q_OVERFLOW = 0x4000
+    IN_IGNORED = 0x8000
+    IN_ISDIR = 0x40000000
+
+    MASK = IN_CLOSE_WRITE | IN_ATTRIB | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+    EVENT = struct.Struct("iIII")
+
+    root: Path
+
+    _fd: int
+    _watches: Dict[int, Path]
+
+    def __init__(self, root: Path):
+        import ctypes
+        import ctypes.util
+
+        self.root = root
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c") or None, use_errno=True)
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+        self._watches = {}
+        self._add_tree(root)
+
+    def _add(self, path: Path):
+        """Watch a single directory."""
+
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(str(path)), self.MASK)
+        if wd >= 0:
+            self._watches[wd] = path
+
+    def _add_tree(self, root: Path) -> List[Path]:
+        """Watch a directory and everything under it, returning its files."""
+
+        files = []
+        for directory, directories, names in os.walk(root):
+            directories[:] = [name for name in directories if not ignored(Path(directory, name), self.root)]
+            self._add(Path(directory))
+            files.extend(Path(directory, name) for name in names)
+        return files
+
+    def read(self, timeout: Optional[float]) -> List[Path]:
+        """Wait up to the timeout for changed paths."""
+
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return []
+
+        try:
+            data = os.read(self._fd, 1 << 16)
+        except BlockingIOError:
+            return []
+
+        changed = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = self.EVENT.unpack_from(data, offset)
+            offset += self.EVENT.size
+            name = data[offset:offset + length].rstrip(b"\0")
+            offset += length
+
+            if mask & self.IN_Q_OVERFLOW:
+                log.warning("watch event queue overflowed, treating everything as changed")
+                changed.append(self.root)
+                continue
+            if mask & self.IN_IGNORED:
+                self._watches.pop(wd, None)
+                continue
+
+            directory = self._watches.get(wd)
+            if directory is None:
+                continue
+            path = directory.joinpath(os.fsdecode(name)) if name else directory
+            if mask & self.IN_ISDIR and mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                changed.extend(self._add_tree(path))
+            changed.append(path)
+        return changed
+
+    def close(self):
+        """Release the inotify descriptor."""
+
+        os.close(self._fd)
+
+
+class PollingBackend:
+    """Detect changes by periodically comparing file stats."""
+
+    root: Path
+    interval: float
+
+    _snapshot: Dict[Path, Tuple[int, int]]
+
+    def __init__(self, root: Path, interval: float = 0.25):
+        self.root = root
+        self.interval = interval
+        self._snapshot = self._scan()
+
+    def _scan(self) -> Dict[Path, Tuple[int, int]]:
+        """Stat every file in the tree."""
+
+        snapshot = {}
+        for directory, directories, names in os.walk(self.root):
+            directories[:] = [name for name in directories if not ignored(Path(directory, name), self.root)]
+            for name in names:
+                path = Path(directory, name)
+                try:
+                    stat = path.stat()
+                except FileNotFoundError:
+                    continue
+                snapshot[path] = (stat.st_mtime_ns, stat.st_size)
+        return snapshot
+
+    def read(self, timeout: Optional[float]) -> List[Path]:
+        """Wait up to the timeout, then report what differs."""
+
+        time.sleep(min(self.interval, timeout) if timeout is not None else self.interval)
+        snapshot = self._scan()
+        changed = [path for path, stamp in snapshot.items() if self._snapshot.get(path) != stamp]
+        changed.extend(path for path in self._snapshot if path not in snapshot)
+        self._snapshot = snapshot
+        return changed
+
+    def close(self):
+        """Nothing to release."""
+
+
+def create_backend(root: Path, polling: bool = False):
+    """Use inotify where available, otherwise poll."""
+
+    if not polling:
+        try:
+            return InotifyBackend(root)
+        except (OSError, AttributeError) as error:
+            log.info(f"inotify unavailable, polling for changes instead: {error}")
+    return PollingBackend(root)
+
+
+class Watcher:
+    """Rebuild affected artifacts whenever the material changes.
+
+    Changes are collected until nothing has changed for the debounce
+    period, so a burst of saves results in a single rebuild, but never
+    held longer than the maximum delay. Each rebuild receives one
+    Affected entry per assignment describing which artifacts of the
+    assignment and of each of its problems need rebuilding.
+    """
+
+    material_path: Path
+    rebuild: Callable[[List[Affected]], None]
+    debounce: float
+    max_delay: float
+
+    _backend: object
+    _stopping: threading.Event
+
+    def __init__(
+            self,
+            material_path: Path,
+            rebuild: Callable[[List[Affected]], None],
+            debounce: float = 0.05,
+            max_delay: float = 0.5,
+            polling: bool = False):
+        self.material_path = material_path
+        self.rebuild = rebuild
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self._backend = create_backend(material_path, polling=polling)
+        self._stopping = threading.Event()
+
+    def _flush(self, paths: Iterable[Path]):
+        """Classify, group and rebuild."""
+
+        changes = [classify(self.material_path, path) for path in paths]
+        affected = group(self.material_path, changes)
+        if not affected:
+            return
+
+        log.info(f"rebuilding {len(affected)} assignments after {len(changes)} changes")
+        try:
+            self.rebuild(affected)
+        except Exception:
+            log.exception("rebuild failed, waiting for further changes")
+
+    def run(self):
+        """Watch until stopped."""
+
+        pending: Set[Path] = set()
+        first = last = 0.0
+        try:
+            while not self._stopping.is_set():
+                timeout = self.debounce if pending else 0.5
+                paths = [path for path in self._backend.read(timeout) if not ignored(path, self.material_path)]
+                now = time.monotonic()
+                if paths:
+                    if not pending:
+                        first = now
+                    pending.update(paths)
+                    last = now
+                    if now - first < self.max_delay:
+                        continue
+                if pending and (now - last >= self.debounce or now - first >= self.max_delay):
+                    self._flush(pending)
+                    pending = set()
+        finally:
+            self._backend.close()
+
+    def stop(self):
+        """Return from run after the current wait."""
+
+        self._stopping.set()